@@ -0,0 +1,16 @@
+"""
+EasyCloud offline benchmarks. The monitoring pipeline (Monitor, RuleEngine and
+Agent) is executed against a simulated cloud provider, whose latency and error
+rate are configurable, so that its performance can be measured without using
+a real platform.
+Usage (from the EasyCloud root directory): python3 -m benchmarks.run --help
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
@@ -0,0 +1,264 @@
+"""
+EasyCloud simulated cloud provider, used by the benchmarks. It provides a
+configuration manager holding the options of a scenario, a Monitor fetching
+synthetic measurements and a Manager executing fake actions, each call
+having a configurable latency and error rate.
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+import collections
+import datetime
+import random
+import threading
+import time
+
+from configparser import SafeConfigParser
+from core.actionbinder import bind_action
+from core.metaconfmanager import MetaConfManager
+from core.metamonitor import MetaMonitor
+
+# Options used if not specified by the scenario (same meaning of the [options]
+# section of the modules settings.cfg)
+DEFAULT_OPTIONS = {"monitor_fetch_period": 60,
+                   "granularity": 60,
+                   "window_size": 1,
+                   "minimum_positive": 1,
+                   "monitor_workers": 32,
+                   "agent_workers": 4}
+
+# Threshold of the rule used by the benchmarks: the measurements of the "hot"
+# instances are always above it, the ones of the other instances always below
+CPU_LOAD_THRESHOLD = 60.0
+BENCHMARK_RULES = [{"name": "cpu_load_gt_60%", "target": "cpu_load", "operator": ">",
+                    "threshold": CPU_LOAD_THRESHOLD, "action": "clone"}]
+
+
+class FakeCloud:
+
+    def __init__(self, instances, latency=0.005, error_rate=0.0, hot_ratio=0.1, action_latency=0.01, seed=None):
+        """
+        Init method
+
+        Args:
+            instances (int): the number of synthetic instances
+            latency (float): the average latency (in seconds) of a metric fetch
+            error_rate (float): the probability of a metric fetch (or an action) to fail
+            hot_ratio (float): the fraction of instances whose measurements trigger the rule
+            action_latency (float): the average latency (in seconds) of an action
+            seed (int): the seed of the random generator (None for a random seed)
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.action_latency = action_latency
+        self._random = random.Random(seed)
+        self.instance_ids = ["i-%08d" % _index for _index in range(instances)]
+        self.hot_instances = set(self._random.sample(self.instance_ids, int(instances * hot_ratio)))
+        # Fetch times of the measurements that will trigger an action, in the form
+        # {<instance_id>: deque(<time>)}, and latencies from fetch to action
+        self._triggers = collections.defaultdict(collections.deque)
+        self.action_latencies = []
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.triggers = 0
+        self.actions = 0
+        self.action_errors = 0
+        self._lock = threading.Lock()
+
+    def call(self, latency):
+        """
+        Simulate a call to the provider
+
+        Args:
+            latency (float): the average latency of the call
+
+        Returns:
+            bool: True if the call succeeded, False if it failed
+        """
+        if latency > 0:
+            time.sleep(latency * (0.5 + self._random.random()))
+        return self._random.random() >= self.error_rate
+
+    def fetch(self, instance_id, limit, granularity, batched=False):
+        """
+        Fetch the CPU load measurements of an instance
+
+        Args:
+            instance_id (str): the instance id
+            limit (int): the number of measurements
+            granularity (int): the distance in seconds between two measurements
+            batched (bool): the measurements are part of a batch call already simulated
+
+        Returns:
+            tuple[]: the measurements, as (timestamp, value) pairs
+
+        Raises:
+            IOError: if the call fails
+        """
+        _succeeded = batched or self.call(self.latency)
+        with self._lock:
+            self.fetches += 1
+            if not _succeeded:
+                self.fetch_errors += 1
+                raise IOError("simulated provider error")
+            if instance_id in self.hot_instances:
+                self.triggers += 1
+                self._triggers[instance_id].append(time.time())
+        _now = datetime.datetime.utcnow()
+        _hot = instance_id in self.hot_instances
+        return [(_now - datetime.timedelta(seconds=granularity * (limit - 1 - _index)),
+                 self._random.uniform(CPU_LOAD_THRESHOLD + 1, 100) if _hot else self._random.uniform(0, CPU_LOAD_THRESHOLD - 1))
+                for _index in range(limit)]
+
+    def execute(self, instance_id):
+        """
+        Execute an action on an instance, recording the time elapsed since the fetch
+        of the measurements that triggered it
+
+        Args:
+            instance_id (str): the instance id
+
+        Returns:
+            bool: True if the action succeeded
+
+        Raises:
+            IOError: if the call fails
+        """
+        _succeeded = self.call(self.action_latency)
+        with self._lock:
+            self.actions += 1
+            if len(self._triggers[instance_id]) > 0:
+                self.action_latencies.append(time.time() - self._triggers[instance_id].popleft())
+            if not _succeeded:
+                self.action_errors += 1
+                raise IOError("simulated provider error")
+        return True
+
+
+class BenchmarkConfManager(MetaConfManager):
+
+    def __init__(self, **options):
+        """
+        Init method. The options are read from a dictionary instead of a settings.cfg file
+
+        Args:
+            options (dict): the options of the scenario (see DEFAULT_OPTIONS)
+        """
+        self.platform = "benchmark"
+        self.parser = SafeConfigParser()
+        _options = dict(DEFAULT_OPTIONS)
+        _options.update(options)
+        self.parser.read_dict({"options": {_name: str(_value) for _name, _value in _options.items()}})
+        self.read_login_data()
+        self.read_platform_options()
+        self.read_options()
+
+    def read_login_data(self):
+        pass
+
+    def read_platform_options(self):
+        pass
+
+
+class FakeMonitor(MetaMonitor):
+
+    # Maximum number of instances fetched with a single batch call
+    MAX_BATCH_INSTANCES = 500
+
+    def __init__(self, conf, commands_queue, measurements_queue, cloud):
+        """
+        Init method
+
+        Args:
+            conf (MetaConfManager): a configuration manager holding all the settings
+                                    for the Monitor
+            commands_queue (Queue): message queue for receiving commands regarding the
+                                    instances to observe
+            measurements_queue (Queue): message queue for sending measurements to
+                                        the RuleEngine
+            cloud (FakeCloud): the simulated provider
+        """
+        self.cloud = cloud
+        super().__init__(conf, commands_queue, measurements_queue)
+        self._bind_generic_metric_to_getter(name="cpu_load", function=self._get_cpu_measures)
+
+    def connect(self):
+        pass
+
+    def _get_cpu_measures(self, instance_id, granularity, limit):
+        return self._get_metric_values(instance_id, "cpu_load", granularity, limit)
+
+    def _build_messages(self, measurements):
+        return [self._build_message(timestamp=_timestamp, value=_value, unit="Percent") for _timestamp, _value in measurements]
+
+    def _get_metric_values(self, instance_id, metric, granularity, limit):
+        """
+        Simulated measurements getter
+
+        Args:
+            instance_id (str): The id of the instance to fetch the measurements
+            metric (str): The metric name
+            granularity (int): The granularity of the measurements fetched, expressed in seconds
+            limit (int): The maximum number of measurements returned
+
+        Returns:
+            dict[]: The measurements
+        """
+        return self._build_messages(self.cloud.fetch(instance_id, limit, granularity))
+
+    def _get_batch_samples(self, instance_ids, metric_names, limit, granularity):
+        """
+        Simulated batch getter: a call for every MAX_BATCH_INSTANCES instances
+        (the instances of a failed call are fetched again one by one)
+
+        Args:
+            instance_ids (str[]): The ids of the instances to fetch the measurements
+            metric_names (str[]): The *generic* metrics names
+            limit (int): The maximum number of measurements returned for each metric
+            granularity (int): The granularity of the measurements fetched, expressed in seconds
+
+        Returns:
+            dict: A structure in the form {<instance_id>: {<metric_name>: [<measurement>, ...]}}
+        """
+        _batch = {}
+        if "cpu_load" not in metric_names:
+            return _batch
+        for _start in range(0, len(instance_ids), self.MAX_BATCH_INSTANCES):
+            if not self.cloud.call(self.cloud.latency):
+                continue
+            for _instance_id in instance_ids[_start:_start + self.MAX_BATCH_INSTANCES]:
+                _batch[_instance_id] = {"cpu_load": self._build_messages(self.cloud.fetch(_instance_id, limit, granularity,
+                                                                                          batched=True))}
+        return _batch
+
+
+class FakeManager:
+
+    def __init__(self, conf, cloud):
+        """
+        Init method
+
+        Args:
+            conf (MetaConfManager): a configuration manager holding all the settings
+            cloud (FakeCloud): the simulated provider
+        """
+        self.platform_name = "Benchmark"
+        self.conf = conf
+        self.cloud = cloud
+
+    @bind_action("FakeManager", "clone")
+    def clone_instance(self, instance_id):
+        """
+        Simulated clone action
+
+        Args:
+            instance_id (str): The id of the instance to clone
+        """
+        return self.cloud.execute(instance_id)
@@ -0,0 +1,218 @@
+"""
+EasyCloud benchmark runner. For each number of instances, the Monitor sweeps
+the simulated provider while the RuleEngine and the Agent run in their own
+threads, connected through the same queues used by the MetaManager; then the
+sweep time, the latency from metric fetch to action, the throughput and the
+memory use are reported.
+
+Example: python3 -m benchmarks.run --instances 10 100 1000 10000 --latency 0.01
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+import argparse
+import json
+import logging
+import time
+import tracemalloc
+
+from benchmarks.fakecloud import BENCHMARK_RULES, BenchmarkConfManager, FakeCloud, FakeManager, FakeMonitor
+from concurrent.futures import ThreadPoolExecutor
+from core.actioncoalescer import ActionCoalescer
+from core.metaagent import MetaAgent
+from core.ruleengine import RuleEngine
+from core.shardedruleengine import ShardedRuleEngine
+from queue import Queue
+from threading import Thread
+
+
+def percentile(values, q):
+    """
+    Return a percentile of a list of values (nearest rank)
+
+    Args:
+        values (float[]): the values
+        q (float): the percentile (between 0 and 100)
+
+    Returns:
+        float: the percentile, None if the list is empty
+    """
+    if len(values) == 0:
+        return None
+    _sorted = sorted(values)
+    return _sorted[min(len(_sorted) - 1, max(0, int(round(q / 100.0 * len(_sorted))) - 1))]
+
+
+def run_scenario(instances, sweeps, cloud_options, options, drain_timeout=60, trace_memory=False):
+    """
+    Execute the monitoring pipeline on a simulated provider
+
+    Args:
+        instances (int): the number of synthetic instances
+        sweeps (int): the number of sweeps performed by the Monitor
+        cloud_options (dict): the parameters of the FakeCloud (latency, error_rate, ...)
+        options (dict): the EasyCloud options (monitor_workers, agent_workers, ...)
+        drain_timeout (float): the maximum number of seconds to wait for the actions
+                               after the last sweep
+        trace_memory (bool): measure the peak of memory allocated (slows down the execution)
+
+    Returns:
+        dict: the results of the scenario
+    """
+    conf = BenchmarkConfManager(**options)
+    cloud = FakeCloud(instances, **cloud_options)
+    # Same queues created by MetaManager.start_monitor
+    monitor_cmd_queue = Queue()
+    measurements_queue = Queue()
+    re_cmd_queue = Queue()
+    agent_cmd_queue = Queue()
+    if conf.action_coalescing:
+        agent_cmd_queue = ActionCoalescer(agent_cmd_queue, cooldown=conf.action_cooldown)
+    results_queue = Queue()
+    if trace_memory:
+        tracemalloc.start()
+    monitor = FakeMonitor(conf=conf, commands_queue=monitor_cmd_queue, measurements_queue=measurements_queue, cloud=cloud)
+    if conf.rule_engine_shards > 1:
+        rule_engine = ShardedRuleEngine(conf=conf, commands_queue=re_cmd_queue, measurements_queue=measurements_queue,
+                                        agent_queue=agent_cmd_queue, shards=conf.rule_engine_shards)
+    else:
+        rule_engine = RuleEngine(conf=conf, commands_queue=re_cmd_queue, measurements_queue=measurements_queue,
+                                 agent_queue=agent_cmd_queue)
+    agent = MetaAgent(commands_queue=agent_cmd_queue, manager=FakeManager(conf, cloud), workers=conf.agent_workers,
+                      action_limits=conf.agent_action_limits, results_queue=results_queue)
+    _threads = [Thread(target=rule_engine.run, daemon=True), Thread(target=agent.run, daemon=True)]
+    for _thread in _threads:
+        _thread.start()
+    re_cmd_queue.put({"command": "init", "rules": BENCHMARK_RULES})
+    for _rule in BENCHMARK_RULES:
+        re_cmd_queue.put({"command": "enable_rule", "rule_name": _rule["name"]})
+    for _instance_id in cloud.instance_ids:
+        monitor_cmd_queue.put({"command": "add", "instance_id": _instance_id})
+    # Sweeps (with the same workers pool created by MetaMonitor.run)
+    if conf.monitor_workers > 1:
+        monitor._executor = ThreadPoolExecutor(max_workers=conf.monitor_workers)
+    _sweep_times = []
+    _start = time.time()
+    try:
+        for _sweep in range(sweeps):
+            _sweep_start = time.time()
+            monitor._check_commands()
+            monitor._sweep()
+            _sweep_times.append(time.time() - _sweep_start)
+    finally:
+        if monitor._executor is not None:
+            monitor._executor.shutdown(wait=False)
+            monitor._executor = None
+    _sweeps_end = time.time()
+    # Wait for the actions triggered by the last sweep (each measurement of a hot instance
+    # triggers an action, unless the identical actions are coalesced)
+    _results = 0
+    _drained = False
+    _last_result = time.time()
+    _deadline = time.time() + drain_timeout
+    while not _drained and time.time() < _deadline:
+        while not results_queue.empty():
+            results_queue.get()
+            _results += 1
+            _last_result = time.time()
+        if conf.action_coalescing:
+            _drained = measurements_queue.empty() and agent_cmd_queue.empty() and time.time() - _last_result > 1
+        else:
+            _drained = _results >= cloud.triggers
+        time.sleep(0.01)
+    _end = time.time()
+    _memory_peak = None
+    if trace_memory:
+        _memory_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    rule_engine.stop()
+    agent.stop()
+    for _thread in _threads:
+        _thread.join(5)
+    return {"instances": instances,
+            "sweeps": sweeps,
+            "sweep_mean": sum(_sweep_times) / len(_sweep_times),
+            "sweep_max": max(_sweep_times),
+            "latency_p50": percentile(cloud.action_latencies, 50),
+            "latency_p95": percentile(cloud.action_latencies, 95),
+            "latency_max": max(cloud.action_latencies) if len(cloud.action_latencies) > 0 else None,
+            "measurements_per_second": instances * sweeps / (_sweeps_end - _start),
+            "actions": cloud.actions,
+            "actions_per_second": cloud.actions / (_end - _start),
+            "fetch_errors": cloud.fetch_errors,
+            "action_errors": cloud.action_errors,
+            "memory_peak": _memory_peak,
+            "drained": _drained}
+
+
+def print_report(results):
+    """
+    Print the results of the scenarios as a table
+
+    Args:
+        results (dict[]): the results returned by run_scenario
+    """
+    def _seconds(value):
+        return "-" if value is None else "%.3fs" % value
+    _header = ["Instances", "Sweep (mean)", "Sweep (max)", "Latency p50", "Latency p95", "Latency max",
+               "Measurements/s", "Actions", "Actions/s", "Errors", "Memory peak"]
+    _rows = [_header]
+    for _result in results:
+        _rows.append([str(_result["instances"]),
+                      _seconds(_result["sweep_mean"]),
+                      _seconds(_result["sweep_max"]),
+                      _seconds(_result["latency_p50"]),
+                      _seconds(_result["latency_p95"]),
+                      _seconds(_result["latency_max"]),
+                      "%.1f" % _result["measurements_per_second"],
+                      str(_result["actions"]) + ("" if _result["drained"] else " (timeout)"),
+                      "%.1f" % _result["actions_per_second"],
+                      str(_result["fetch_errors"] + _result["action_errors"]),
+                      "-" if _result["memory_peak"] is None else "%.1f MB" % (_result["memory_peak"] / 1048576.0)])
+    _widths = [max(len(_row[_index]) for _row in _rows) for _index in range(len(_header))]
+    for _row in _rows:
+        print("  ".join(_cell.ljust(_width) for _cell, _width in zip(_row, _widths)))
+
+
+def main():
+    """
+    Parse the command line and execute the scenarios
+    """
+    parser = argparse.ArgumentParser(description="EasyCloud offline benchmarks (simulated cloud provider)")
+    parser.add_argument("--instances", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="numbers of synthetic instances, one scenario each (default: 10 100 1000 10000)")
+    parser.add_argument("--sweeps", type=int, default=3, help="sweeps performed in each scenario (default: 3)")
+    parser.add_argument("--latency", type=float, default=0.005, help="average latency of a metric fetch in seconds (default: 0.005)")
+    parser.add_argument("--action-latency", type=float, default=0.01, help="average latency of an action in seconds (default: 0.01)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a provider call to fail (default: 0)")
+    parser.add_argument("--hot-ratio", type=float, default=0.1, help="fraction of instances triggering an action (default: 0.1)")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the random generator")
+    parser.add_argument("--option", action="append", default=[], metavar="NAME=VALUE",
+                        help="EasyCloud option, as in the [options] section of settings.cfg (e.g. monitor_workers=64)")
+    parser.add_argument("--memory", action="store_true", help="measure the peak of memory allocated (slower)")
+    parser.add_argument("--json", metavar="FILE", help="also write the results to a JSON file")
+    parser.add_argument("--log-level", default="CRITICAL", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                        help="log level (default: CRITICAL, the simulated errors are not logged)")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    options = dict(_option.split("=", 1) for _option in args.option)
+    cloud_options = {"latency": args.latency, "action_latency": args.action_latency, "error_rate": args.error_rate,
+                     "hot_ratio": args.hot_ratio, "seed": args.seed}
+    results = []
+    for _instances in args.instances:
+        results.append(run_scenario(_instances, args.sweeps, cloud_options, options, trace_memory=args.memory))
+    print_report(results)
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
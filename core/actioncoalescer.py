@@ -0,0 +1,145 @@
+"""
+EasyCloud ActionCoalescer component, placed between the RuleEngine and the
+MetaAgent. While a rule stays satisfied the RuleEngine sends the same action
+for the same instance at every sweep: the coalescer forwards an action only if
+an identical one is not already waiting or in progress, and if the previous one
+has been completed at least action_cooldown seconds ago.
+The MetaAgent must release each action once completed.
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+import collections
+import logging
+import threading
+import time
+
+
+class ActionCoalescer:
+
+    def __init__(self, queue, cooldown=0):
+        """
+        Init method
+
+        Args:
+            queue (Queue): message queue used for sending the admitted actions to the Agent
+            cooldown (int): minimum number of seconds between the completion of an action
+                            and the admission of an identical one
+        """
+        self.queue = queue
+        self.cooldown = cooldown
+        # (instance_id, action) pairs waiting or in progress
+        self._pending = set()
+        # Completion time of the last action of each (instance_id, action) pair
+        self._last_completed = {}
+        # Counters
+        self.admitted = 0
+        self.suppressed_pending = 0
+        self.suppressed_cooldown = 0
+        self.suppressed_by_action = collections.Counter()
+        self._lock = threading.Lock()
+
+    def put(self, command):
+        """
+        Send an action to the Agent, unless it must be suppressed
+
+        Args:
+            command (dict): The command, in the form {"instance_id": <id>, "action": <action>}
+        """
+        if self.admit(command):
+            self.queue.put(command)
+
+    def admit(self, command):
+        """
+        Check if an action can be sent to the Agent, marking it as pending if so
+
+        Args:
+            command (dict): The command, in the form {"instance_id": <id>, "action": <action>}
+
+        Returns:
+            bool: True if the action can be sent, False if it must be suppressed
+        """
+        _key = (command["instance_id"], command["action"])
+        with self._lock:
+            if _key in self._pending:
+                self.suppressed_pending += 1
+                self.suppressed_by_action[command["action"]] += 1
+                logging.debug("[" + self.__class__.__name__ + "] Action " + command["action"] + " for instance " +
+                              command["instance_id"] + " suppressed (an identical action is pending)")
+                return False
+            if _key in self._last_completed and time.time() - self._last_completed[_key] < self.cooldown:
+                self.suppressed_cooldown += 1
+                self.suppressed_by_action[command["action"]] += 1
+                logging.debug("[" + self.__class__.__name__ + "] Action " + command["action"] + " for instance " +
+                              command["instance_id"] + " suppressed (cooldown)")
+                return False
+            self._pending.add(_key)
+            self.admitted += 1
+            return True
+
+    def release(self, command):
+        """
+        Mark an action as completed, starting its cooldown
+
+        Args:
+            command (dict): The command, in the form {"instance_id": <id>, "action": <action>}
+        """
+        _key = (command["instance_id"], command["action"])
+        with self._lock:
+            self._pending.discard(_key)
+            self._last_completed[_key] = time.time()
+
+    def get_stats(self):
+        """
+        Return the number of actions admitted and suppressed
+
+        Returns:
+            dict: the counters, in the form {"admitted": <n>, "suppressed_pending": <n>,
+                  "suppressed_cooldown": <n>, "suppressed_by_action": {<action>: <n>}}
+        """
+        with self._lock:
+            return {"admitted": self.admitted,
+                    "suppressed_pending": self.suppressed_pending,
+                    "suppressed_cooldown": self.suppressed_cooldown,
+                    "suppressed_by_action": dict(self.suppressed_by_action)}
+
+    def get(self, block=True, timeout=None):
+        """
+        Return the next admitted action (same behavior of queue.Queue.get)
+
+        Args:
+            block (bool): wait for an action if none is available
+            timeout (float): the maximum number of seconds to wait (None waits forever)
+
+        Returns:
+            dict: the command, in the form {"instance_id": <id>, "action": <action>}
+
+        Raises:
+            Empty: if no action is available (immediately or before the timeout)
+        """
+        return self.queue.get(block=block, timeout=timeout)
+
+    def empty(self):
+        """
+        Check if no admitted action is waiting for the Agent
+
+        Returns:
+            bool: True if the queue of the admitted actions is empty
+        """
+        return self.queue.empty()
+
+    def qsize(self):
+        """
+        Return the number of admitted actions waiting for the Agent
+
+        Returns:
+            int: the (approximate) size of the queue of the admitted actions
+        """
+        return self.queue.qsize()
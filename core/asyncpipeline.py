@@ -0,0 +1,370 @@
+"""
+EasyCloud AsyncPipeline, an alternative to the three threads (Monitor, RuleEngine
+and Agent) started by the MetaManager. All the stages are executed as coroutines
+on a single event loop, exchanging the same messages through asyncio queues:
+no stage polls its queues, so each message is handled as soon as it is available.
+The platform SDKs are synchronous, so every blocking call (metric fetches and
+actions) is executed by a pool of threads, while the loop keeps track of all
+the requests in progress. The actions respect the same limits applied by the
+MetaAgent (agent_workers and agent_action_limits), on a dedicated pool.
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+import asyncio
+import collections
+import functools
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from core.instrumentation import SWEEP_DURATION
+
+
+class LoopQueue:
+    """
+    An asyncio.Queue owned by an event loop, that can be fed by any thread using
+    the put method (same interface of queue.Queue used by the pipeline components)
+    """
+
+    def __init__(self, loop):
+        """
+        Init method
+
+        Args:
+            loop (AbstractEventLoop): the event loop owning the queue
+        """
+        self._loop = loop
+        self._queue = None
+
+    @property
+    def queue(self):
+        """
+        Return the asyncio.Queue (it must be accessed only by the loop thread)
+
+        Returns:
+            asyncio.Queue: the queue
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    def put(self, item):
+        """
+        Put an item in the queue (thread-safe, the order of the items is preserved)
+
+        Args:
+            item (object): the item
+        """
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._put_nowait, item)
+
+    def _put_nowait(self, item):
+        self.queue.put_nowait(item)
+
+    def qsize(self):
+        """
+        Return the number of items in the queue
+
+        Returns:
+            int: the (approximate) size of the queue
+        """
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def empty(self):
+        """
+        Check if the queue is empty
+
+        Returns:
+            bool: True if the queue is empty
+        """
+        return self.qsize() == 0
+
+
+class AsyncPipeline:
+
+    def __init__(self, conf):
+        """
+        Init method. The queues used by the components must be taken from this object
+        before creating them, then the components must be bound using the bind method
+
+        Args:
+            conf (MetaConfManager): a configuration manager holding all the settings
+                                    for the pipeline
+        """
+        self.conf = conf
+        self._loop = asyncio.new_event_loop()
+        # Queues connecting the stages
+        self.rule_engine_commands_queue = LoopQueue(self._loop)
+        self.measurements_queue = LoopQueue(self._loop)
+        self.agent_queue = LoopQueue(self._loop)
+        self.monitor = None
+        self.rule_engine = None
+        self.agent = None
+        # Objects created inside the loop
+        self._executor = None
+        self._semaphore = None
+        self._stop_event = None
+        self._agent_executor = None
+        self._agent_semaphore = None
+        self._actions_semaphores = {}
+        self._instances_locks = collections.defaultdict(asyncio.Lock)
+        self._stop = False
+
+    def bind(self, monitor, rule_engine, agent):
+        """
+        Bind the components executed by the pipeline
+
+        Args:
+            monitor (MetaMonitor): the platform monitor, using measurements_queue
+            rule_engine (RuleEngine): the RuleEngine, using rule_engine_commands_queue,
+                                      measurements_queue and agent_queue
+            agent (MetaAgent): the platform agent, using agent_queue
+        """
+        self.monitor = monitor
+        self.rule_engine = rule_engine
+        self.agent = agent
+
+    def run(self):
+        """
+        Execute the pipeline until stop is called
+        """
+        logging.debug("[" + self.__class__.__name__ + "] Pipeline started")
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+            logging.debug("[" + self.__class__.__name__ + "] Pipeline stopped")
+
+    def stop(self):
+        """
+        Stop the pipeline (can be called by any thread)
+        """
+        self._stop = True
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake_up)
+
+    def _wake_up(self):
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    async def _main(self):
+        """
+        Start all the stages and cancel them when the pipeline is stopped
+        """
+        self._stop_event = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.conf.pipeline_concurrency)
+        self._semaphore = asyncio.Semaphore(self.conf.pipeline_concurrency)
+        self._agent_executor = ThreadPoolExecutor(max_workers=self.conf.agent_workers)
+        self._agent_semaphore = asyncio.Semaphore(self.conf.agent_workers)
+        # Actions without a limit are limited only by agent_workers, as in the MetaAgent
+        self._actions_semaphores = collections.defaultdict(lambda: asyncio.Semaphore(self.conf.agent_workers))
+        for _action, _limit in self.conf.agent_action_limits.items():
+            self._actions_semaphores[_action] = asyncio.Semaphore(_limit)
+        _stages = [asyncio.ensure_future(self._monitor_stage()),
+                   asyncio.ensure_future(self._rule_engine_stage()),
+                   asyncio.ensure_future(self._agent_stage())]
+        if not self._stop:
+            await self._stop_event.wait()
+        for _stage in _stages:
+            _stage.cancel()
+        await asyncio.gather(*_stages, return_exceptions=True)
+        self.rule_engine._stop_pool()
+        self._executor.shutdown(wait=False)
+        self._agent_executor.shutdown(wait=False)
+
+    def _run_blocking(self, function, *args, **kwargs):
+        """
+        Execute a blocking function in the threads pool
+
+        Args:
+            function (function): the function to execute
+
+        Returns:
+            Future: an awaitable returning the function result
+        """
+        return self._loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    # =============================================================================================== #
+    #                                             Monitor                                             #
+    # =============================================================================================== #
+
+    async def _monitor_stage(self):
+        """
+        Fetch the measurements of all the monitored instances every monitor_fetch_period
+        seconds, with all the fetches of a sweep in progress at the same time
+        (up to pipeline_concurrency)
+        """
+        while not self._stop:
+            _sweep_start = time.time()
+            try:
+                self.monitor._check_commands()
+                self._prune_instances_locks()
+                await self._sweep()
+                self.monitor._instrumentation.observe(SWEEP_DURATION, time.time() - _sweep_start)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("[" + self.__class__.__name__ + "] An exception has occourred during the sweep: " + str(e))
+            _sleep_time = max(0, self.conf.monitor_fetch_period - (time.time() - _sweep_start))
+            logging.debug("[" + self.__class__.__name__ + "] Sleeping for " + str(_sleep_time) + " seconds...")
+            await asyncio.sleep(_sleep_time)
+
+    def _prune_instances_locks(self):
+        """
+        Forget the locks of the instances no longer monitored (the ones held by an
+        action in progress are kept until the next sweep)
+        """
+        for _instance_id in [_instance_id for _instance_id, _lock in self._instances_locks.items()
+                             if _instance_id not in self.monitor._monitored_instances and not _lock.locked()]:
+            del self._instances_locks[_instance_id]
+
+    async def _sweep(self):
+        """
+        Fetch the measurements of all the monitored metrics for each monitored instance
+        and send a message for each instance to the RuleEngine stage
+        """
+        _deadline = time.time() + self.conf.monitor_sweep_timeout
+        _instances = list(self.monitor._monitored_instances)
+        _prefetched = {}
+        if self.conf.monitor_batch_fetch and len(_instances) > 0:
+            _prefetched = await self._run_blocking(self.monitor._batch_sweep, _instances)
+        await asyncio.gather(*[self._fetch_instance(_instance, _deadline, _prefetched.get(_instance, {}))
+                               for _instance in _instances])
+
+    async def _fetch_instance(self, instance_id, deadline, prefetched):
+        """
+        Fetch all the monitored metrics of an instance and send its message
+
+        Args:
+            instance_id (str): The instance id
+            deadline (float): UNIX time after which the pending fetches are abandoned
+            prefetched (dict): The measurements of the instance already fetched, in
+                               the form {<metric_name>: <samples>}
+        """
+        _metrics_samples = await asyncio.gather(*[self._fetch_metric(instance_id, _metric_name, deadline, prefetched)
+                                                  for _metric_name in self.monitor._monitored_metrics])
+        self.monitor._send_measurements(instance_id, _metrics_samples)
+
+    async def _fetch_metric(self, instance_id, metric_name, deadline, prefetched):
+        """
+        Fetch the measurements of a metric of an instance
+
+        Args:
+            instance_id (str): The instance id
+            metric_name (str): The *generic* metric name
+            deadline (float): UNIX time after which the fetch is abandoned
+            prefetched (dict): The measurements of the instance already fetched
+
+        Returns:
+            dict: A structure in the format returned by MetaMonitor._get_samples
+        """
+        if metric_name in prefetched:
+            return prefetched[metric_name]
+        async with self._semaphore:
+            _timeout = deadline - time.time()
+            if _timeout <= 0:
+                return self.monitor._timeout_samples(metric_name)
+            try:
+                return await asyncio.wait_for(
+                    self._run_blocking(self.monitor._get_samples_safe, instance_id=instance_id, metric_name=metric_name,
+                                       limit=self.monitor._fetch_limit(instance_id, metric_name),
+                                       granularity=self.conf.granularity),
+                    timeout=_timeout)
+            except asyncio.TimeoutError:
+                return self.monitor._timeout_samples(metric_name)
+
+    # =============================================================================================== #
+    #                                           RuleEngine                                            #
+    # =============================================================================================== #
+
+    async def _rule_engine_stage(self):
+        """
+        Evaluate the rules on each message as soon as it is received. Commands
+        regarding the rules are applied as soon as they are received, and always
+        before the next message
+        """
+        _commands = self.rule_engine_commands_queue.queue
+        _measurements = self.measurements_queue.queue
+        # Wait for the init message
+        while True:
+            message = await _commands.get()
+            if "command" in message and message["command"] == "init" and "rules" in message:
+                self.rule_engine._process_command(message)
+                logging.debug("[" + self.__class__.__name__ + "] Init message received!")
+                break
+        # Both queues are awaited, so that the commands are applied as soon as they are
+        # received (the get still pending is kept for the next iteration)
+        _command_get = None
+        _message_get = None
+        try:
+            while True:
+                if _command_get is None:
+                    _command_get = asyncio.ensure_future(_commands.get())
+                if _message_get is None:
+                    _message_get = asyncio.ensure_future(_measurements.get())
+                # Check the process pool frequently while some evaluations are in progress
+                _done, _ = await asyncio.wait({_command_get, _message_get}, return_when=asyncio.FIRST_COMPLETED,
+                                              timeout=0.1 if self.rule_engine._pending else None)
+                if len(_done) == 0:
+                    self.rule_engine._collect_results()
+                    continue
+                if _command_get in _done:
+                    self.rule_engine._process_command(_command_get.result())
+                    _command_get = None
+                if _message_get in _done:
+                    # Commands have priority over the message
+                    while not _commands.empty():
+                        self.rule_engine._process_command(_commands.get_nowait())
+                    self.rule_engine._process_message(_message_get.result())
+                    _message_get = None
+        finally:
+            for _get in (_command_get, _message_get):
+                if _get is not None:
+                    _get.cancel()
+
+    # =============================================================================================== #
+    #                                              Agent                                              #
+    # =============================================================================================== #
+
+    async def _agent_stage(self):
+        """
+        Execute each action as soon as it is received and the limits allow it. Actions
+        regarding different instances are executed concurrently (up to agent_workers
+        and agent_action_limits), the ones regarding the same instance are executed in order
+        """
+        _commands = self.agent_queue.queue
+        _actions = set()
+        try:
+            while True:
+                command = await _commands.get()
+                logging.debug("Command received: " + str(command))
+                _action = asyncio.ensure_future(self._execute_command(command))
+                _actions.add(_action)
+                _action.add_done_callback(_actions.discard)
+        finally:
+            for _action in _actions:
+                _action.cancel()
+
+    async def _execute_command(self, command):
+        """
+        Execute a command issued by the RuleEngine
+
+        Args:
+            command (dict): The command, in the form {"instance_id": <id>, "action": <action>}
+        """
+        async with self._instances_locks[command["instance_id"]], self._actions_semaphores[command["action"]], \
+                self._agent_semaphore:
+            try:
+                await self._loop.run_in_executor(self._agent_executor,
+                                                 functools.partial(self.agent._execute_and_report, command))
+            except Exception as e:
+                logging.error("An exception has occourred: " + str(e))
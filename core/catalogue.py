@@ -0,0 +1,266 @@
+"""
+EasyCloud Catalogue component, holding resources that change very rarely
+(e.g. the images or the instance types of a region) indexed by id. Each catalogue
+is shared by the whole process: it is listed from the platform only the first
+time it is used, then it is refreshed periodically by a background thread, so
+that the lookups never wait for a network call.
+Each catalogue is also stored on disk, so that a new process can start with the
+catalogues of the previous one and revalidate them in background.
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+import gzip
+import libcloud
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+
+# Directory and version of the catalogues stored on disk (files with a different
+# version, or stored by a different Libcloud version, are ignored)
+CATALOGUES_DIR = "cache"
+CATALOGUES_VERSION = 1
+
+# Catalogues created, in the form {(<platform>, <region>, <name>): <Catalogue>}
+_catalogues = {}
+_catalogues_lock = threading.Lock()
+
+
+def get_catalogue(platform, region, name, loader, key, refresh_interval, client=None, signature=""):
+    """
+    Return the catalogue of a platform region, creating it if it doesn't exist.
+    The catalogue is stored on disk only if the client is specified
+
+    Args:
+        platform (str): the platform name
+        region (str): the region name
+        name (str): the catalogue name (e.g. "sizes")
+        loader (function): a function without arguments listing the resources
+                           (it can be called by a background thread)
+        key (function): a function returning the id of a resource
+        refresh_interval (int): the number of seconds between two refreshes (0 or less
+                                lists the resources only once, see Catalogue)
+        client (function): a function returning the platform client, referenced by
+                           the resources read from disk
+        signature (str): the options used by the loader (e.g. the images filters),
+                         the resources stored with different options are ignored
+
+    Returns:
+        Catalogue: the catalogue
+    """
+    with _catalogues_lock:
+        _catalogue = _catalogues.get((platform, region, name))
+        if _catalogue is None:
+            _path = None
+            if client is not None:
+                _path = os.path.join(CATALOGUES_DIR, re.sub(r"[^\w.-]+", "_", platform + "_" + region + "_" + name).lower() + ".pkl.gz")
+            _catalogue = Catalogue(name=platform + "/" + region + "/" + name, loader=loader,
+                                   key=key, refresh_interval=refresh_interval,
+                                   path=_path, client=client, signature=signature)
+            _catalogues[(platform, region, name)] = _catalogue
+        return _catalogue
+
+
+class _CataloguePickler(pickle.Pickler):
+    """
+    Pickler storing a reference in place of the platform client
+    """
+
+    def __init__(self, file, client_type):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._client_type = client_type
+
+    def persistent_id(self, obj):
+        if isinstance(obj, self._client_type):
+            return "client"
+        return None
+
+
+class _CatalogueUnpickler(pickle.Unpickler):
+    """
+    Unpickler replacing the references to the platform client with the current one
+    """
+
+    def __init__(self, file, client):
+        super().__init__(file)
+        self._client = client
+
+    def persistent_load(self, pid):
+        if pid == "client":
+            return self._client
+        raise pickle.UnpicklingError("Unknown reference " + str(pid))
+
+
+class Catalogue:
+
+    def __init__(self, name, loader, key, refresh_interval, path=None, client=None, signature=""):
+        """
+        Init method
+
+        Args:
+            name (str): the catalogue name (used only for logging)
+            loader (function): a function without arguments listing the resources
+            key (function): a function returning the id of a resource
+            refresh_interval (int): the number of seconds between two refreshes. With 0 or
+                                    less the background refresh is disabled: the resources
+                                    are listed once, when first used, and the catalogue
+                                    stored on disk is never read
+            path (str): the file where the catalogue is stored (None disables the storage)
+            client (function): a function returning the platform client, referenced by
+                               the resources read from disk
+            signature (str): the options used by the loader
+        """
+        self.name = name
+        self._loader = loader
+        self._key = key
+        self.refresh_interval = refresh_interval
+        self._path = path
+        self._client = client
+        self._signature = signature
+        # Resources in the original order and indexed by id (replaced together on refresh)
+        self._resources = []
+        self._index = {}
+        self._loaded_at = None
+        self._load_lock = threading.Lock()
+        self._refresher = None
+
+    def get(self, resource_id):
+        """
+        Return a resource given its id
+
+        Args:
+            resource_id (object): the resource id
+
+        Returns:
+            object: the resource, None if it doesn't exist
+        """
+        self._ensure_loaded()
+        return self._index.get(resource_id)
+
+    def list(self):
+        """
+        Return all the resources
+
+        Returns:
+            object[]: the resources
+        """
+        self._ensure_loaded()
+        return list(self._resources)
+
+    def warm_up(self):
+        """
+        Read the catalogue stored on disk, if any, and start the background refresh,
+        which lists the resources immediately if they are missing or expired (nothing
+        is done if the background refresh is disabled)
+        """
+        if not self._refresh_enabled():
+            return
+        with self._load_lock:
+            if self._loaded_at is None:
+                self._read()
+            self._start_refresher()
+
+    def refresh(self):
+        """
+        List the resources from the platform, replacing the current ones
+        """
+        _resources = list(self._loader())
+        self._set_resources(_resources, time.time())
+        logging.debug("[" + self.__class__.__name__ + "] " + self.name + " refreshed (" + str(len(_resources)) + " items)")
+        self._write()
+
+    def _set_resources(self, resources, loaded_at):
+        _index = {}
+        for _resource in resources:
+            _index[self._key(_resource)] = _resource
+        self._resources, self._index = resources, _index
+        self._loaded_at = loaded_at
+
+    def _refresh_enabled(self):
+        return self.refresh_interval > 0
+
+    def _is_expired(self):
+        return self._loaded_at is None or time.time() - self._loaded_at >= self.refresh_interval
+
+    def _ensure_loaded(self):
+        """
+        Load the resources if it has never been done, and start the background refresh
+        """
+        if self._loaded_at is not None:
+            return
+        with self._load_lock:
+            if self._loaded_at is None and self._refresh_enabled():
+                self._read()
+            if self._loaded_at is None:
+                self.refresh()
+            self._start_refresher()
+
+    def _start_refresher(self):
+        if self._refresher is None and self._refresh_enabled():
+            self._refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        """
+        Background refresh loop
+        """
+        while True:
+            _attempt = 0
+            with self._load_lock:
+                if self._is_expired():
+                    _attempt = time.time()
+                    try:
+                        self.refresh()
+                    except Exception as e:
+                        logging.error("[" + self.__class__.__name__ + "] Unable to refresh " + self.name + ": " + str(e))
+            _next_refresh = max(self._loaded_at or 0, _attempt) + self.refresh_interval
+            time.sleep(max(0, _next_refresh - time.time()))
+
+    def _read(self):
+        """
+        Read the resources stored on disk, ignoring the ones stored by a different
+        version or with different options
+        """
+        if self._path is None or not os.path.isfile(self._path):
+            return
+        try:
+            with gzip.open(self._path, "rb") as file:
+                _stored = _CatalogueUnpickler(file, self._client()).load()
+            if (_stored["version"] != CATALOGUES_VERSION or _stored.get("libcloud_version") != libcloud.__version__ or
+                    _stored["signature"] != self._signature):
+                logging.debug("[" + self.__class__.__name__ + "] Ignoring outdated " + self._path)
+                return
+            self._set_resources(_stored["resources"], _stored["time"])
+            logging.debug("[" + self.__class__.__name__ + "] " + self.name + " read from " + self._path +
+                          " (" + str(len(self._resources)) + " items)")
+        except Exception as e:
+            logging.warning("[" + self.__class__.__name__ + "] Unable to read " + self._path + ": " + str(e))
+
+    def _write(self):
+        """
+        Store the resources on disk (the file is replaced only once completely written)
+        """
+        if self._path is None:
+            return
+        _tmp_path = self._path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            with gzip.open(_tmp_path, "wb") as file:
+                _CataloguePickler(file, type(self._client())).dump({"version": CATALOGUES_VERSION,
+                                                                    "libcloud_version": libcloud.__version__,
+                                                                    "signature": self._signature,
+                                                                    "time": self._loaded_at,
+                                                                    "resources": self._resources})
+            os.replace(_tmp_path, self._path)
+        except Exception as e:
+            logging.warning("[" + self.__class__.__name__ + "] Unable to write " + self._path + ": " + str(e))
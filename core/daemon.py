@@ -0,0 +1,180 @@
+"""
+EasyCloud Daemon, executing the monitor (Monitor, RuleEngine and Agent) of a
+platform without the TUI, e.g. as a systemd service:
+
+    [Service]
+    WorkingDirectory=/opt/easycloud
+    ExecStart=/usr/bin/python3 easycloud_launcher.py --daemon aws_libcloud
+    Restart=on-failure
+
+SIGTERM and SIGINT stop the daemon, waiting for the pending measurements and
+actions (up to drain_timeout seconds); SIGHUP reloads rules/rules.dct.
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+import logging
+import modules
+import signal
+import threading
+
+from core.metaconfmanager import MetaConfManager
+from core.module import Module
+from pkgutil import iter_modules
+
+# Seconds between two checks of the monitor threads (and of the actions results)
+HEALTH_CHECK_PERIOD = 5
+
+
+class Daemon:
+
+    def __init__(self, platform, rule_names=None):
+        """
+        Init method
+
+        Args:
+            platform (str): the platform module directory name (e.g. aws_libcloud)
+            rule_names (str[], optional): the names of the rules to enable (default: all
+                                          the rules whose action is available)
+        """
+        self.platform = platform
+        self.rule_names = rule_names
+        self.manager = None
+        self._stop_event = threading.Event()
+        # Stop signal received and reload requested by a signal
+        self._signal = None
+        self._reload = False
+
+    def run(self):
+        """
+        Start the monitor and wait for a stop signal
+
+        Returns:
+            int: the exit code (0 if stopped by a signal, 1 if the monitor can't be
+                 started or terminates unexpectedly)
+        """
+        try:
+            self.manager = self._load_manager()
+        except Exception as e:
+            logging.error("[" + self.__class__.__name__ + "] Unable to load the " + self.platform + " platform: " + str(e))
+            return 1
+        for _signal in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(_signal, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        try:
+            self.manager.start_monitor()
+        except Exception as e:
+            logging.error("[" + self.__class__.__name__ + "] Unable to start the monitor: " + str(e))
+            return 1
+        self.manager.monitoring = True
+        self._enable_rules()
+        logging.info("[" + self.__class__.__name__ + "] " + self.manager.platform_name + " monitor started")
+        _exit_code = 0
+        while not self._stop_event.wait(HEALTH_CHECK_PERIOD):
+            if self._reload:
+                self._reload = False
+                self.reload_rules()
+            self._log_agent_results()
+            if not self.manager.is_monitor_running():
+                logging.error("[" + self.__class__.__name__ + "] The monitor terminated unexpectedly")
+                _exit_code = 1
+                break
+        if self._signal is not None:
+            logging.info("[" + self.__class__.__name__ + "] Signal " + signal.Signals(self._signal).name + " received")
+        logging.info("[" + self.__class__.__name__ + "] Stopping the monitor...")
+        if not self.manager.drain_monitor(self.manager.conf.drain_timeout):
+            logging.warning("[" + self.__class__.__name__ + "] Some measurements or actions have been discarded")
+        self._log_agent_results()
+        self.manager.monitoring = False
+        logging.info("[" + self.__class__.__name__ + "] " + self.manager.platform_name + " monitor stopped")
+        return _exit_code
+
+    def stop(self):
+        """
+        Ask the daemon to stop (can be called by any thread)
+        """
+        self._stop_event.set()
+
+    def reload_rules(self):
+        """
+        Read rules/rules.dct again and send the new rules to the RuleEngine
+        """
+        self.manager._read_rules_from_file()
+        self.manager.re_cmd_queue.put({"command": "init", "rules": self.manager.rules})
+        _rule_names = self._get_rule_names()
+        for _rule_name in [_rule_name for _rule_name in self.manager.active_rules if _rule_name not in _rule_names]:
+            self.manager.active_rules.remove(_rule_name)
+            self.manager.re_cmd_queue.put({"command": "disable_rule", "rule_name": _rule_name})
+        self._enable_rules()
+        logging.info("[" + self.__class__.__name__ + "] Rules reloaded, active rules: " +
+                     ", ".join(self.manager.active_rules))
+
+    def _load_manager(self):
+        """
+        Create the manager of the platform, without asking the user for any data
+
+        Returns:
+            MetaManager: the platform manager
+        """
+        _platforms = [_module[1] for _module in iter_modules(modules.__path__)]
+        if self.platform not in _platforms:
+            raise ValueError("unknown platform (available platforms: " + ", ".join(_platforms) + ")")
+        MetaConfManager.interactive = False
+        _module = Module(self.platform)
+        _module.load_manager_class()
+        _manager = _module.manager_class()
+        _manager.collect_agent_results = True
+        logging.getLogger().setLevel(_manager.conf.log_level)
+        return _manager
+
+    def _get_rule_names(self):
+        """
+        Return the names of the rules to enable
+
+        Returns:
+            str[]: the rules names
+        """
+        _rules = {_rule["name"]: _rule for _rule in self.manager.rules}
+        if self.rule_names is None:
+            _actions = self.manager.get_available_actions()
+            return [_name for _name, _rule in _rules.items() if _rule["action"] in _actions]
+        for _rule_name in self.rule_names:
+            if _rule_name not in _rules:
+                logging.warning("[" + self.__class__.__name__ + "] Rule " + _rule_name + " not found in rules.dct")
+        return [_rule_name for _rule_name in self.rule_names if _rule_name in _rules]
+
+    def _enable_rules(self):
+        """
+        Enable the rules not yet active
+        """
+        for _rule_name in self._get_rule_names():
+            if _rule_name not in self.manager.active_rules:
+                self.manager.active_rules.append(_rule_name)
+                self.manager.re_cmd_queue.put({"command": "enable_rule", "rule_name": _rule_name})
+
+    def _log_agent_results(self):
+        for _result in self.manager.get_agent_results():
+            # A falsy result means that the action has been skipped (e.g. instance already cloned)
+            if _result["success"] and _result["result"]:
+                logging.info("[" + self.__class__.__name__ + "] Action \"" + _result["action"] + "\" executed on instance " +
+                             str(_result["instance_id"]) + " in " + "%.1f" % _result["duration"] + " seconds")
+            elif not _result["success"]:
+                logging.warning("[" + self.__class__.__name__ + "] Action \"" + _result["action"] + "\" failed on instance " +
+                                str(_result["instance_id"]) + ": " + _result["error"])
+
+    # The signal handlers only set some flags, handled by the main loop (logging
+    # or using the queues inside a handler can deadlock the main thread)
+
+    def _handle_stop(self, signum, frame):
+        self._signal = signum
+        self.stop()
+
+    def _handle_reload(self, signum, frame):
+        self._reload = True
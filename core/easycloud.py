@@ -125,6 +125,7 @@ class EasyCloud:
         try:
             _new_instance = manager_class()
             self.loaded_instances.append(_new_instance)
+            logging.getLogger().setLevel(_new_instance.conf.log_level)
             return _new_instance
         except Exception as e:
             SimpleTUI.exception_dialog(e)
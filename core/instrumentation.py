@@ -0,0 +1,335 @@
+"""
+EasyCloud Instrumentation component, collecting the statistics of the monitoring
+pipeline of each platform: sweep and provider calls latencies, queues depths,
+rules evaluations and actions execution times.
+The statistics can be read by the TUI or exported in the Prometheus text format
+through a local HTTP server.
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+import collections
+import logging
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Names of the statistics collected
+SWEEP_DURATION = "easycloud_sweep_duration_seconds"
+PROVIDER_CALL_DURATION = "easycloud_provider_call_duration_seconds"
+QUEUE_DEPTH = "easycloud_queue_depth"
+RULE_EVALUATIONS = "easycloud_rule_evaluations_total"
+ACTION_DURATION = "easycloud_action_duration_seconds"
+
+# Upper bounds (in seconds) of the histograms buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Number of seconds considered for computing the rate of a counter
+RATE_WINDOW = 60
+
+# Instrumentation of each platform, in the form {<platform>: <Instrumentation>}
+_instrumentations = collections.OrderedDict()
+_instrumentations_lock = threading.Lock()
+# HTTP servers started, in the form {<port>: <server>}
+_servers = {}
+
+
+def get_instrumentation(platform):
+    """
+    Return the instrumentation of a platform, creating it if it doesn't exist
+
+    Args:
+        platform (str): the platform name
+
+    Returns:
+        Instrumentation: the instrumentation of the platform
+    """
+    with _instrumentations_lock:
+        if platform not in _instrumentations:
+            _instrumentations[platform] = Instrumentation(platform)
+        return _instrumentations[platform]
+
+
+def to_prometheus():
+    """
+    Return the statistics of all the platforms in the Prometheus text format
+
+    Returns:
+        str: the statistics
+    """
+    with _instrumentations_lock:
+        _instrumentations_list = list(_instrumentations.values())
+    _samples = collections.OrderedDict()
+    for _instrumentation in _instrumentations_list:
+        for _name, _type, _lines in _instrumentation.get_samples():
+            if _name not in _samples:
+                _samples[_name] = (_type, [])
+            _samples[_name][1].extend(_lines)
+    _text = ""
+    for _name, (_type, _lines) in _samples.items():
+        _text += "# TYPE " + _name + " " + _type + "\n"
+        _text += "".join(_line + "\n" for _line in _lines)
+    return _text
+
+
+def start_exporter(port, address="127.0.0.1"):
+    """
+    Start a local HTTP server exporting the statistics of all the platforms in
+    the Prometheus text format (nothing is done if the server is already running)
+
+    Args:
+        port (int): the server port
+        address (str, optional): the server address (default: 127.0.0.1)
+    """
+    with _instrumentations_lock:
+        if port in _servers:
+            return
+        _server = ThreadingHTTPServer((address, port), _ExporterRequestHandler)
+        _server.daemon_threads = True
+        _servers[port] = _server
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    logging.info("Statistics exported on http://" + address + ":" + str(port) + "/metrics")
+
+
+class _ExporterRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        _body = to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not written in the application log
+        pass
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Init method
+
+        Args:
+            buckets (float[]): the upper bounds of the buckets, in ascending order
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """
+        Add a value to the histogram
+
+        Args:
+            value (float): the value
+        """
+        _index = 0
+        while _index < len(self.buckets) and value > self.buckets[_index]:
+            _index += 1
+        self.counts[_index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Return an estimation of a quantile (the upper bound of the bucket containing it)
+
+        Args:
+            q (float): the quantile (between 0 and 1)
+
+        Returns:
+            float: the estimation, None if the histogram is empty
+        """
+        if self.count == 0:
+            return None
+        _rank = q * self.count
+        _cumulative = 0
+        for _index, _count in enumerate(self.counts[:-1]):
+            _cumulative += _count
+            if _cumulative >= _rank:
+                return self.buckets[_index]
+        return self.max
+
+
+class Counter:
+
+    def __init__(self):
+        """
+        Init method
+        """
+        self.value = 0
+        # Increments of the last RATE_WINDOW seconds, in the form deque([<second>, <amount>])
+        self._recent = collections.deque()
+
+    def increment(self, amount=1):
+        """
+        Increment the counter
+
+        Args:
+            amount (int): the increment
+        """
+        self.value += amount
+        _second = int(time.time())
+        if len(self._recent) > 0 and self._recent[-1][0] == _second:
+            self._recent[-1][1] += amount
+        else:
+            self._recent.append([_second, amount])
+        self._expire(_second)
+
+    def rate(self):
+        """
+        Return the average increment per second over the last RATE_WINDOW seconds
+
+        Returns:
+            float: the rate
+        """
+        self._expire(int(time.time()))
+        return sum(_amount for _second, _amount in self._recent) / RATE_WINDOW
+
+    def _expire(self, now):
+        while len(self._recent) > 0 and self._recent[0][0] <= now - RATE_WINDOW:
+            self._recent.popleft()
+
+
+class Instrumentation:
+
+    def __init__(self, platform):
+        """
+        Init method
+
+        Args:
+            platform (str): the platform name (exported as a label)
+        """
+        self.platform = platform
+        # Statistics, in the form {(<name>, ((<label>, <value>), ...)): <Histogram|Counter>}
+        self._histograms = collections.OrderedDict()
+        self._counters = collections.OrderedDict()
+        # Functions returning the current value of a gauge, in the form {(<name>, <labels>): <function>}
+        self._gauges = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        """
+        Add a value to a histogram
+
+        Args:
+            name (str): the histogram name
+            value (float): the value (e.g. a duration in seconds)
+            labels (dict): the labels of the histogram
+        """
+        _key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if _key not in self._histograms:
+                self._histograms[_key] = Histogram()
+            self._histograms[_key].observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Increment a counter
+
+        Args:
+            name (str): the counter name
+            amount (int): the increment
+            labels (dict): the labels of the counter
+        """
+        _key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if _key not in self._counters:
+                self._counters[_key] = Counter()
+            self._counters[_key].increment(amount)
+
+    def set_gauge(self, name, function, **labels):
+        """
+        Register a gauge, whose value is read only when the statistics are requested
+
+        Args:
+            name (str): the gauge name
+            function (function): a function without arguments returning the current value
+            labels (dict): the labels of the gauge
+        """
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = function
+
+    def remove_gauges(self, name):
+        """
+        Remove all the gauges with a certain name
+
+        Args:
+            name (str): the gauges name
+        """
+        with self._lock:
+            for _key in [_key for _key in self._gauges if _key[0] == name]:
+                del self._gauges[_key]
+
+    def get_stats(self):
+        """
+        Return a summary of the statistics, used by the TUI
+
+        Returns:
+            dict: the summary, in the form {"histograms": [(<name>, <labels>, <count>, <mean>, <p95>, <max>)],
+                  "counters": [(<name>, <labels>, <value>, <rate>)], "gauges": [(<name>, <labels>, <value>)]}
+        """
+        with self._lock:
+            _histograms = [(_name, dict(_labels), _h.count, _h.sum / _h.count if _h.count > 0 else 0.0,
+                            _h.quantile(0.95), _h.max) for (_name, _labels), _h in self._histograms.items()]
+            _counters = [(_name, dict(_labels), _c.value, _c.rate()) for (_name, _labels), _c in self._counters.items()]
+            _gauges = list(self._gauges.items())
+        return {"histograms": _histograms,
+                "counters": _counters,
+                "gauges": [(_name, dict(_labels), self._read_gauge(_function)) for (_name, _labels), _function in _gauges]}
+
+    def get_samples(self):
+        """
+        Return the statistics in the Prometheus text format, grouped by name
+
+        Returns:
+            tuple[]: the statistics, in the form (<name>, <type>, <lines>)
+        """
+        _samples = collections.OrderedDict()
+        with self._lock:
+            for (_name, _labels), _histogram in self._histograms.items():
+                _lines = _samples.setdefault(_name, ("histogram", []))[1]
+                _cumulative = 0
+                for _bound, _count in zip(list(_histogram.buckets) + ["+Inf"], _histogram.counts):
+                    _cumulative += _count
+                    _lines.append(_name + "_bucket" + self._format_labels(_labels + (("le", str(_bound)),)) +
+                                  " " + str(_cumulative))
+                _lines.append(_name + "_sum" + self._format_labels(_labels) + " " + repr(_histogram.sum))
+                _lines.append(_name + "_count" + self._format_labels(_labels) + " " + str(_histogram.count))
+            for (_name, _labels), _counter in self._counters.items():
+                _samples.setdefault(_name, ("counter", []))[1].append(
+                    _name + self._format_labels(_labels) + " " + str(_counter.value))
+            _gauges = list(self._gauges.items())
+        for (_name, _labels), _function in _gauges:
+            _samples.setdefault(_name, ("gauge", []))[1].append(
+                _name + self._format_labels(_labels) + " " + str(self._read_gauge(_function)))
+        return [(_name, _type, _lines) for _name, (_type, _lines) in _samples.items()]
+
+    def _format_labels(self, labels):
+        _labels = (("platform", self.platform),) + tuple(labels)
+        return "{" + ",".join(_label + "=\"" + str(_value).replace("\\", "\\\\").replace("\"", "\\\"") + "\""
+                              for _label, _value in _labels) + "}"
+
+    def _read_gauge(self, function):
+        try:
+            return function()
+        except Exception as e:
+            logging.warning("[" + self.__class__.__name__ + "] Unable to read a gauge: " + str(e))
+            return 0
@@ -0,0 +1,85 @@
+"""
+EasyCloud InventoryCache component, used by the managers for keeping the
+resources listed from a platform (images, instance types, instances, volumes,
+...) for a limited time, instead of listing them again for every menu.
+A collection is listed again once its TTL is expired or after an operation
+that modifies it has invalidated it.
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+import logging
+import threading
+import time
+
+# Names of the collections available
+IMAGES = "images"
+SIZES = "sizes"
+ZONES = "zones"
+NETWORKS = "networks"
+SECURITY_GROUPS = "security_groups"
+KEY_PAIRS = "key_pairs"
+INSTANCES = "instances"
+VOLUMES = "volumes"
+FLOATING_IPS = "floating_ips"
+
+
+class InventoryCache:
+
+    def __init__(self):
+        """
+        Init method
+        """
+        # Collections stored, in the form {<collection>: (<expiration time>, <resources>)}
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def get(self, collection, loader, ttl):
+        """
+        Return the resources of a collection, listing them only if they are not stored
+        or if they are expired
+
+        Args:
+            collection (str): the collection name
+            loader (function): a function without arguments returning the resources
+            ttl (int): the number of seconds the resources can be stored (0 disables the cache)
+
+        Returns:
+            object[]: the resources of the collection
+        """
+        with self._lock:
+            _entry = self._collections.get(collection)
+            if _entry is not None and _entry[0] > time.time():
+                logging.debug("[" + self.__class__.__name__ + "] Using stored " + collection)
+                return _entry[1]
+        _resources = loader()
+        if ttl > 0:
+            with self._lock:
+                self._collections[collection] = (time.time() + ttl, _resources)
+        return _resources
+
+    def invalidate(self, *collections):
+        """
+        Remove some collections, so that they are listed again on the next request
+
+        Args:
+            collections (str): the collections names
+        """
+        with self._lock:
+            for _collection in collections:
+                self._collections.pop(_collection, None)
+        logging.debug("[" + self.__class__.__name__ + "] Invalidated " + ", ".join(collections))
+
+    def clear(self):
+        """
+        Remove all the collections
+        """
+        with self._lock:
+            self._collections.clear()
@@ -1,11 +1,22 @@
 """
 EasyCloud Metaagent component, used to execute all the commands
-the RuleEngine module issues for a specific platform
+the RuleEngine module issues for a specific platform.
+If more than one worker is available, the commands are executed concurrently,
+with a limit on the commands of each action type in progress at the same time.
+The commands regarding the same instance are always executed one at a time,
+in the order they have been received.
 """
 
+import collections
 import logging
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from core.actionbinder import get_actions
+from core.actioncoalescer import ActionCoalescer
+from core.instrumentation import ACTION_DURATION, get_instrumentation
+from queue import Empty
 
 __author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
 __copyright__ = "Copyright (C) 2019"
@@ -19,7 +30,7 @@ __status__ = "Prototype"
 
 class MetaAgent:
 
-    def __init__(self, commands_queue, manager):
+    def __init__(self, commands_queue, manager, workers=1, action_limits=None, results_queue=None):
         """
         Init method (object initialization)
 
@@ -27,9 +38,31 @@ class MetaAgent:
             commands_queue (Queue): message queue used for receiving commands from
                                     the platform RuleEngine
             manager (str): The Manager class name
+            workers (int): the maximum number of commands executed at the same time
+            action_limits (dict): the maximum number of commands executed at the same time
+                                  for each action, in the form {<action_name>: <limit>}
+            results_queue (Queue): message queue used for sending the result of each
+                                   command to the Manager
         """
         self.commands_queue = commands_queue
         self.manager = manager
+        self.workers = workers
+        self.action_limits = action_limits if action_limits is not None else {}
+        self.results_queue = results_queue
+        # Association between action names and manager methods, resolved only once
+        self._dispatch_table = self._build_dispatch_table()
+        # Workers pool (created only if workers > 1)
+        self._executor = None
+        # Commands not yet submitted to the pool, instances with a command in progress
+        # and number of commands in progress for each action
+        self._waiting = collections.deque()
+        self._busy_instances = set()
+        self._running_actions = collections.Counter()
+        # True while a command is executed by the main loop (if workers == 1)
+        self._executing = False
+        self._lock = threading.Lock()
+        # Statistics of the actions executions
+        self._instrumentation = get_instrumentation(manager.conf.platform)
         # Set MetaAgent Enabled
         self._stop = False
 
@@ -39,31 +72,144 @@ class MetaAgent:
         """
         self._stop = True
 
+    def is_idle(self):
+        """
+        Check if all the commands received have been executed
+
+        Returns:
+            bool: True if no commands are waiting or in progress
+        """
+        with self._lock:
+            return (self.commands_queue.empty() and not self._executing and
+                    len(self._waiting) == 0 and len(self._busy_instances) == 0)
+
     def run(self):
         """
         Main agent loop
         """
+        if self.workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
         try:
             while not self._stop:
-                command = self.commands_queue.get()
+                try:
+                    command = self.commands_queue.get(timeout=3)
+                except Empty:
+                    continue
                 logging.debug("Command received: " + str(command))
-                self.execute_command(command)
+                if self._executor is None:
+                    self._executing = True
+                    try:
+                        self._execute_and_report(command)
+                    finally:
+                        self._executing = False
+                else:
+                    with self._lock:
+                        self._waiting.append(command)
+                        self._dispatch()
         except Exception as e:
             logging.error("An exception has occourred: " + str(e))
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
 
-    def execute_command(self, command):
+    def _dispatch(self):
         """
-        Execute a command issued by the RuleEngine
+        Submit to the workers pool all the waiting commands that can be executed,
+        respecting the global and the per-action limits and executing a single command
+        at a time for each instance (must be called holding the lock)
+        """
+        _still_waiting = collections.deque()
+        _blocked_instances = set()
+        while len(self._waiting) > 0:
+            command = self._waiting.popleft()
+            _instance_id = command["instance_id"]
+            _action = command["action"]
+            if (len(self._busy_instances) < self.workers and
+                    _instance_id not in self._busy_instances and _instance_id not in _blocked_instances and
+                    self._running_actions[_action] < self.action_limits.get(_action, self.workers)):
+                self._busy_instances.add(_instance_id)
+                self._running_actions[_action] += 1
+                self._executor.submit(self._execute_and_release, command)
+            else:
+                # Keep the order of the commands regarding the same instance
+                _blocked_instances.add(_instance_id)
+                _still_waiting.append(command)
+        self._waiting = _still_waiting
+
+    def _execute_and_release(self, command):
+        """
+        Execute a command in a worker, then submit the commands waiting for it
+
+        Args:
+            command (dict): The command, in the form {"instance_id": <id>, "action": <action>}
+        """
+        try:
+            self._execute_and_report(command)
+        finally:
+            with self._lock:
+                self._busy_instances.discard(command["instance_id"])
+                self._running_actions[command["action"]] -= 1
+                if not self._stop:
+                    self._dispatch()
+
+    def _execute_and_report(self, command):
+        """
+        Execute a command and send its result to the Manager (if a results queue is available)
+        in the form {"instance_id": <id>, "action": <action>, "success": <bool>,
+        "result": <returned value> | "error": <error message>, "duration": <seconds>}
 
         Args:
-            command (str): The command name
+            command (dict): The command, in the form {"instance_id": <id>, "action": <action>}
         """
+        _result = {"instance_id": command["instance_id"], "action": command["action"]}
+        _start = time.time()
         try:
-            all_actions = get_actions(self.manager.__class__.__name__)
-            action_method = getattr(self.manager, all_actions[command["action"]])
-        except AttributeError:
-            logging.error("Error: the " + self.manager.platform_name + " module has no action called " + command["action"])
+            _result["result"] = self.execute_command(command)
+            _result["success"] = True
         except Exception as e:
-            logging.error("An exception has occourred: " + str(e))
+            logging.error("An exception has occourred while executing \"" + command["action"] +
+                          "\" for instance " + command["instance_id"] + ": " + str(e))
+            _result["error"] = str(e)
+            _result["success"] = False
+        finally:
+            # Allow the RuleEngine to issue this action again
+            if isinstance(self.commands_queue, ActionCoalescer):
+                self.commands_queue.release(command)
+        _result["duration"] = time.time() - _start
+        self._instrumentation.observe(ACTION_DURATION, _result["duration"], action=command["action"],
+                                      outcome="success" if _result["success"] else "error")
+        if self.results_queue is not None:
+            self.results_queue.put(_result)
+
+    def execute_command(self, command):
+        """
+        Execute a command issued by the RuleEngine
+
+        Args:
+            command (dict): The command, in the form {"instance_id": <id>, "action": <action>}
+
+        Returns:
+            object: the value returned by the action
+        """
+        action_method = self._dispatch_table.get(command["action"])
+        if action_method is None:
+            raise ValueError("the " + self.manager.platform_name + " module has no action called " + command["action"])
         logging.debug("Executing \"" + command["action"] + "\" for instance " + command["instance_id"])
-        action_method(command["instance_id"])
+        return action_method(command["instance_id"])
+
+    def _build_dispatch_table(self):
+        """
+        Bind all the actions registered for the manager to its methods
+
+        Returns:
+            dict: a structure in the form {<action_name>: <bound method>}
+        """
+        _dispatch_table = {}
+        for _action, _method_name in get_actions(self.manager.__class__.__name__).items():
+            _method = getattr(self.manager, _method_name, None)
+            if _method is None:
+                logging.error("Error: the " + self.manager.platform_name + " module has no method called " +
+                              _method_name + " (action " + _action + ")")
+            else:
+                _dispatch_table[_action] = _method
+        return _dispatch_table
@@ -2,6 +2,8 @@
 Common base class for all the configuration managers
 """
 
+import logging
+
 from abc import ABC, abstractmethod
 from configparser import SafeConfigParser
 from os import sep
@@ -19,6 +21,10 @@ __status__ = "Prototype"
 
 class MetaConfManager(ABC):
 
+    # If False, a missing parameter is reported as an error instead of asking
+    # the user for it (e.g. when EasyCloud is executed as a daemon)
+    interactive = True
+
     def __init__(self, platform):
         """
         Initializes parser object
@@ -49,6 +55,36 @@ class MetaConfManager(ABC):
         self.granularity = self.get_parameter("options", "granularity", return_type=int)
         self.window_size = self.get_parameter("options", "window_size", return_type=int)
         self.minimum_positive = self.get_parameter("options", "minimum_positive", return_type=int)
+        # Optional settings (a default value is used if not defined)
+        self.monitor_workers = self.get_parameter("options", "monitor_workers", return_type=int, default=1)
+        self.monitor_sweep_timeout = self.get_parameter("options", "monitor_sweep_timeout", return_type=int,
+                                                        default=self.monitor_fetch_period)
+        self.monitor_batch_fetch = self.get_parameter("options", "monitor_batch_fetch", return_type=bool, default=False)
+        self.monitor_incremental_fetch = self.get_parameter("options", "monitor_incremental_fetch", return_type=bool, default=False)
+        self.rule_engine_shards = self.get_parameter("options", "rule_engine_shards", return_type=int, default=1)
+        self.rule_engine_processes = self.get_parameter("options", "rule_engine_processes", return_type=int, default=0)
+        self.monitor_pipeline = self.get_parameter("options", "monitor_pipeline", return_type=str, default="threads")
+        self.pipeline_concurrency = self.get_parameter("options", "pipeline_concurrency", return_type=int, default=100)
+        self.scheduler_workers = self.get_parameter("options", "scheduler_workers", return_type=int, default=32)
+        self.provider_rate_limit = self.get_parameter("options", "provider_rate_limit", return_type=float, default=0)
+        self.inventory_ttl = self.get_parameter("options", "inventory_ttl", return_type=int, default=60)
+        self.log_level = self.get_parameter("options", "log_level", return_type=str, default="INFO").upper()
+        if not isinstance(logging.getLevelName(self.log_level), int):
+            logging.warning("[" + self.__class__.__name__ + "] Unknown log level " + self.log_level + ", using INFO")
+            self.log_level = "INFO"
+        self.metrics_port = self.get_parameter("options", "metrics_port", return_type=int, default=0)
+        self.wait_timeout = self.get_parameter("options", "wait_timeout", return_type=int, default=300)
+        self.drain_timeout = self.get_parameter("options", "drain_timeout", return_type=int, default=60)
+        self.catalogue_refresh_interval = self.get_parameter("options", "catalogue_refresh_interval", return_type=int, default=86400)
+        self.action_coalescing = self.get_parameter("options", "action_coalescing", return_type=bool, default=False)
+        self.action_cooldown = self.get_parameter("options", "action_cooldown", return_type=int, default=0)
+        self.agent_workers = self.get_parameter("options", "agent_workers", return_type=int, default=1)
+        # Actions limits, in the form "<action_name>:<limit>,<action_name>:<limit>,..."
+        self.agent_action_limits = {}
+        for _action_limit in self.get_parameter("options", "agent_action_limits", return_type=str, default="").split(","):
+            if ":" in _action_limit:
+                _action, _limit = _action_limit.split(":", 1)
+                self.agent_action_limits[_action.strip()] = int(_limit)
 
     def ask_for_data(self, section_name, param_name, return_type=None, regex=None):
         """
@@ -61,7 +97,13 @@ class MetaConfManager(ABC):
 
         Returns:
             <return_type>: user input of type <return_type>
+
+        Raises:
+            ValueError: if the user can't be asked for the parameter (interactive is False)
         """
+        if not self.interactive:
+            raise ValueError("The parameter \"" + param_name + "\" (\"" + section_name + "\" section) " +
+                             "is not defined in settings.cfg")
         return SimpleTUI.input_dialog("Missing value",
                                       question="A parameter required by this module has not been defined in settings.cfg!\n"
                                       "Please, define a value to assign to \"" + param_name + "\" (\"" + section_name + "\" section)",
@@ -70,10 +112,10 @@ class MetaConfManager(ABC):
                                       pause_on_exit=False,
                                       cannot_quit=True)
 
-    def get_parameter(self, section, option, return_type=None, regex=None):
+    def get_parameter(self, section, option, return_type=None, regex=None, default=None):
         """
         Return the parameter stored in the module configuration file or
-        ask the user to provide it
+        ask the user to provide it (unless a default value is specified)
 
         Args:
             section (str): name of the section (a name surrounded with square brackets
@@ -84,6 +126,9 @@ class MetaConfManager(ABC):
                                                    file
             regex (str): the regular expression the input must follow, if a user input is
                          required
+            default (<return_type>, optional): the value returned if the parameter is not
+                                               defined in the configuration file, instead
+                                               of asking the user for it
 
         Returns:
             <return_type>: user input of type <return_type>
@@ -91,9 +136,10 @@ class MetaConfManager(ABC):
         if self.parser.has_option(section, option):
             value = self.parser.get(section, option)
             if return_type == bool:
-                if value in ["True", "true"]:
-                    return True
+                return value in ["True", "true"]
             else:
                 return return_type(value)
+        elif default is not None:
+            return default
         else:
             return self.ask_for_data(section, option, regex=regex, return_type=return_type)
@@ -6,10 +6,19 @@ import json
 import logging
 import os
 import subprocess
+import time
 
 from abc import ABC, abstractmethod
+from core.actionbinder import get_actions
+from core.actioncoalescer import ActionCoalescer
+from core.asyncpipeline import AsyncPipeline
+from core.instrumentation import QUEUE_DEPTH, get_instrumentation, start_exporter
+from core.inventorycache import FLOATING_IPS, INSTANCES, VOLUMES, InventoryCache
 from core.metaagent import MetaAgent
 from core.ruleengine import RuleEngine
+from core.scheduler import get_scheduler
+from core.shardedruleengine import ShardedRuleEngine
+from core.waiter import wait_until
 from queue import Queue
 from threading import Thread
 from tui.simpletui import SimpleTUI
@@ -39,10 +48,17 @@ class MetaManager(ABC):
         self.monitor = None
         self.rule_engine = None
         self.agent = None
+        self.pipeline = None
         self.monitoring = False
         self.rules = []
         self.active_rules = []
         self.monitor_cmd_queue = None
+        self.agent_results_queue = None
+        # The results of the actions are collected only if someone reads them (see get_agent_results)
+        self.collect_agent_results = False
+        self.action_coalescer = None
+        # Resources listed from the platform, shared by all the menus
+        self.inventory = InventoryCache()
         self._read_rules_from_file()
 
     def menu(self):
@@ -133,6 +149,20 @@ class MetaManager(ABC):
         """
         pass
 
+    def _cached(self, collection, loader):
+        """
+        Return the resources of a collection from the inventory cache, listing them
+        from the platform if they are not available or expired
+
+        Args:
+            collection (str): the collection name (see core.inventorycache)
+            loader (function): a function without arguments listing the resources
+
+        Returns:
+            object[]: the resources of the collection
+        """
+        return self.inventory.get(collection, loader, ttl=self.conf.inventory_ttl)
+
     # =============================================================================================== #
     #                                           List printers                                         #
     # =============================================================================================== #
@@ -289,6 +319,36 @@ class MetaManager(ABC):
             SimpleTUI.info("There are no rules available")
         return len(self.rules)
 
+    def print_monitor_stats(self):
+        """
+        Print the statistics of the monitor (latencies, queues depths and rates)
+
+        Returns:
+            int: The number of statistics printed
+        """
+        _stats = get_instrumentation(self.conf.platform).get_stats()
+        table_header = ["Statistic", "Labels", "Count", "Mean", "95th perc.", "Max"]
+        table_body = []
+        for _name, _labels, _count, _mean, _p95, _max in _stats["histograms"]:
+            table_body.append([_name, self._format_stats_labels(_labels), str(_count), "%.3fs" % _mean,
+                               "<= %ss" % _p95 if _p95 is not None else "-", "%.3fs" % _max])
+        SimpleTUI.print_table(table_header, table_body)
+        print("")
+        table_header = ["Statistic", "Labels", "Value", "Rate (per second)"]
+        table_body = []
+        for _name, _labels, _value, _rate in _stats["counters"]:
+            table_body.append([_name, self._format_stats_labels(_labels), str(_value), "%.2f" % _rate])
+        for _name, _labels, _value in _stats["gauges"]:
+            table_body.append([_name, self._format_stats_labels(_labels), str(_value), "-"])
+        SimpleTUI.print_table(table_header, table_body)
+        _count = len(_stats["histograms"]) + len(_stats["counters"]) + len(_stats["gauges"])
+        if _count == 0:
+            SimpleTUI.info("There are no statistics available, start the monitor first")
+        return _count
+
+    def _format_stats_labels(self, labels):
+        return ", ".join(_label + "=" + str(_value) for _label, _value in sorted(labels.items()))
+
     def print_all_active_rules(self):
         """
         Print all the active rules
@@ -383,6 +443,7 @@ class MetaManager(ABC):
                                      SimpleTUI.DIALOG_ERROR)
         except Exception as e:
             SimpleTUI.exception_dialog(e)
+        self.inventory.invalidate(INSTANCES, VOLUMES)
 
     @abstractmethod
     def _platform_create_new_instance(self, instance_name, image, instance_type, commands_queue):
@@ -408,6 +469,7 @@ class MetaManager(ABC):
                                          SimpleTUI.DIALOG_ERROR)
             except Exception as e:
                 SimpleTUI.exception_dialog(e)
+            self.inventory.invalidate(INSTANCES)
 
         # Delete instance
         elif action == "delete":
@@ -421,6 +483,7 @@ class MetaManager(ABC):
                                          SimpleTUI.DIALOG_ERROR)
             except Exception as e:
                 SimpleTUI.exception_dialog(e)
+            self.inventory.invalidate(INSTANCES, VOLUMES, FLOATING_IPS)
             # if instance_id in self.cloned_instances:
             #    del self.cloned_instances[instance_id]
         # Invalid instance action
@@ -506,6 +569,7 @@ class MetaManager(ABC):
                                      SimpleTUI.DIALOG_ERROR)
         except Exception as e:
             SimpleTUI.exception_dialog(e)
+        self.inventory.invalidate(VOLUMES, INSTANCES)
 
     @abstractmethod
     def _platform_is_volume_attached(self, volume):
@@ -547,6 +611,7 @@ class MetaManager(ABC):
                                      SimpleTUI.DIALOG_ERROR)
         except Exception as e:
             SimpleTUI.exception_dialog(e)
+        self.inventory.invalidate(VOLUMES, INSTANCES)
 
     @abstractmethod
     def _platform_delete_volume(self):
@@ -587,6 +652,7 @@ class MetaManager(ABC):
                                      SimpleTUI.DIALOG_ERROR)
         except Exception as e:
             SimpleTUI.exception_dialog(e)
+        self.inventory.invalidate(VOLUMES, INSTANCES)
 
     @abstractmethod
     def _platform_attach_volume(self, volume, instance):
@@ -619,6 +685,7 @@ class MetaManager(ABC):
                                      SimpleTUI.DIALOG_ERROR)
         except Exception as e:
             SimpleTUI.exception_dialog(e)
+        self.inventory.invalidate(VOLUMES)
 
     @abstractmethod
     def _platform_create_volume(self, volume_name, volume_size):
@@ -689,6 +756,7 @@ class MetaManager(ABC):
                                      SimpleTUI.DIALOG_ERROR)
         except Exception as e:
             SimpleTUI.exception_dialog(e)
+        self.inventory.invalidate(FLOATING_IPS, INSTANCES)
 
     @abstractmethod
     def _platform_is_ip_assigned(self, floating_ip):
@@ -732,6 +800,7 @@ class MetaManager(ABC):
                                      SimpleTUI.DIALOG_ERROR)
         except Exception as e:
             SimpleTUI.exception_dialog(e)
+        self.inventory.invalidate(FLOATING_IPS, INSTANCES)
 
     @abstractmethod
     def _platform_release_floating_ip(self):
@@ -772,6 +841,7 @@ class MetaManager(ABC):
                                      SimpleTUI.DIALOG_ERROR)
         except Exception as e:
             SimpleTUI.exception_dialog(e)
+        self.inventory.invalidate(FLOATING_IPS, INSTANCES)
 
     @abstractmethod
     def _platform_associate_floating_ip(self, floating_ip, instance):
@@ -790,6 +860,7 @@ class MetaManager(ABC):
                                      SimpleTUI.DIALOG_ERROR)
         except Exception as e:
             SimpleTUI.exception_dialog(e)
+        self.inventory.invalidate(FLOATING_IPS)
 
     @abstractmethod
     def _platform_reserve_floating_ip(self):
@@ -845,6 +916,12 @@ class MetaManager(ABC):
         """
         Start Monitor, RuleEngine and Agent threads
         """
+        if self.conf.monitor_pipeline == "asyncio":
+            self._start_async_monitor()
+            return
+        if self.conf.monitor_pipeline == "scheduler":
+            self._start_scheduled_monitor()
+            return
         # Queue creation
         # Queue used for receiving metrics from the Monitor
         monitor_measurements_queue = Queue()
@@ -853,22 +930,37 @@ class MetaManager(ABC):
         # Queue used for sending commands
         self.re_cmd_queue = Queue()
         # Queue used in RuleEngine for sending commands to the Agent
-        agent_cmd_queue = Queue()
+        agent_cmd_queue = self._get_agent_queue(Queue())
+        # Queue used by the Agent for reporting the results of the actions
+        self.agent_results_queue = Queue() if self.collect_agent_results else None
         # Monitor object and thread creation
         logging.debug("MANAGER: " + str(self.re_cmd_queue))
+        self._start_instrumentation(measurements_queue=monitor_measurements_queue, agent_queue=agent_cmd_queue)
         self.monitor = self._platform_get_monitor(commands_queue=self.monitor_cmd_queue,
                                                   measurements_queue=monitor_measurements_queue)
         self.monitor_thread = Thread(target=self.monitor.run)
         self.monitor_thread.setDaemon(True)
         # RuleEngine object and thread creation
-        self.rule_engine = RuleEngine(conf=self.conf,
-                                      commands_queue=self.re_cmd_queue,
-                                      measurements_queue=monitor_measurements_queue,
-                                      agent_queue=agent_cmd_queue)
+        if self.conf.rule_engine_shards > 1:
+            self.rule_engine = ShardedRuleEngine(conf=self.conf,
+                                                 commands_queue=self.re_cmd_queue,
+                                                 measurements_queue=monitor_measurements_queue,
+                                                 agent_queue=agent_cmd_queue,
+                                                 shards=self.conf.rule_engine_shards,
+                                                 actions=self.get_available_actions())
+        else:
+            self.rule_engine = RuleEngine(conf=self.conf,
+                                          commands_queue=self.re_cmd_queue,
+                                          measurements_queue=monitor_measurements_queue,
+                                          agent_queue=agent_cmd_queue,
+                                          actions=self.get_available_actions())
         self.rule_engine_thread = Thread(target=self.rule_engine.run)
         self.rule_engine_thread.setDaemon(True)
         # Agent object and thread creation
-        self.agent = MetaAgent(commands_queue=agent_cmd_queue, manager=self)
+        self.agent = MetaAgent(commands_queue=agent_cmd_queue, manager=self,
+                               workers=self.conf.agent_workers,
+                               action_limits=self.conf.agent_action_limits,
+                               results_queue=self.agent_results_queue)
         self.agent_thread = Thread(target=self.agent.run)
         self.agent_thread.setDaemon(True)
         # Threads execution
@@ -883,10 +975,148 @@ class MetaManager(ABC):
         logging.debug("MANAGER QUEUE SIZE RE: " + str(self.rule_engine.commands_queue.qsize()))
         logging.debug("QUEUE SIZE: " + str(self.re_cmd_queue.qsize()))
 
+    def _start_async_monitor(self):
+        """
+        Start Monitor, RuleEngine and Agent on a single event loop, executed by a
+        single thread (shared by all the components)
+        """
+        self.pipeline = AsyncPipeline(conf=self.conf)
+        # Queue used for sending metrics to the Monitor (add/remove metric measurements to fetch)
+        self.monitor_cmd_queue = Queue()
+        # Queue used for sending commands
+        self.re_cmd_queue = self.pipeline.rule_engine_commands_queue
+        # Components creation
+        self.monitor = self._platform_get_monitor(commands_queue=self.monitor_cmd_queue,
+                                                  measurements_queue=self.pipeline.measurements_queue)
+        _agent_cmd_queue = self._get_agent_queue(self.pipeline.agent_queue)
+        self.rule_engine = RuleEngine(conf=self.conf,
+                                      commands_queue=self.re_cmd_queue,
+                                      measurements_queue=self.pipeline.measurements_queue,
+                                      agent_queue=_agent_cmd_queue,
+                                      actions=self.get_available_actions())
+        self.agent_results_queue = Queue() if self.collect_agent_results else None
+        self.agent = MetaAgent(commands_queue=_agent_cmd_queue, manager=self,
+                               results_queue=self.agent_results_queue)
+        self._start_instrumentation(measurements_queue=self.pipeline.measurements_queue, agent_queue=_agent_cmd_queue)
+        self.pipeline.bind(monitor=self.monitor, rule_engine=self.rule_engine, agent=self.agent)
+        # Pipeline thread execution
+        self.monitor_thread = Thread(target=self.pipeline.run)
+        self.monitor_thread.setDaemon(True)
+        self.rule_engine_thread = self.monitor_thread
+        self.agent_thread = self.monitor_thread
+        self.monitor_thread.start()
+        logging.debug(self.platform_name + " Pipeline Thread Started")
+        # Send the init message to the RuleEngine
+        self.re_cmd_queue.put({"command": "init", "rules": self.rules})
+
+    def _start_scheduled_monitor(self):
+        """
+        Start the Agent thread and let the MonitorScheduler (shared by all the platforms)
+        execute Monitor and RuleEngine
+        """
+        _scheduler = get_scheduler(self.conf.scheduler_workers)
+        # Queue used for receiving metrics from the Monitor (shared by all the platforms)
+        monitor_measurements_queue = _scheduler.get_measurements_queue()
+        # Queue used for sending metrics to the Monitor (add/remove metric measurements to fetch)
+        self.monitor_cmd_queue = Queue()
+        # Queue used for sending commands
+        self.re_cmd_queue = Queue()
+        # Queue used in RuleEngine for sending commands to the Agent
+        agent_cmd_queue = self._get_agent_queue(Queue())
+        # Queue used by the Agent for reporting the results of the actions
+        self.agent_results_queue = Queue() if self.collect_agent_results else None
+        self._start_instrumentation(measurements_queue=monitor_measurements_queue, agent_queue=agent_cmd_queue)
+        # Components creation
+        self.monitor = self._platform_get_monitor(commands_queue=self.monitor_cmd_queue,
+                                                  measurements_queue=monitor_measurements_queue)
+        self.rule_engine = RuleEngine(conf=self.conf,
+                                      commands_queue=self.re_cmd_queue,
+                                      measurements_queue=monitor_measurements_queue,
+                                      agent_queue=agent_cmd_queue,
+                                      actions=self.get_available_actions())
+        self.agent = MetaAgent(commands_queue=agent_cmd_queue, manager=self,
+                               workers=self.conf.agent_workers,
+                               action_limits=self.conf.agent_action_limits,
+                               results_queue=self.agent_results_queue)
+        self.agent_thread = Thread(target=self.agent.run)
+        self.agent_thread.setDaemon(True)
+        self.agent_thread.start()
+        logging.debug(self.platform_name + " Agent Thread Started")
+        # Send the init message to the RuleEngine (applied before the first measurements)
+        self.re_cmd_queue.put({"command": "init", "rules": self.rules})
+        # Monitor and RuleEngine are executed by the scheduler
+        self.monitor_thread, self.rule_engine_thread = _scheduler.register(self.conf.platform, self.monitor, self.rule_engine)
+        logging.debug(self.platform_name + " Monitor and RuleEngine scheduled")
+
     @abstractmethod
     def _platform_get_monitor(self, commands_queue, measurements_queue):
         pass
 
+    def _start_instrumentation(self, measurements_queue, agent_queue):
+        """
+        Register the depths of the monitor queues as statistics and start the
+        statistics exporter (if metrics_port is defined)
+
+        Args:
+            measurements_queue (Queue): the queue used by the Monitor for sending measurements
+            agent_queue (Queue): the queue used by the RuleEngine for sending commands to the Agent
+        """
+        _instrumentation = get_instrumentation(self.conf.platform)
+        _instrumentation.remove_gauges(QUEUE_DEPTH)
+        _instrumentation.set_gauge(QUEUE_DEPTH, measurements_queue.qsize, queue="measurements")
+        _instrumentation.set_gauge(QUEUE_DEPTH, agent_queue.qsize, queue="agent")
+        if self.agent_results_queue is not None:
+            _instrumentation.set_gauge(QUEUE_DEPTH, self.agent_results_queue.qsize, queue="agent_results")
+        if self.conf.metrics_port > 0:
+            try:
+                start_exporter(self.conf.metrics_port)
+            except Exception as e:
+                logging.error("Unable to export the statistics on port " + str(self.conf.metrics_port) + ": " + str(e))
+
+    def _get_agent_queue(self, queue):
+        """
+        Return the queue used by the RuleEngine for sending commands to the Agent,
+        wrapped in an ActionCoalescer if action_coalescing is enabled
+
+        Args:
+            queue (Queue): the queue read by the Agent
+
+        Returns:
+            Queue: the queue to be used by both RuleEngine and Agent
+        """
+        if self.conf.action_coalescing:
+            self.action_coalescer = ActionCoalescer(queue, cooldown=self.conf.action_cooldown)
+            return self.action_coalescer
+        self.action_coalescer = None
+        return queue
+
+    def get_suppressed_actions(self):
+        """
+        Return the number of actions admitted and suppressed by the ActionCoalescer
+
+        Returns:
+            dict: the counters (see ActionCoalescer.get_stats), None if action_coalescing is disabled
+        """
+        if self.action_coalescer is not None:
+            return self.action_coalescer.get_stats()
+        return None
+
+    def get_agent_results(self):
+        """
+        Return the results of the actions executed by the Agent since the last call
+        (collect_agent_results must be set before starting the monitor)
+
+        Returns:
+            dict[]: the results, in the form {"instance_id": <id>, "action": <action>,
+                    "success": <bool>, "result": <returned value> | "error": <error message>,
+                    "duration": <seconds>}
+        """
+        _results = []
+        if self.agent_results_queue is not None:
+            while not self.agent_results_queue.empty():
+                _results.append(self.agent_results_queue.get())
+        return _results
+
     def stop_monitor(self):
         """
         Stop Monitor, RuleEngine and Agent threads
@@ -898,11 +1128,52 @@ class MetaManager(ABC):
             self.rule_engine.stop()
         if self.agent is not None and self.agent_thread.is_alive():
             self.agent.stop()
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+        get_instrumentation(self.conf.platform).remove_gauges(QUEUE_DEPTH)
         # Wait for threads closure
         self.monitor_thread.join(5)
         self.rule_engine_thread.join(5)
         self.agent_thread.join(5)
 
+    def drain_monitor(self, timeout):
+        """
+        Stop the Monitor, wait until the measurements already fetched have been
+        evaluated by the RuleEngine and the resulting actions executed by the Agent,
+        then stop RuleEngine and Agent threads
+
+        Args:
+            timeout (float): the maximum number of seconds to wait (the measurements
+                             and the actions still pending are then discarded)
+
+        Returns:
+            bool: True if all the pending work has been completed, False otherwise
+        """
+        _deadline = time.time() + timeout
+        _drained = True
+        if self.pipeline is not None:
+            # The stages of the asyncio pipeline can't be stopped one at a time
+            logging.info("The asyncio monitor pipeline doesn't support the drain, stopping it")
+        elif self.monitor is not None and self.monitor_thread.is_alive():
+            # Let the Monitor complete the sweep in progress
+            self.monitor.stop()
+            self.monitor_thread.join(max(0, _deadline - time.time()))
+            # The components are idle if they look so twice in a row (a message
+            # can be in transit between a queue and a component for a moment)
+            _idle_probes = [0]
+
+            def _probe():
+                if self.rule_engine.is_idle() and self.agent.is_idle():
+                    _idle_probes[0] += 1
+                else:
+                    _idle_probes[0] = 0
+                return _idle_probes[0] >= 2
+            _drained = wait_until(_probe, max(0, _deadline - time.time()), description="the monitor drain",
+                                  initial_delay=0.1, max_delay=1, jitter=0)
+        self.stop_monitor()
+        return _drained
+
     def is_monitor_running(self):
         """
         Detect if any  of the monitor (intended as Platform Monitor + RuleEngine + Agent) is running
@@ -935,6 +1206,7 @@ class MetaManager(ABC):
                           "Create a new rule",
                           "Edit a rule",
                           "Delete a rule",
+                          "Show monitor statistics",
                           "Back to the Main Menu"]
             choice = SimpleTUI.print_menu(menu_header, menu_items, menu_subheader)
             if choice == 1:
@@ -951,6 +1223,9 @@ class MetaManager(ABC):
             elif choice == 6:
                 self.delete_rule()
             elif choice == 7:
+                SimpleTUI.list_dialog("Monitor statistics",
+                                      self.print_monitor_stats)
+            elif choice == 8:
                 break
             else:
                 SimpleTUI.msg_dialog("Error", "Unimplemented functionality", SimpleTUI.DIALOG_ERROR)
@@ -1053,6 +1328,8 @@ class MetaManager(ABC):
                                          regex="^[a-zA-Z0-9_-]+$")
         if _action is None:
             return
+        if not self._is_action_available(_action):
+            return
         _rule_params["action"] = _action
         # Create rule, update rules file and issue a refresh command to the RuleEngine
         self.rules.append(_rule_params)
@@ -1107,6 +1384,8 @@ class MetaManager(ABC):
                                          regex="^[a-zA-Z0-9_-]+$")
         if _action is None:
             return
+        if not self._is_action_available(_action):
+            return
 
         # Update rule, update rules file and issue a refresh command to the RuleEngine
         _rule_params["target"] = _target
@@ -1143,6 +1422,33 @@ class MetaManager(ABC):
     #                                 RuleManager - Utility functions                                 #
     # =============================================================================================== #
 
+    def get_available_actions(self):
+        """
+        Return the names of the actions registered for this platform
+
+        Returns:
+            str[]: the actions names
+        """
+        return list(get_actions(self.__class__.__name__).keys())
+
+    def _is_action_available(self, action):
+        """
+        Check if an action is registered for this platform, showing an error otherwise
+
+        Args:
+            action (str): the action name
+
+        Returns:
+            bool: True if the action is available, False otherwise
+        """
+        if action in get_actions(self.__class__.__name__):
+            return True
+        SimpleTUI.msg_dialog("Rule action",
+                             "The action \"" + action + "\" is not available for this platform!\n"
+                             "Available actions: " + ", ".join(self.get_available_actions()),
+                             SimpleTUI.DIALOG_ERROR)
+        return False
+
     def _read_rules_from_file(self):
         """
         Read all the rules contained in rules/rules.dct
@@ -1154,6 +1460,11 @@ class MetaManager(ABC):
             if("rules" in _data):
                 self.rules = _data["rules"]
                 logging.debug("All rules loaded")
+                _actions = self.get_available_actions()
+                for _rule in self.rules:
+                    if _rule["action"] not in _actions:
+                        logging.warning("The rule " + _rule["name"] + " has an action not available for this platform (" +
+                                        _rule["action"] + "), it will be ignored by the RuleEngine")
             else:
                 logging.error("Bad rules file format")
         except IOError as e:
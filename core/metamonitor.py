@@ -7,6 +7,10 @@ implemented by a specialized monitor. Currently these methods are:
     _get_metric_values: returns a list of standardized messages (created with
                         method _build_message, defined in this abstract class)
 
+A specialized monitor can also override _get_batch_samples, in order to fetch the
+measurements of many instances with a few requests (used if monitor_batch_fetch
+is enabled).
+
 Metrics getters must be implemented in the specialized monitor and binded with the
 generic metric name using _bind_generic_metric_to_getter.
 """
@@ -15,9 +19,14 @@ import collections
 import datetime
 import json
 import logging
+import math
+import threading
 import time
 
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from core.instrumentation import PROVIDER_CALL_DURATION, SWEEP_DURATION, get_instrumentation
 from os import sep
 
 __author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
@@ -54,9 +63,23 @@ class MetaMonitor(ABC):
         self._monitored_instances = []  # List of monitored instances ids
         self._read_metrics_from_file()  # Read metrics from rules/metrics.dct
         self._monitored_metrics = self._set_all_metrics_active()
+        # Last window_size measurements of each (instance, metric) pair, in the form
+        # {(<instance_id>, <metric_name>): [<last_fetch_time>, deque((<receive_time>, <measurement>))]}
+        # (used only if monitor_incremental_fetch is enabled)
+        self._windows = {}
 
-        # Set monitor enabled
+        # Set monitor enabled (the event interrupts the sleep between two sweeps)
         self._stop = False
+        self._stop_event = threading.Event()
+        # Workers pool (created only if monitor_workers > 1, or shared by all the
+        # platforms if the monitor is executed by the MonitorScheduler)
+        self._executor = None
+        # Limit of the provider calls (assigned by the MonitorScheduler, if any) and
+        # instances not fetched in the last sweep because of it (fetched first in the next one)
+        self.rate_limiter = None
+        self._deferred_instances = []
+        # Statistics of the sweeps and of the provider calls
+        self._instrumentation = get_instrumentation(conf.platform)
 
         # Connect to the monitoring service
         self.connect()
@@ -90,39 +113,297 @@ class MetaMonitor(ABC):
 
         logging.debug("Monitor thread started")
 
+        # Pool of workers used for fetching the measurements in parallel
+        if self.conf.monitor_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.conf.monitor_workers)
+
         # Main monitor loop
-        while not self._stop:
-
-            # Check commands
-
-            logging.debug("[" + self.__class__.__name__ + "] Checking commands...")
-            while not self.commands_queue.empty():
-                command = self.commands_queue.get()
-                logging.debug("[" + self.__class__.__name__ + "] New command received: " + str(command))
-                self._process_command(command)
-
-            # Check instances
-            logging.debug("[" + self.__class__.__name__ + "] Checking instances...")
-            logging.debug(self._monitored_instances)
-            for _instance in self._monitored_instances:
-                _metrics_samples = []
-                logging.debug("[" + self.__class__.__name__ + "] Check instance {0}".format(_instance))
-                for _requested_metric in self._monitored_metrics:
-                    _metrics_samples.append(self._get_samples(instance_id=_instance, metric_name=_requested_metric,
-                                                              limit=self.conf.window_size, granularity=self.conf.granularity))
-                logging.debug("[" + self.__class__.__name__ + "] Sending message: " + str({"instance_id": _instance, "measurements": _metrics_samples}))
-                self.measurements_queue.put({"instance_id": _instance, "measurements": _metrics_samples})
-
-            # Put this monitor to sleep (time defined in config file and
-            # expressed in seconds)
-            logging.debug("[" + self.__class__.__name__ + "] Sleeping for " + str(self.conf.monitor_fetch_period) + " seconds...")
-            time.sleep(self.conf.monitor_fetch_period)
+        try:
+            while not self._stop:
+
+                # Check commands
+                self._check_commands()
+
+                # Check instances
+                _sweep_start = time.time()
+                self._sweep()
+                self._instrumentation.observe(SWEEP_DURATION, time.time() - _sweep_start)
+
+                # Put this monitor to sleep (time defined in config file and
+                # expressed in seconds, minus the time spent during the fetch)
+                _sleep_time = max(0, self.conf.monitor_fetch_period - (time.time() - _sweep_start))
+                logging.debug("[%s] Sleeping for %s seconds...", self.__class__.__name__, _sleep_time)
+                self._stop_event.wait(_sleep_time)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
 
     def stop(self):
         """
-        Stop this monitor
+        Stop this monitor (a sweep in progress is completed)
         """
         self._stop = True
+        self._stop_event.set()
+
+    def _check_commands(self):
+        """
+        Process all the commands received since the last check
+        """
+        logging.debug("[" + self.__class__.__name__ + "] Checking commands...")
+        while not self.commands_queue.empty():
+            command = self.commands_queue.get()
+            logging.debug("[%s] New command received: %s", self.__class__.__name__, command)
+            self._process_command(command)
+
+    def _sweep(self):
+        """
+        Fetch the measurements of all the monitored metrics for each monitored instance
+        and send a message for each instance to the RuleEngine.
+        All the measurements not fetched before monitor_sweep_timeout seconds are reported
+        as errors, so that a slow instance cannot stall the whole sweep. The instances
+        that the rate limiter doesn't allow to fetch before then are left for the next sweep
+        """
+        logging.debug("[%s] Checking instances: %s", self.__class__.__name__, self._monitored_instances)
+        _deadline = time.time() + self.conf.monitor_sweep_timeout
+        _deferred = [_instance for _instance in self._deferred_instances if _instance in self._monitored_instances]
+        _instances = _deferred + [_instance for _instance in self._monitored_instances if _instance not in _deferred]
+        self._deferred_instances = []
+        # Measurements already fetched through the batch getter
+        _prefetched = {}
+        if self.conf.monitor_batch_fetch and len(_instances) > 0:
+            _prefetched = self._batch_sweep(_instances)
+        if self._executor is None:
+            self._sequential_sweep(_instances, _deadline, _prefetched)
+        else:
+            self._parallel_sweep(_instances, _deadline, _prefetched)
+
+    def _batch_sweep(self, instances):
+        """
+        Fetch the measurements of all the instances through the batch getter
+
+        Args:
+            instances (str[]): The ids of the instances to check
+
+        Returns:
+            dict: A structure in the form {<instance_id>: {<metric_name>: <samples>}}, where
+                  <samples> is in the same format returned by _get_samples
+        """
+        _prefetched = {}
+        _limit = max([self._fetch_limit(_instance, _metric_name)
+                      for _instance in instances for _metric_name in self._monitored_metrics] + [1])
+        self._throttle()
+        _call_start = time.time()
+        try:
+            _batch = self._get_batch_samples(instance_ids=instances, metric_names=self._monitored_metrics,
+                                             limit=_limit, granularity=self.conf.granularity)
+            self._instrumentation.observe(PROVIDER_CALL_DURATION, time.time() - _call_start, metric="batch", outcome="success")
+        except Exception as _exception:
+            self._instrumentation.observe(PROVIDER_CALL_DURATION, time.time() - _call_start, metric="batch", outcome="error")
+            logging.error("[" + self.__class__.__name__ + "] Error while fetching the measurements in batch, " +
+                          "falling back to a fetch for each instance: " + str(_exception))
+            return _prefetched
+        for _instance in instances:
+            _prefetched[_instance] = {}
+            for _metric_name, _metric_samples in _batch.get(_instance, {}).items():
+                _prefetched[_instance][_metric_name] = {"metric": _metric_name, "values": _metric_samples}
+        return _prefetched
+
+    def _sequential_sweep(self, instances, deadline, prefetched):
+        """
+        Fetch the measurements one after another
+
+        Args:
+            instances (str[]): The ids of the instances to check
+            deadline (float): UNIX time after which no more fetches are performed
+            prefetched (dict): The measurements already fetched, in the form
+                               {<instance_id>: {<metric_name>: <samples>}}
+        """
+        for _index, _instance in enumerate(instances):
+            _metrics_samples = []
+            logging.debug("[%s] Check instance %s", self.__class__.__name__, _instance)
+            # All the calls regarding the instance are allowed at once, so that no fetch is wasted
+            _calls = len([_metric for _metric in self._monitored_metrics if _metric not in prefetched.get(_instance, {})])
+            if _calls > 0 and time.time() < deadline and not self._throttle(deadline, _calls):
+                self._defer(instances[_index:])
+                return
+            for _requested_metric in self._monitored_metrics:
+                if _requested_metric in prefetched.get(_instance, {}):
+                    _metrics_samples.append(prefetched[_instance][_requested_metric])
+                elif time.time() < deadline:
+                    _metrics_samples.append(self._get_samples_safe(instance_id=_instance, metric_name=_requested_metric,
+                                                                   limit=self._fetch_limit(_instance, _requested_metric),
+                                                                   granularity=self.conf.granularity))
+                else:
+                    _metrics_samples.append(self._timeout_samples(_requested_metric))
+            self._send_measurements(_instance, _metrics_samples)
+
+    def _parallel_sweep(self, instances, deadline, prefetched):
+        """
+        Fetch the measurements using the workers pool. The message regarding an instance
+        is sent as soon as all its measurements are available
+
+        Args:
+            instances (str[]): The ids of the instances to check
+            deadline (float): UNIX time after which all the pending fetches are abandoned
+            prefetched (dict): The measurements already fetched, in the form
+                               {<instance_id>: {<metric_name>: <samples>}}
+        """
+        _futures = {}
+        _results = {}
+        _pending = {}
+        for _index, _instance in enumerate(instances):
+            # All the calls regarding the instance are allowed at once, so that no fetch is wasted
+            _calls = len([_metric for _metric in self._monitored_metrics if _metric not in prefetched.get(_instance, {})])
+            if _calls > 0 and not self._throttle(deadline, _calls):
+                self._defer(instances[_index:])
+                break
+            _results[_instance] = dict(prefetched.get(_instance, {}))
+            _pending[_instance] = 0
+            for _requested_metric in self._monitored_metrics:
+                if _requested_metric in _results[_instance]:
+                    continue
+                _future = self._executor.submit(self._get_samples_safe, instance_id=_instance, metric_name=_requested_metric,
+                                                limit=self._fetch_limit(_instance, _requested_metric),
+                                                granularity=self.conf.granularity)
+                _futures[_future] = (_instance, _requested_metric)
+                _pending[_instance] += 1
+            if _pending[_instance] == 0:
+                self._send_measurements(_instance, [_results[_instance][_metric]
+                                                    for _metric in self._monitored_metrics])
+        try:
+            for _future in as_completed(_futures, timeout=max(0, deadline - time.time())):
+                _instance, _requested_metric = _futures[_future]
+                _results[_instance][_requested_metric] = _future.result()
+                _pending[_instance] -= 1
+                if _pending[_instance] == 0:
+                    self._send_measurements(_instance, [_results[_instance][_metric]
+                                                        for _metric in self._monitored_metrics])
+        except FuturesTimeoutError:
+            logging.warning("[" + self.__class__.__name__ + "] Sweep deadline exceeded, " +
+                            str(len([_f for _f in _futures if not _f.done()])) + " fetches abandoned")
+        # Report the missing measurements as errors
+        for _future, (_instance, _requested_metric) in _futures.items():
+            if _requested_metric not in _results[_instance]:
+                _future.cancel()
+                _results[_instance][_requested_metric] = self._timeout_samples(_requested_metric)
+        for _instance, _instance_pending in _pending.items():
+            if _instance_pending > 0:
+                self._send_measurements(_instance, [_results[_instance][_metric]
+                                                    for _metric in self._monitored_metrics])
+
+    def _defer(self, instances):
+        """
+        Leave some instances for the next sweep, without sending any message about them
+
+        Args:
+            instances (str[]): The ids of the instances not fetched
+        """
+        self._deferred_instances = list(instances)
+        logging.warning("[" + self.__class__.__name__ + "] Provider rate limit reached, " +
+                        str(len(instances)) + " instances left for the next sweep")
+
+    def _calls_per_sweep(self):
+        """
+        Return the number of provider calls needed by a sweep (a lower bound if the
+        measurements are fetched through the batch getter)
+
+        Returns:
+            int: the number of calls
+        """
+        if self.conf.monitor_batch_fetch and type(self)._get_batch_samples is not MetaMonitor._get_batch_samples:
+            return 1
+        return len(self._monitored_instances) * len(self._monitored_metrics)
+
+    def _throttle(self, deadline=None, calls=1):
+        """
+        Wait until some calls to the provider are allowed by the rate limiter (if any)
+
+        Args:
+            deadline (float, optional): UNIX time after which the calls are useless
+            calls (int, optional): the number of calls (default: 1)
+
+        Returns:
+            bool: True if the calls can be performed, False if they wouldn't be allowed
+                  before the deadline
+        """
+        if self.rate_limiter is None:
+            return True
+        return self.rate_limiter.acquire(timeout=None if deadline is None else deadline - time.time(), calls=calls)
+
+    def _send_measurements(self, instance_id, metrics_samples):
+        """
+        Send the measurements of an instance to the RuleEngine
+
+        Args:
+            instance_id (str): The instance id
+            metrics_samples (dict[]): The measurements of each monitored metric
+        """
+        _message = {"instance_id": instance_id,
+                    "measurements": [self._merge_window(instance_id, _metric_samples) for _metric_samples in metrics_samples]}
+        # The messages contain whole windows of measurements, so they are formatted only if logged
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("[%s] Sending message: %s", self.__class__.__name__, _message)
+        self.measurements_queue.put(_message)
+
+    def _fetch_limit(self, instance_id, metric_name):
+        """
+        Return the number of measurements to request for a metric of an instance.
+        If monitor_incremental_fetch is enabled and a full window of measurements is
+        available, only the measurements newer than the last fetch (plus the last one,
+        that could have been updated in the meantime) are requested
+
+        Args:
+            instance_id (str): The instance id
+            metric_name (str): The *generic* metric name
+
+        Returns:
+            int: The number of measurements to request
+        """
+        _window = self._windows.get((instance_id, metric_name))
+        if not self.conf.monitor_incremental_fetch or _window is None or len(_window[1]) < self.conf.window_size:
+            return self.conf.window_size
+        _elapsed = time.time() - _window[0]
+        return max(1, min(self.conf.window_size, int(math.ceil(_elapsed / self.conf.granularity)) + 1))
+
+    def _merge_window(self, instance_id, metric_samples):
+        """
+        Merge the measurements just fetched with the ones stored in the window of
+        the (instance, metric) pair and return the updated window.
+        Measurements containing errors are returned as they are
+
+        Args:
+            instance_id (str): The instance id
+            metric_samples (dict): A structure in the format returned by _get_samples
+
+        Returns:
+            dict: A structure in the format returned by _get_samples, containing the
+                  last window_size measurements
+        """
+        if not self.conf.monitor_incremental_fetch or metric_samples["values"] is None:
+            return metric_samples
+        for _sample in metric_samples["values"]:
+            if "error" in _sample:
+                return metric_samples
+        _key = (instance_id, metric_samples["metric"])
+        if _key not in self._windows:
+            self._windows[_key] = [0, collections.deque(maxlen=self.conf.window_size)]
+        _window = self._windows[_key]
+        _now = time.time()
+        if len(metric_samples["values"]) > 0:
+            # An empty fetch doesn't count as a fetch, so that the next one requests
+            # all the measurements published in the meantime
+            _window[0] = _now
+            # Newer measurements replace the stored ones with the same or a more recent timestamp
+            _oldest_timestamp = metric_samples["values"][0]["timestamp"]
+            while len(_window[1]) > 0 and _window[1][-1][1]["timestamp"] >= _oldest_timestamp:
+                _window[1].pop()
+            _window[1].extend((_now, _sample) for _sample in metric_samples["values"])
+        # Forget the measurements received more than a window ago (e.g. the provider
+        # stopped publishing the metric), so that they can't satisfy a rule forever
+        while len(_window[1]) > 0 and _window[1][0][0] < _now - self.conf.window_size * self.conf.granularity:
+            _window[1].popleft()
+        return {"metric": metric_samples["metric"], "values": [_sample for _received, _sample in _window[1]]}
 
     def _process_command(self, message):
         """
@@ -169,6 +450,8 @@ class MetaMonitor(ABC):
         """
         if(instance_id in self._monitored_instances):
             self._monitored_instances.remove(instance_id)
+            for _metric_name in self._monitored_metrics:
+                self._windows.pop((instance_id, _metric_name), None)
             logging.debug("[" + self.__class__.__name__ + "] Monitored instance removed: " + instance_id)
         else:
             logging.warning("[" + self.__class__.__name__ + "] Attempted to remove instance " +
@@ -195,12 +478,52 @@ class MetaMonitor(ABC):
         if(_metric_getter is not None):
             _metric_samples = _metric_getter(
                 instance_id=instance_id, granularity=granularity, limit=limit)
-            logging.debug(
-                "Adding " + str(_metric_samples) + " (instance " + instance_id + ", metric " + metric_name + ")")
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Adding %s (instance %s, metric %s)", _metric_samples, instance_id, metric_name)
             return {"metric": metric_name, "values": _metric_samples}
         else:
             return {"metric": metric_name, "values": None}
 
+    def _get_samples_safe(self, instance_id, metric_name, limit, granularity):
+        """
+        Same as _get_samples, but any exception raised by the metric getter is
+        reported as an error measurement instead of being propagated
+
+        Args:
+            instance_id (str): The instance id (intended as instance id)
+            metric_name (str): The *generic* metric name
+            limit (int): The maximum number of measurements returned
+            granularity (int): The granularity of the measurements fetched, expressed in seconds
+
+        Returns:
+            dict: A structure containing all the measurements (max=limit) for a certain metric
+        """
+        _call_start = time.time()
+        try:
+            _samples = self._get_samples(instance_id=instance_id, metric_name=metric_name,
+                                         limit=limit, granularity=granularity)
+            self._instrumentation.observe(PROVIDER_CALL_DURATION, time.time() - _call_start, metric=metric_name, outcome="success")
+            return _samples
+        except Exception as _exception:
+            self._instrumentation.observe(PROVIDER_CALL_DURATION, time.time() - _call_start, metric=metric_name, outcome="error")
+            logging.error("[" + self.__class__.__name__ + "] Error while fetching metric " + metric_name +
+                          " for instance " + instance_id + ": " + str(_exception))
+            return {"metric": metric_name, "values": [self._error_sample(_exception)]}
+
+    def _timeout_samples(self, metric_name):
+        """
+        Return the measurements structure used for a metric not fetched before the
+        sweep deadline
+
+        Args:
+            metric_name (str): The *generic* metric name
+
+        Returns:
+            dict: A structure containing a single error measurement
+        """
+        return {"metric": metric_name,
+                "values": [self._error_sample(FuturesTimeoutError("Sweep deadline exceeded"))]}
+
     def _bind_generic_metric_to_getter(self, name, function):
         """
         Method for registering a metric getter with a generic metric name
@@ -226,7 +549,7 @@ class MetaMonitor(ABC):
                       None if no getter is assigned to the generic metric
         """
         _value = self._metrics_getters[generic_metric]
-        logging.info("METRIC GETTER VALUE for " + generic_metric + ": " + str(_value))
+        logging.debug("Metric getter for %s: %s", generic_metric, _value)
         if(callable(_value)):  # check if the returned value is a function
             return _value
         else:
@@ -236,6 +559,24 @@ class MetaMonitor(ABC):
     def _get_metric_values(self, instance, metric, granularity, limit):
         pass
 
+    def _get_batch_samples(self, instance_ids, metric_names, limit, granularity):
+        """
+        Batch measurements getter. It can be overridden by a specialized monitor able
+        to fetch the measurements of many instances (and metrics) with a few requests.
+        All the metrics not included in the returned structure are fetched using the
+        standard getters
+
+        Args:
+            instance_ids (str[]): The ids of the instances to fetch the measurements
+            metric_names (str[]): The *generic* metrics names
+            limit (int): The maximum number of measurements returned for each metric
+            granularity (int): The granularity of the measurements fetched, expressed in seconds
+
+        Returns:
+            dict: A structure in the form {<instance_id>: {<metric_name>: [<measurement>, ...]}}
+        """
+        return {}
+
     def _build_message(self, timestamp, value, unit):
         """
         Generic message builder, must be used to create messages to be inserted
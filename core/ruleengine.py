@@ -15,16 +15,26 @@ __maintainer__ = "Luca Banzato"
 __email__ = "20005492@studenti.uniupo.it"
 __status__ = "Prototype"
 
+import collections
 import logging
-import operator
+import multiprocessing
 import threading
 
+from concurrent.futures import ProcessPoolExecutor
+from core.instrumentation import RULE_EVALUATIONS, get_instrumentation
+from core.ruleevaluator import OPERATORS, build_window, count_satisfied, evaluate_windows, init_worker
 from queue import Empty
 
+# Keys required in a rule definition (rules without any of them are ignored)
+RULE_KEYS = ("name", "target", "operator", "threshold", "action")
+
+# Compiled rules: rules definitions indexed by name and active rules definitions indexed by target metric
+RuleIndex = collections.namedtuple("RuleIndex", ["by_name", "by_metric"])
+
 
 class RuleEngine(threading.Thread):
 
-    def __init__(self, conf, commands_queue, measurements_queue, agent_queue):
+    def __init__(self, conf, commands_queue, measurements_queue, agent_queue, actions=None):
         """
         Init method
 
@@ -37,12 +47,27 @@ class RuleEngine(threading.Thread):
                                         the platform monitor
             agent_queue (Queue): message queue used for sending commands to the platform
                                 Agent
+            actions (str[]): the names of the actions available in the platform Agent
+                             (rules with other actions are rejected), None to accept any action
         """
         self.conf = conf
+        self.actions = actions
         self.commands_queue = commands_queue
         self.measurements_queue = measurements_queue
         self.agent_queue = agent_queue
+        self.rules = []
         self.active_rules = []
+        self._rule_index = RuleIndex(by_name={}, by_metric={})
+        # Pool of processes evaluating the rules (if rule_engine_processes > 0), True if
+        # its workers hold outdated rules, and evaluations submitted to it, in the form
+        # (instance_id, errors, future)
+        self._pool = None
+        self._pool_outdated = False
+        self._pending = collections.deque()
+        # True while a message received from the Monitor is being processed
+        self._busy = False
+        # Statistics of the rules evaluations
+        self._instrumentation = get_instrumentation(conf.platform)
         # Each instance is stored in this format: {"instance_id": <id>,
         # "rules":["p1","p2",...]}
         self._stop = False
@@ -76,18 +101,24 @@ class RuleEngine(threading.Thread):
                 # (commands have priority)
                 while not self.commands_queue.empty():
                     command = self.commands_queue.get()
-                    logging.debug("[" + self.__class__.__name__ + "] Message received! " + str(command))
+                    logging.debug("[%s] Message received! %s", self.__class__.__name__, command)
                     self._process_command(command)
                 logging.debug("[" + self.__class__.__name__ + "] Checking for new messages...")
                 # Fetch a message from the monitor queue (or block the flow
-                # until a message is received)
-                message = self.measurements_queue.get(timeout=3)
+                # until a message is received, checking the process pool
+                # frequently while some evaluations are in progress)
+                message = self.measurements_queue.get(timeout=0.1 if self._pending else 3)
                 # Check if an action must be performed
-                self._process_message(message)
+                self._busy = True
+                try:
+                    self._process_message(message)
+                finally:
+                    self._busy = False
                 logging.debug("Finished reasoning!")
             except Empty:
                 logging.debug("[" + self.__class__.__name__ + "] No new messages...")
-                pass
+                self._collect_results()
+        self._stop_pool()
 
     def stop(self):
         """
@@ -95,6 +126,16 @@ class RuleEngine(threading.Thread):
         """
         self._stop = True
 
+    def is_idle(self):
+        """
+        Check if all the measurements received have been evaluated (and the
+        resulting actions sent to the Agent)
+
+        Returns:
+            bool: True if no measurements are waiting or being evaluated
+        """
+        return self.measurements_queue.empty() and not self._busy and len(self._pending) == 0
+
     def _process_command(self, message):
         """
         Process a command sent by another thread. Command must be in the form
@@ -110,7 +151,8 @@ class RuleEngine(threading.Thread):
         if("command" in message):
             # Init message (load all the rules)
             if message["command"] == "init" and "rules" in message:
-                self.rules = message["rules"]
+                self.rules = list(message["rules"])
+                self._rebuild_rule_index()
             # Enable a rule
             elif message["command"] == "enable_rule" and "rule_name" in message:
                 self._enable_rule(message["rule_name"])
@@ -144,6 +186,7 @@ class RuleEngine(threading.Thread):
         """
         if rule_name not in self.active_rules:
             self.active_rules.append(rule_name)
+            self._rebuild_rule_index()
             logging.debug("[" + self.__class__.__name__ + "] Rule Enabled: " + rule_name)
         else:
             logging.warning("[" + self.__class__.__name__ + "] Attempted to add rule " +
@@ -158,6 +201,7 @@ class RuleEngine(threading.Thread):
         """
         if rule_name in self.active_rules:
             self.active_rules.remove(rule_name)
+            self._rebuild_rule_index()
             logging.debug("[" + self.__class__.__name__ + "] Rule Disabled: " + rule_name)
         else:
             logging.warning("[" + self.__class__.__name__ + "] Attempted to remove rule " +
@@ -172,10 +216,11 @@ class RuleEngine(threading.Thread):
         """
         if rule not in self.rules:
             self.rules.append(rule)
+            self._rebuild_rule_index()
             logging.debug("[" + self.__class__.__name__ + "] Rule Created: " + str(rule))
         else:
             logging.warning("[" + self.__class__.__name__ + "] Attempted to add rule " +
-                            rule["name"] + " to the rules while a copy of it is already present!")
+                            str(rule.get("name")) + " to the rules while a copy of it is already present!")
 
     def _remove_rule(self, rule_name):
         """
@@ -186,8 +231,9 @@ class RuleEngine(threading.Thread):
         """
         found = False
         for rule in self.rules:
-            if rule["name"] == rule_name:
+            if rule.get("name") == rule_name:
                 self.rules.remove(rule)
+                self._rebuild_rule_index()
                 logging.debug("[" + self.__class__.__name__ + "] Rule Removed: " + rule_name)
                 found = True
                 break
@@ -203,15 +249,16 @@ class RuleEngine(threading.Thread):
             edited_rule (str): the new rule body
         """
         found = False
-        for rule in self.rules:
-            if rule["name"] == edited_rule["name"]:
-                rule = edited_rule
-                logging.debug("[" + self.__class__.__name__ + "] Rule Edited: " + str(rule))
+        for i, rule in enumerate(self.rules):
+            if rule.get("name") == edited_rule.get("name"):
+                self.rules[i] = edited_rule
+                self._rebuild_rule_index()
+                logging.debug("[" + self.__class__.__name__ + "] Rule Edited: " + str(edited_rule))
                 found = True
                 break
         if not found:
             logging.warning("[" + self.__class__.__name__ + "] Attempted to edit rule " +
-                            edited_rule["name"] + ", but no rule with that name has been found in the rules list!")
+                            str(edited_rule.get("name")) + ", but no rule with that name has been found in the rules list!")
 
     def _process_message(self, message):
         """
@@ -220,103 +267,217 @@ class RuleEngine(threading.Thread):
         Args:
             message (dict): a JSON-Formatted message
         """
-        logging.debug("[" + self.__class__.__name__ + "] Processing the message: " + str(message))
+        # The messages contain whole windows of measurements, so they are formatted only if logged
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("[%s] Processing the message: %s", self.__class__.__name__, message)
         if("instance_id" in message and "measurements" in message):
-            logging.debug("[" + self.__class__.__name__ + "] Performing magic stuff...")
-            self._reason(instance_id=message["instance_id"], rules_names=self.active_rules,
-                         measurements=message["measurements"])
+            self._reason(instance_id=message["instance_id"], measurements=message["measurements"])
         else:
             logging.error("[" + self.__class__.__name__ +
                           "] Bad message received: " + str(message))
 
-    def _get_rule_definition(self, rule_name):
+    def _rebuild_rule_index(self):
+        """
+        Compile the rules definitions and the active rules names into a new index,
+        replacing the current one (malformed rules are reported and left out)
+        """
+        _by_name = {}
         for rule_definition in self.rules:
-            if rule_definition["name"] == rule_name:
-                return rule_definition
-        return None
+            if "name" not in rule_definition:
+                logging.error("[" + self.__class__.__name__ + "] Rule without a name ignored: " + str(rule_definition))
+                continue
+            _by_name[rule_definition["name"]] = rule_definition
+        _by_metric = collections.defaultdict(list)
+        for _rule_name in self.active_rules:
+            if _rule_name in _by_name:
+                _rule = _by_name[_rule_name]
+                _missing_keys = [_key for _key in RULE_KEYS if _key not in _rule]
+                if len(_missing_keys) > 0:  # Malformed rule
+                    logging.error("[" + self.__class__.__name__ + "] Missing " + ", ".join(_missing_keys) +
+                                  " in the definition of rule " + _rule_name)
+                elif self._get_operator(operator_symbol=_rule["operator"]) is None:  # Invalid operator
+                    logging.error("[" + self.__class__.__name__ + "] Invalid operator defined for rule " +
+                                  _rule["name"] + ": " + str(_rule["operator"]))
+                elif self.actions is not None and _rule["action"] not in self.actions:  # Unknown action
+                    logging.error("[" + self.__class__.__name__ + "] Unknown action defined for rule " +
+                                  _rule["name"] + ": " + _rule["action"])
+                else:
+                    _by_metric[_rule["target"]].append(_rule)
+            else:
+                logging.error("[" + self.__class__.__name__ + "] No rule named " +
+                              _rule_name + " has been found in the rules list")
+        self._rule_index = RuleIndex(by_name=_by_name, by_metric=dict(_by_metric))
+        # The pool is replaced on the next submission, so that a burst of commands
+        # (e.g. init followed by the enabling of each rule) restarts it only once
+        self._pool_outdated = True
+
+    def _start_pool(self):
+        """
+        Replace the process pool with a new one, whose workers receive the current
+        compiled rules only once, at startup. Evaluations already submitted to the
+        old pool are completed by its workers.
+        The workers are spawned, so that they don't inherit the threads and the
+        locks of this process
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self._pool = ProcessPoolExecutor(max_workers=self.conf.rule_engine_processes,
+                                         mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=init_worker,
+                                         initargs=(self._rule_index.by_metric,))
+        self._pool_outdated = False
+        logging.debug("[" + self.__class__.__name__ + "] Process pool started with " +
+                      str(self.conf.rule_engine_processes) + " workers")
+
+    def _stop_pool(self):
+        """
+        Send the actions of the evaluations already submitted and stop the process pool
+        """
+        if self._pool is not None:
+            self._collect_results(block=True)
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _get_rule_definition(self, rule_name):
+        """
+        Return the definition of a rule
+
+        Args:
+            rule_name (str): the rule name
 
-    def _reason(self, instance_id, rules_names, measurements):
+        Returns:
+            dict: the rule definition, None if no rule with that name exists
+        """
+        return self._rule_index.by_name.get(rule_name)
+
+    def _reason(self, instance_id, measurements):
         """
         Reason about enabled rules and last measurements and
         take an action if necessary
 
         Args:
             instance_id (str): The instance id to reason about
-            assigned_rules (str[]): A list of enabled rules names in the form
-                                    [{'metric': '<metric1_name>', 'values': []},
-                                    ...,
-                                    {'metric': '<metric2_name>', 'values': []}]
-            measurements (dict): A JSON-Formatted struct
-        """
-        logging.debug("MEASUREMENTS TO BE PROCESSED: " + str(measurements))
-        for _rule_name in rules_names:
-            rule = self._get_rule_definition(_rule_name)
-            try:
-                _metric_measurements = None
-                for metric_measurement in measurements:
-                    if metric_measurement["metric"] == rule["target"]:
-                        _metric_measurements = metric_measurement["values"]
-                        break
-                # Monitor reported that has no getter for the metric required
-                # by this rule (in form {"metric":None})
-                if(_metric_measurements is None):
-                    logging.error(
-                        "[" + self.__class__.__name__ + "] The monitor reported that has no getter implemented for this metric: " + rule["target"])
-                # Less measurements than expected for a metric
-                elif(len(_metric_measurements) < self.conf.window_size):
-                    logging.error("[" + self.__class__.__name__ + "] The monitor reported less measurements (" + str(len(
-                        _metric_measurements)) + ") than the specified window_size value (" + str(self.conf.window_size) + ").")
-                else:  # Operator and expected number of measurements are available
-                    self._apply_rule(instance_id=instance_id, rule_name=_rule_name,
-                                     metric_measurements=_metric_measurements)
+            measurements (dict[]): A JSON-Formatted struct in the form
+                                   [{'metric': '<metric1_name>', 'values': []},
+                                   ...,
+                                   {'metric': '<metric2_name>', 'values': []}]
+        """
+        _metrics_measurements = {}
+        _windows = {}
+        for metric_measurement in measurements:
+            _metrics_measurements[metric_measurement["metric"]] = metric_measurement["values"]
+        for _target, _rules in self._rule_index.by_metric.items():
             # Monitor has not provided measurements for a certain metric
             # (something went wrong...)
-            except KeyError:
+            if _target not in _metrics_measurements:
                 logging.error("[" + self.__class__.__name__ + "] No measurements regarding metric " +
-                              rule["target"] + " have been found")
+                              _target + " have been found")
+                continue
+            _metric_measurements = _metrics_measurements[_target]
+            # Monitor reported that has no getter for the metric required
+            # by this rule (in form {"metric":None})
+            if(_metric_measurements is None):
+                logging.error(
+                    "[" + self.__class__.__name__ + "] The monitor reported that has no getter implemented for this metric: " + _target)
+            # Less measurements than expected for a metric
+            elif(len(_metric_measurements) < self.conf.window_size):
+                logging.error("[" + self.__class__.__name__ + "] The monitor reported less measurements (" + str(len(
+                    _metric_measurements)) + ") than the specified window_size value (" + str(self.conf.window_size) + ").")
+            else:  # Operator and expected number of measurements are available
+                _windows[_target] = _metric_measurements
+        if self.conf.rule_engine_processes > 0:
+            self._submit_windows(instance_id=instance_id, windows=_windows)
+        else:
+            for _target, _metric_measurements in _windows.items():
+                self._apply_rules(instance_id=instance_id, rules=self._rule_index.by_metric[_target],
+                                  metric_measurements=_metric_measurements)
+
+    def _apply_rules(self, instance_id, rules, metric_measurements):
+        """
+        Apply all the rules targeting the same metric and send a message to
+        the Agent for each rule satisfied
 
-    def _apply_rule(self, instance_id, rule_name, metric_measurements):
+        Args:
+            instance_id (str): The instance id to reason about
+            rules (dict[]): The definitions of the rules targeting the metric
+            metric_measurements (dict[]): A JSON-Formatted struct
+        """
+        # Convert the measurements in an array of floats, counting the measurements
+        # with errors (in form {"timestamp":"<tt>", "error":"<error_message>"})
+        _window, _errors = build_window(metric_measurements)
+        if(_errors > 0):
+            # Bad measurements (very rare, should not happen due to temporal series)
+            logging.error("[" + self.__class__.__name__ + "] " + str(_errors) + " of the measurements aren't valid")
+        # Number of times each rule has been satisfied
+        _satisfied = count_satisfied(_window, rules)
+        self._instrumentation.increment(RULE_EVALUATIONS, len(rules))
+        for _rule, _rule_satisfied in zip(rules, _satisfied):
+            self._decide(instance_id=instance_id, rule_name=_rule["name"], action=_rule["action"],
+                         satisfied=_rule_satisfied, errors=_errors)
+
+    def _submit_windows(self, instance_id, windows):
         """
-        Apply a rule and send a message to the Agent if required
+        Submit the windows of an instance to the process pool, as compact arrays of floats,
+        starting the pool if it doesn't hold the current rules.
+        The actions are sent to the Agent in the same order of submission
+
+        Args:
+            instance_id (str): The instance id to reason about
+            windows (dict): The measurements of each target metric in the form
+                            {<target_metric>: [<measurement>, ...]}
+        """
+        _compact_windows = {}
+        _errors = {}
+        for _target, _metric_measurements in windows.items():
+            _compact_windows[_target], _errors[_target] = build_window(_metric_measurements, compact=True)
+            if(_errors[_target] > 0):
+                logging.error("[" + self.__class__.__name__ + "] " + str(_errors[_target]) + " of the measurements aren't valid")
+        if self._pool is None or self._pool_outdated:
+            self._start_pool()
+        self._pending.append((instance_id, _errors, self._pool.submit(evaluate_windows, _compact_windows)))
+        self._collect_results()
+
+    def _collect_results(self, block=False):
+        """
+        Take the decisions regarding the evaluations completed by the process pool,
+        stopping at the first one still in progress
+
+        Args:
+            block (bool): Wait for all the evaluations to be completed
+        """
+        while self._pending and (block or self._pending[0][2].done()):
+            _instance_id, _errors, _future = self._pending.popleft()
+            try:
+                _results = _future.result()
+            except Exception as e:
+                logging.error("[" + self.__class__.__name__ + "] Rules evaluation failed for instance " +
+                              _instance_id + ": " + str(e))
+                continue
+            for _target, _evaluations in _results.items():
+                self._instrumentation.increment(RULE_EVALUATIONS, len(_evaluations))
+                for _rule_name, _action, _rule_satisfied in _evaluations:
+                    self._decide(instance_id=_instance_id, rule_name=_rule_name, action=_action,
+                                 satisfied=_rule_satisfied, errors=_errors[_target])
+
+    def _decide(self, instance_id, rule_name, action, satisfied, errors):
+        """
+        Send the action of a rule to the Agent if it has been satisfied enough times
 
         Args:
             instance_id (str): The instance id to reason about
             rule_name (str): The rule name
-            metric_measurements (dict): A JSON-Formatted struct
-        """
-        # number of measurements with errors (in form {"timestamp":"<tt>",
-        # "error":"<error_message>"})
-        _errors = 0
-        _satisfied = 0  # number of times this rule has been satisfied
-
-        try:  # Rule initialization
-            _rule = self._get_rule_definition(rule_name)  # Get rule definition (a dictionary)
-            # Convert operator symbol in function (e.g. ">" -> operator.gt)
-            _operation = self._get_operator(operator_symbol=_rule["operator"])
-            if(_operation is None):  # Invalid operator
-                logging.error("[" + self.__class__.__name__ + "] Invalid operator defined for rule " +
-                              _rule["name"] + ": " + _rule["operator"])
-            else:
-                for _measurement in metric_measurements:  # Check each measurement
-                    # Bad measurement (very rare, should not happen due to
-                    # temporal series)
-                    if("error" in _measurement):
-                        logging.error(
-                            "[" + self.__class__.__name__ + "] One of the measurements isn't valid: " + _measurement["error"])
-                        _errors += 1
-                    else:  # Fine measurement, perform rule satisfaction
-                        if(_operation(_measurement["value"], _rule["threshold"])):
-                            _satisfied += 1
-                logging.debug(str(_satisfied) + " measurements are satisfying the " + rule_name + " rule, with a minimum_positive of " + str(self.conf.minimum_positive))
-                if(_satisfied >= self.conf.minimum_positive):  # Should I apply the rule?
-                    logging.debug("[" + self.__class__.__name__ + "] ACTION!!!!! " + str(_rule["action"]))
-                    self._send_action(instance_id=instance_id,
-                                      action=_rule["action"])
-                    if(_errors > 0):
-                        logging.warning("[" + self.__class__.__name__ + "] An action regarding a decision based on measurements with errors was performed!")
-        except KeyError:  # rule_name is the name of a rule not defined in the rules list
-            logging.error("[" + self.__class__.__name__ + "] No rule named " +
-                          rule_name + " has been found in the rules list")
+            action (str): The action name
+            satisfied (int): The number of measurements satisfying the rule
+            errors (int): The number of invalid measurements
+        """
+        logging.debug("%s measurements are satisfying the %s rule, with a minimum_positive of %s",
+                      satisfied, rule_name, self.conf.minimum_positive)
+        if(satisfied >= self.conf.minimum_positive):  # Should I apply the rule?
+            logging.debug("[%s] ACTION!!!!! %s", self.__class__.__name__, action)
+            self._send_action(instance_id=instance_id,
+                              action=action)
+            if(errors > 0):
+                logging.warning("[" + self.__class__.__name__ + "] An action regarding a decision based on measurements with errors was performed!")
 
     """
     Convert an operator symbol to a function
@@ -333,16 +494,8 @@ class RuleEngine(threading.Thread):
             function: a function performing the comparison represented by
                       the input symbol, None if an invalid symbol was passed
         """
-        _symbol_function_map = {
-            "<": operator.lt,
-            "<=": operator.le,
-            "==": operator.eq,
-            "!=": operator.ne,
-            ">=": operator.ge,
-            ">": operator.gt
-        }
-        if operator_symbol in _symbol_function_map:
-            return _symbol_function_map[operator_symbol]
+        if operator_symbol in OPERATORS:
+            return OPERATORS[operator_symbol]
         else:
             return None
 
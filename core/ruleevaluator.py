@@ -0,0 +1,133 @@
+"""
+EasyCloud RuleEvaluator component, used by the RuleEngine for converting the
+measurements windows into arrays of floats and for counting how many of them
+satisfy the rules targeting a metric.
+NumPy is used if available, otherwise the comparisons are performed on arrays
+provided by the array module of the standard library.
+The evaluation can also be performed by a pool of processes: each worker
+receives the compiled rules once (init_worker) and then the windows of an
+instance as compact arrays (evaluate_windows).
+"""
+
+import operator
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+# Association between operator symbols and functions
+# (these functions work both on floats and on NumPy arrays)
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    ">": operator.gt
+}
+
+# Compiled rules used by a worker process, in the form
+# {<target_metric>: [<rule_definition>, ...]}
+_worker_rules = {}
+
+
+def build_window(measurements, compact=False):
+    """
+    Convert a list of measurements into a contiguous array of floats.
+    Measurements with errors (or without a value) are stored as NaN
+
+    Args:
+        measurements (dict[]): A list of measurements in the form
+                               {"timestamp": <timestamp>, "value": <value>, "unit": <unit>}
+                               or {"timestamp": <timestamp>, "error": <error>}
+        compact (bool): Always return an array of the array module (suited to be
+                        sent to another process)
+
+    Returns:
+        array, int: the array of values (a NumPy array if NumPy is available and
+                    compact is False) and the number of invalid measurements
+    """
+    _values = array("d")
+    _errors = 0
+    for _measurement in measurements:
+        if "error" in _measurement or _measurement.get("value") is None:
+            _values.append(float("nan"))
+            _errors += 1
+        else:
+            _values.append(float(_measurement["value"]))
+    if numpy is not None and not compact:
+        return numpy.frombuffer(_values, dtype=numpy.float64), _errors
+    return _values, _errors
+
+
+def count_satisfied(window, rules):
+    """
+    Count how many values of a window satisfy each rule, ignoring the invalid ones.
+    All the rules are evaluated in a single pass over the window
+
+    Args:
+        window (array): An array of values created with build_window
+        rules (dict[]): A list of rules definitions (all with a valid operator)
+
+    Returns:
+        int[]: The number of values satisfying each rule (same order of rules)
+    """
+    if numpy is not None and isinstance(window, numpy.ndarray):
+        _valid = window[~numpy.isnan(window)]
+        return [int(numpy.count_nonzero(OPERATORS[_rule["operator"]](_valid, _rule["threshold"])))
+                for _rule in rules]
+    _comparisons = [(OPERATORS[_rule["operator"]], _rule["threshold"]) for _rule in rules]
+    _satisfied = [0] * len(rules)
+    for _value in window:
+        if _value != _value:  # NaN (invalid measurement)
+            continue
+        for i, (_operation, _threshold) in enumerate(_comparisons):
+            if _operation(_value, _threshold):
+                _satisfied[i] += 1
+    return _satisfied
+
+
+def init_worker(rules_by_metric):
+    """
+    Initialize a worker process with the compiled rules
+
+    Args:
+        rules_by_metric (dict): The active rules definitions indexed by target metric
+    """
+    global _worker_rules
+    _worker_rules = rules_by_metric
+
+
+def evaluate_windows(windows):
+    """
+    Evaluate the windows of an instance against the rules of the worker process
+
+    Args:
+        windows (dict): The windows of the instance in the form {<target_metric>: <array>},
+                        where each array has been created with build_window in compact mode
+
+    Returns:
+        dict: The rules evaluated for each metric in the form
+              {<target_metric>: [(<rule_name>, <action>, <satisfied>), ...]}
+    """
+    _results = {}
+    for _target, _values in windows.items():
+        _rules = _worker_rules.get(_target, [])
+        if numpy is not None:
+            _values = numpy.frombuffer(_values, dtype=numpy.float64)
+        _satisfied = count_satisfied(_values, _rules)
+        _results[_target] = [(_rule["name"], _rule["action"], _rule_satisfied)
+                             for _rule, _rule_satisfied in zip(_rules, _satisfied)]
+    return _results
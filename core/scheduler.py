@@ -0,0 +1,440 @@
+"""
+EasyCloud MonitorScheduler, executing the Monitors and the RuleEngines of all
+the platforms whose monitor_pipeline is "scheduler". The sweeps of the platforms
+are staggered over their fetch periods and their fetches are executed by a single
+workers pool, respecting the rate limit of each provider. The measurements of all
+the platforms are evaluated by a single rule evaluation stage, while each platform
+keeps its own rules and its own Agent.
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from core.instrumentation import SWEEP_DURATION
+from queue import Empty, Queue
+
+# Default number of workers of the shared pool
+DEFAULT_WORKERS = 32
+
+# Maximum number of seconds between two checks of the stopped components
+CHECK_PERIOD = 1
+
+# Scheduler shared by all the platforms (created by the first platform using it)
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(workers=DEFAULT_WORKERS):
+    """
+    Return the scheduler shared by all the platforms, creating it if it doesn't exist
+
+    Args:
+        workers (int, optional): the number of workers of the shared pool (used only
+                                 if the scheduler is created)
+
+    Returns:
+        MonitorScheduler: the scheduler
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = MonitorScheduler(workers)
+        return _scheduler
+
+
+class RateLimiter:
+
+    def __init__(self, rate):
+        """
+        Init method. The calls are limited with a token bucket, allowing bursts of
+        up to rate calls
+
+        Args:
+            rate (float): the maximum number of calls per second
+        """
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None, calls=1):
+        """
+        Wait until some calls are allowed (all of them or none)
+
+        Args:
+            timeout (float, optional): the maximum number of seconds to wait (default: no limit)
+            calls (int, optional): the number of calls (default: 1)
+
+        Returns:
+            bool: True if the calls are allowed, False if they wouldn't be allowed before
+                  the timeout (no call is reserved in this case)
+        """
+        with self._lock:
+            _now = time.time()
+            self._tokens = min(self.capacity, self._tokens + (_now - self._last) * self.rate)
+            self._last = _now
+            _wait = max(0.0, (calls - self._tokens) / self.rate)
+            if timeout is not None and _wait > timeout:
+                return False
+            # The tokens are reserved now, so that the waiting calls are served in order
+            self._tokens -= calls
+        if _wait > 0:
+            time.sleep(_wait)
+        return True
+
+
+class _PlatformQueue:
+
+    def __init__(self, queue):
+        """
+        Init method. The messages of a platform Monitor are sent to the shared queue,
+        together with this object, so that the rule evaluation stage knows their RuleEngine
+
+        Args:
+            queue (Queue): the queue shared by all the platforms
+        """
+        self.queue = queue
+        self.rule_engine = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def put(self, message):
+        """
+        Send a message of the platform Monitor to the shared queue
+
+        Args:
+            message (dict): the message
+        """
+        with self._lock:
+            self._count += 1
+        self.queue.put((self, message))
+
+    def taken(self):
+        """
+        Report that a message of this platform has been taken from the shared queue
+        """
+        with self._lock:
+            self._count -= 1
+
+    def qsize(self):
+        """
+        Return the number of messages of the platform in the shared queue
+
+        Returns:
+            int: the number of messages
+        """
+        return self._count
+
+    def empty(self):
+        """
+        Check if no message of the platform is in the shared queue
+
+        Returns:
+            bool: True if no message is waiting
+        """
+        return self._count == 0
+
+
+class _ScheduledPlatform:
+
+    def __init__(self, platform, monitor, rule_engine, next_sweep):
+        """
+        Init method
+
+        Args:
+            platform (str): the platform name
+            monitor (MetaMonitor): the platform Monitor
+            rule_engine (RuleEngine): the platform RuleEngine
+            next_sweep (float): UNIX time of the first sweep
+        """
+        self.platform = platform
+        self.monitor = monitor
+        self.rule_engine = rule_engine
+        self.next_sweep = next_sweep
+        self.sweeping = False
+        self.monitor_running = True
+        self.rule_engine_running = True
+        # True once the user has been warned that the rate limit is too low for the sweeps
+        self.rate_limit_warned = False
+
+
+class _ScheduledComponent:
+
+    def __init__(self, scheduler, entry, component):
+        """
+        Init method. Used by the MetaManager in place of the thread executing a component
+
+        Args:
+            scheduler (MonitorScheduler): the scheduler executing the component
+            entry (_ScheduledPlatform): the platform of the component
+            component (str): "monitor" or "rule_engine"
+        """
+        self._scheduler = scheduler
+        self._entry = entry
+        self._attribute = component + "_running"
+
+    def is_alive(self):
+        """
+        Check if the component is still executed
+
+        Returns:
+            bool: True if the component hasn't been stopped yet
+        """
+        return getattr(self._entry, self._attribute)
+
+    def join(self, timeout=None):
+        """
+        Wait until the component is stopped
+
+        Args:
+            timeout (float, optional): the maximum number of seconds to wait (default: no limit)
+        """
+        with self._scheduler._condition:
+            self._scheduler._condition.wait_for(lambda: not self.is_alive(), timeout)
+
+
+class MonitorScheduler:
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        """
+        Init method
+
+        Args:
+            workers (int): the number of workers of the pool shared by all the platforms
+        """
+        self.workers = workers
+        # Queue shared by all the platforms Monitors, in the form (<_PlatformQueue>, <message>)
+        self.measurements_queue = Queue()
+        self._platforms = []
+        self._rate_limiters = {}
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._condition = threading.Condition()
+        self._wake_up = threading.Event()
+        threading.Thread(target=self._schedule, daemon=True).start()
+        threading.Thread(target=self._evaluate, daemon=True).start()
+        logging.debug("[" + self.__class__.__name__ + "] Scheduler started with " + str(workers) + " workers")
+
+    def get_measurements_queue(self):
+        """
+        Return a new queue to be used by a platform Monitor and its RuleEngine
+
+        Returns:
+            _PlatformQueue: the queue
+        """
+        return _PlatformQueue(self.measurements_queue)
+
+    def register(self, platform, monitor, rule_engine):
+        """
+        Start scheduling the sweeps of a Monitor and evaluating the measurements of a RuleEngine,
+        both using a queue returned by get_measurements_queue. They are executed until stopped
+
+        Args:
+            platform (str): the platform name (the platforms with the same name share the rate limit)
+            monitor (MetaMonitor): the platform Monitor
+            rule_engine (RuleEngine): the platform RuleEngine
+
+        Returns:
+            tuple: two objects representing the execution of Monitor and RuleEngine,
+                   with the is_alive and join methods of a Thread
+        """
+        _period = monitor.conf.monitor_fetch_period
+        with self._condition:
+            if monitor.conf.provider_rate_limit > 0 and platform not in self._rate_limiters:
+                self._rate_limiters[platform] = RateLimiter(monitor.conf.provider_rate_limit)
+            monitor.rate_limiter = self._rate_limiters.get(platform)
+            monitor._executor = self._pool
+            rule_engine.measurements_queue.rule_engine = rule_engine
+            _entry = _ScheduledPlatform(platform, monitor, rule_engine, self._stagger(_period, time.time()))
+            self._platforms.append(_entry)
+        self._check_rate_limit(_entry)
+        self._wake_up.set()
+        logging.debug("[" + self.__class__.__name__ + "] " + platform + " scheduled, first sweep in " +
+                      "%.1f" % (_entry.next_sweep - time.time()) + " seconds")
+        return _ScheduledComponent(self, _entry, "monitor"), _ScheduledComponent(self, _entry, "rule_engine")
+
+    def _stagger(self, period, now):
+        """
+        Return the time of the first sweep of a new platform, in the middle of the
+        largest interval without sweeps of the other platforms (must be called
+        holding the lock)
+
+        Args:
+            period (float): the fetch period of the new platform
+            now (float): the current UNIX time
+
+        Returns:
+            float: UNIX time of the first sweep
+        """
+        _phases = sorted((_entry.next_sweep - now) % period for _entry in self._platforms if _entry.monitor_running)
+        if len(_phases) == 0:
+            return now
+        # Intervals between two consecutive sweeps, in the form (<length>, <start>)
+        _gaps = [(_phases[_index + 1] - _phases[_index], _phases[_index]) for _index in range(len(_phases) - 1)]
+        _gaps.append((period - _phases[-1] + _phases[0], _phases[-1]))
+        _gap, _start = max(_gaps)
+        return now + (_start + _gap / 2) % period
+
+    # =============================================================================================== #
+    #                                             Monitors                                            #
+    # =============================================================================================== #
+
+    def _schedule(self):
+        """
+        Start the sweep of each Monitor once its fetch period has elapsed (a sweep
+        still in progress is never overlapped by the next one)
+        """
+        while True:
+            _now = time.time()
+            with self._condition:
+                for _entry in self._platforms:
+                    if not _entry.monitor_running or _entry.sweeping:
+                        continue
+                    if _entry.monitor._stop:
+                        _entry.monitor_running = False
+                        self._condition.notify_all()
+                    elif _entry.next_sweep <= _now:
+                        _entry.sweeping = True
+                        _entry.next_sweep = _now + _entry.monitor.conf.monitor_fetch_period
+                        threading.Thread(target=self._sweep, args=(_entry,), daemon=True).start()
+                self._remove_stopped()
+                _next_sweep = min([_entry.next_sweep for _entry in self._platforms if _entry.monitor_running] +
+                                  [_now + CHECK_PERIOD])
+            self._wake_up.wait(min(CHECK_PERIOD, max(0, _next_sweep - time.time())))
+            self._wake_up.clear()
+
+    def _sweep(self, entry):
+        """
+        Execute a sweep of a Monitor
+
+        Args:
+            entry (_ScheduledPlatform): the platform
+        """
+        _sweep_start = time.time()
+        try:
+            entry.monitor._check_commands()
+            self._check_rate_limit(entry)
+            entry.monitor._sweep()
+            entry.monitor._instrumentation.observe(SWEEP_DURATION, time.time() - _sweep_start)
+        except Exception as e:
+            logging.error("[" + self.__class__.__name__ + "] An exception has occourred during the " +
+                          entry.platform + " sweep: " + str(e))
+        finally:
+            with self._condition:
+                entry.sweeping = False
+            self._wake_up.set()
+
+    def _check_rate_limit(self, entry):
+        """
+        Warn (once for each platform Monitor) if the rate limit of its provider doesn't allow
+        all the calls of a sweep before monitor_sweep_timeout, since the instances not
+        fetched in time are left for the next sweep
+
+        Args:
+            entry (_ScheduledPlatform): the platform
+        """
+        _rate_limiter = entry.monitor.rate_limiter
+        if _rate_limiter is None or entry.rate_limit_warned:
+            return
+        with self._condition:
+            # The platforms with the same name share the rate limit
+            _calls = sum(_other.monitor._calls_per_sweep() for _other in self._platforms
+                         if _other.platform == entry.platform and _other.monitor_running)
+        _allowed = _rate_limiter.rate * entry.monitor.conf.monitor_sweep_timeout
+        # The calls regarding an instance are reserved together, within the burst plus the sweep timeout
+        if _rate_limiter.capacity + _allowed < len(entry.monitor._monitored_metrics):
+            entry.rate_limit_warned = True
+            logging.warning("[" + self.__class__.__name__ + "] The " + entry.platform + " rate limit doesn't allow " +
+                            "the " + str(len(entry.monitor._monitored_metrics)) + " calls of an instance within " +
+                            "monitor_sweep_timeout seconds: no instance will be fetched")
+        elif _allowed < _calls:
+            entry.rate_limit_warned = True
+            logging.warning("[" + self.__class__.__name__ + "] The " + entry.platform + " rate limit allows " +
+                            str(int(_allowed)) + " calls in monitor_sweep_timeout seconds, while a sweep needs " +
+                            str(_calls) + " calls: some instances will be fetched only every few sweeps")
+
+    def _remove_stopped(self):
+        # Forget the platforms whose Monitor and RuleEngine are both stopped (must be
+        # called holding the lock)
+        self._platforms = [_entry for _entry in self._platforms if _entry.monitor_running or _entry.rule_engine_running]
+
+    # =============================================================================================== #
+    #                                           RuleEngines                                           #
+    # =============================================================================================== #
+
+    def _evaluate(self):
+        """
+        Rule evaluation stage: evaluate each message with the RuleEngine of its platform.
+        The commands received by a RuleEngine are applied before the next message
+        """
+        while True:
+            with self._condition:
+                _rule_engines = [_entry.rule_engine for _entry in self._platforms if _entry.rule_engine_running]
+            for _rule_engine in _rule_engines:
+                if _rule_engine._stop:
+                    self._stop_rule_engine(_rule_engine)
+                else:
+                    self._apply_commands(_rule_engine)
+            try:
+                _queue, message = self.measurements_queue.get(
+                    timeout=0.1 if any(_rule_engine._pending for _rule_engine in _rule_engines) else CHECK_PERIOD)
+            except Empty:
+                for _rule_engine in _rule_engines:
+                    _rule_engine._collect_results()
+                continue
+            _rule_engine = _queue.rule_engine
+            if _rule_engine is None or _rule_engine._stop:
+                # The RuleEngine has been stopped in the meantime
+                _queue.taken()
+                continue
+            _rule_engine._busy = True
+            _queue.taken()
+            try:
+                # The RuleEngine could have been registered after the commands check
+                self._apply_commands(_rule_engine)
+                _rule_engine._process_message(message)
+            except Exception as e:
+                logging.error("[" + self.__class__.__name__ + "] An exception has occourred while evaluating the rules: " + str(e))
+            finally:
+                _rule_engine._busy = False
+            for _rule_engine in _rule_engines:
+                _rule_engine._collect_results()
+
+    def _apply_commands(self, rule_engine):
+        """
+        Process the commands received by a RuleEngine
+
+        Args:
+            rule_engine (RuleEngine): the RuleEngine
+        """
+        while not rule_engine.commands_queue.empty():
+            _command = rule_engine.commands_queue.get()
+            logging.debug("[%s] Message received! %s", self.__class__.__name__, _command)
+            rule_engine._process_command(_command)
+
+    def _stop_rule_engine(self, rule_engine):
+        """
+        Stop evaluating the measurements of a RuleEngine
+
+        Args:
+            rule_engine (RuleEngine): the RuleEngine
+        """
+        rule_engine._stop_pool()
+        rule_engine.measurements_queue.rule_engine = None
+        with self._condition:
+            for _entry in self._platforms:
+                if _entry.rule_engine is rule_engine:
+                    _entry.rule_engine_running = False
+            self._remove_stopped()
+            self._condition.notify_all()
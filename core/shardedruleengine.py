@@ -0,0 +1,184 @@
+"""
+A RuleEngine split in many shards, each one executed by its own thread.
+Measurements are assigned to a shard using a hash of the instance id, so
+all the messages regarding an instance are always processed in order by
+the same shard, while different instances are processed in parallel.
+Commands regarding the rules are broadcast to all the shards.
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+import logging
+import zlib
+
+from core.ruleengine import RuleEngine
+from queue import Empty, Queue
+from threading import Thread
+
+
+class ShardedRuleEngine:
+
+    def __init__(self, conf, commands_queue, measurements_queue, agent_queue, shards, actions=None):
+        """
+        Init method
+
+        Args:
+            conf (MetaConfManager): a configuration manager holding all the settings
+                                    for the RuleEngine
+            commands_queue (Queue): message queue for communicating with the main
+                                    thread and receiving commands regarding the rules
+            measurements_queue (Queue): message queue for receiving measurements from
+                                        the platform monitor
+            agent_queue (Queue): message queue used for sending commands to the platform
+                                Agent
+            shards (int): number of RuleEngine shards
+            actions (str[]): the names of the actions available in the platform Agent
+                             (rules with other actions are rejected), None to accept any action
+        """
+        self.conf = conf
+        self.commands_queue = commands_queue
+        self.measurements_queue = measurements_queue
+        self.agent_queue = agent_queue
+        # Each shard receives both commands and measurements through the same queue,
+        # in the form ("command", <command>) or ("measurements", <message>), so that
+        # a command is always applied before the measurements received after it
+        self.shards = []
+        self._shards_queues = []
+        self._shards_threads = []
+        for i in range(shards):
+            self.shards.append(RuleEngine(conf=conf,
+                                          commands_queue=None,
+                                          measurements_queue=None,
+                                          agent_queue=agent_queue,
+                                          actions=actions))
+            self._shards_queues.append(Queue())
+            self._shards_threads.append(Thread(target=self._run_shard, args=(i,), daemon=True))
+        self._stop = False
+
+    def run(self):
+        """
+        Dispatcher main loop
+        """
+        for _shard_thread in self._shards_threads:
+            _shard_thread.start()
+        logging.debug("[" + self.__class__.__name__ + "] " + str(len(self.shards)) + " shards started")
+        # Wait for the init message
+        logging.debug("[" + self.__class__.__name__ + "] Waiting for init message...")
+        while not self._stop:
+            try:
+                message = self.commands_queue.get(block=True, timeout=3)
+                self.commands_queue.task_done()
+            except Empty:
+                logging.debug("[" + self.__class__.__name__ + "] No init message received...")
+                continue
+            # Process the message (or ignore it if it's not an init one)
+            if "command" in message and message["command"] == "init" and "rules" in message:
+                self._broadcast_command(message)
+                logging.debug("[" + self.__class__.__name__ + "] Init message received!")
+                break
+        # Normal thread execution
+        while not self._stop:
+            try:
+                # Broadcast any commands received between a message and another
+                # (commands have priority)
+                while not self.commands_queue.empty():
+                    command = self.commands_queue.get()
+                    logging.debug("[%s] Message received! %s", self.__class__.__name__, command)
+                    self._broadcast_command(command)
+                # Fetch a message from the monitor queue (or block the flow
+                # until a message is received)
+                message = self.measurements_queue.get(timeout=3)
+                # Send the message to its shard
+                self._route_message(message)
+            except Empty:
+                logging.debug("[" + self.__class__.__name__ + "] No new messages...")
+        # Wait for shards closure
+        for _shard_thread in self._shards_threads:
+            _shard_thread.join(5)
+
+    def stop(self):
+        """
+        Stop the dispatcher and all the shards
+        """
+        self._stop = True
+
+    def is_idle(self):
+        """
+        Check if all the measurements received have been evaluated by the shards
+
+        Returns:
+            bool: True if no measurements are waiting or being evaluated
+        """
+        if not self.measurements_queue.empty():
+            return False
+        for _shard, _shard_queue in zip(self.shards, self._shards_queues):
+            if not _shard_queue.empty() or _shard._busy or len(_shard._pending) > 0:
+                return False
+        return True
+
+    def _broadcast_command(self, command):
+        """
+        Send a command to all the shards
+
+        Args:
+            command (dict): A JSON-Formatted command
+        """
+        for _shard_queue in self._shards_queues:
+            _shard_queue.put(("command", command))
+
+    def _route_message(self, message):
+        """
+        Send a message received from the Monitor to the shard responsible for its instance
+
+        Args:
+            message (dict): a JSON-Formatted message
+        """
+        if "instance_id" in message:
+            self._shards_queues[self._get_shard_index(message["instance_id"])].put(("measurements", message))
+        else:
+            logging.error("[" + self.__class__.__name__ +
+                          "] Bad message received: " + str(message))
+
+    def _get_shard_index(self, instance_id):
+        """
+        Return the index of the shard responsible for an instance
+
+        Args:
+            instance_id (str): The instance id
+
+        Returns:
+            int: the shard index
+        """
+        return zlib.crc32(str(instance_id).encode()) % len(self.shards)
+
+    def _run_shard(self, index):
+        """
+        Shard main loop
+
+        Args:
+            index (int): the shard index
+        """
+        _shard = self.shards[index]
+        _shard_queue = self._shards_queues[index]
+        while not self._stop:
+            try:
+                _type, _message = _shard_queue.get(timeout=0.1 if _shard._pending else 3)
+            except Empty:
+                _shard._collect_results()
+                continue
+            if _type == "command":
+                _shard._process_command(_message)
+            else:
+                _shard._busy = True
+                try:
+                    _shard._process_message(_message)
+                finally:
+                    _shard._busy = False
+        _shard._stop_pool()
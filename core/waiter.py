@@ -0,0 +1,99 @@
+"""
+EasyCloud Waiter, used by the modules for waiting the completion of the
+asynchronous operations of a platform (e.g. a volume detach). The state of the
+resources is probed with an exponential backoff with jitter, until the operation
+is completed or a deadline is reached. Many resources can be waited at once,
+probing only the ones still pending.
+"""
+
+__author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
+__copyright__ = "Copyright (C) 2019"
+__credits__ = ["Andrea Lombardo", "Irene Lovotti"]
+__license__ = "GPL v3"
+__version__ = "0.10.0"
+__maintainer__ = "Luca Banzato"
+__email__ = "20005492@studenti.uniupo.it"
+__status__ = "Prototype"
+
+import logging
+import random
+import time
+
+# Default backoff parameters (seconds)
+INITIAL_DELAY = 1
+MAX_DELAY = 15
+BACKOFF_FACTOR = 2
+JITTER = 0.5
+
+
+def backoff_delays(initial_delay=INITIAL_DELAY, max_delay=MAX_DELAY, factor=BACKOFF_FACTOR, jitter=JITTER):
+    """
+    Generate the delays between two probes: each delay is the previous one
+    multiplied by factor (up to max_delay), randomly reduced by up to jitter
+    (a fraction of the delay), so that many waits don't probe all together
+
+    Args:
+        initial_delay (float): the first delay
+        max_delay (float): the maximum delay
+        factor (float): the backoff factor
+        jitter (float): the maximum fraction of the delay randomly removed
+
+    Returns:
+        generator: the delays (infinite)
+    """
+    _delay = initial_delay
+    while True:
+        yield _delay * (1 - random.uniform(0, jitter))
+        _delay = min(_delay * factor, max_delay)
+
+
+def wait_until(probe, timeout, description="operation", **backoff):
+    """
+    Wait until a probe is satisfied or the timeout is expired
+
+    Args:
+        probe (function): a function without arguments returning True once the
+                          operation is completed
+        timeout (float): the maximum number of seconds to wait
+        description (str): the operation description (used only for logging)
+        backoff (dict): the backoff parameters (see backoff_delays)
+
+    Returns:
+        bool: True if the operation is completed, False if the timeout is expired
+    """
+    return len(wait_until_all(lambda resources: [] if probe() else resources, [description],
+                              timeout, description=description, **backoff)) == 0
+
+
+def wait_until_all(probe, resources, timeout, description="operation", **backoff):
+    """
+    Wait until the operation on many resources is completed or the timeout is expired.
+    At each round the probe is called once with all the pending resources, so that
+    it can check them with a single request
+
+    Args:
+        probe (function): a function receiving the pending resources and returning
+                          the ones still pending
+        resources (object[]): the resources to wait
+        timeout (float): the maximum number of seconds to wait
+        description (str): the operation description (used only for logging)
+        backoff (dict): the backoff parameters (see backoff_delays)
+
+    Returns:
+        object[]: the resources still pending once the timeout is expired
+                  (empty if the operation is completed on all the resources)
+    """
+    _deadline = time.time() + timeout
+    _pending = list(resources)
+    _delays = backoff_delays(**backoff)
+    while len(_pending) > 0:
+        _pending = list(probe(_pending))
+        if len(_pending) == 0:
+            break
+        _remaining = _deadline - time.time()
+        if _remaining <= 0:
+            logging.warning("Timeout expired while waiting for " + description + " (" + str(len(_pending)) +
+                            " resources still pending)")
+            break
+        time.sleep(min(next(_delays), _remaining))
+    return _pending
@@ -2,12 +2,16 @@
 EasyCloud Launcher script
 """
 
+import atexit
 import logging
 import os
 import signal
 import sys
 
+from core.daemon import Daemon
 from core.easycloud import EasyCloud
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
 
 __author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
 __copyright__ = "Copyright (C) 2019"
@@ -20,6 +24,10 @@ __status__ = "Prototype"
 
 VERSION = "0.10.0 (Preview)"
 
+# Log level used until a platform is loaded (each platform can set its own
+# level using the log_level option)
+DEFAULT_LOG_LEVEL = logging.INFO
+
 
 def signal_handler(signal, frame):
     """
@@ -40,7 +48,8 @@ def help():
     """
     _help_message = "\n"
     _help_message += "EasyCloud " + VERSION + "\n"
-    _help_message += "Usage: easycloud.sh [--libcloud-debug] || [--no-libs-check] || [--help] || [--version]\n"
+    _help_message += "Usage: easycloud.sh [--libcloud-debug] || [--no-libs-check] || [--daemon <platform> [<rule> ...]] ||\n"
+    _help_message += "                    [--help] || [--version]\n"
     _help_message += "\n"
     _help_message += "Optional arguments:\n"
     _help_message += "    --libcloud-debug    display all the outgoing HTTP requests and all the\n"
@@ -48,7 +57,10 @@ def help():
     _help_message += "                        (This setting works only if the application has been executed using\n"
     _help_message += "                        the shipped shell script)\n"
     _help_message += "    --no-libs-check     disable the dependencies check for each module at the\n"
-    _help_message += "                        start of EasyCloud"
+    _help_message += "                        start of EasyCloud\n"
+    _help_message += "    --daemon            run the monitor of a platform (e.g. aws_libcloud) without\n"
+    _help_message += "                        the interactive menu, enabling the rules specified (all the\n"
+    _help_message += "                        rules if none is specified) until SIGTERM or SIGINT is received\n"
     _help_message += "    --help              display this message\n"
     _help_message += "    --version           display the application version\n"
     print(_help_message)
@@ -68,6 +80,34 @@ def run_debug():
     print("Debug Mode for Libcloud can only be activated through the shell script shipped with EasyCloud!")
 
 
+def setup_logging(level=DEFAULT_LOG_LEVEL, console=False):
+    """
+    Configure the application log. The records are put in a queue and written
+    to the log file by a dedicated thread, so that the file I/O never blocks
+    the thread logging them (e.g. the monitor)
+
+    Args:
+        level (int, optional): the log level (default: DEFAULT_LOG_LEVEL)
+        console (bool, optional): also write the records to the standard error
+                                  (e.g. collected by the systemd journal)
+    """
+    _formatter = logging.Formatter(fmt="[%(levelname)s] %(asctime)s - %(module)s(line %(lineno)d): %(message)s",
+                                   datefmt="%d/%m/%Y, %H:%M:%S")
+    _handlers = [logging.FileHandler("logs" + os.sep + "easycloud.log", mode="a")]
+    if console:
+        _handlers.append(logging.StreamHandler())
+    for _handler in _handlers:
+        _handler.setFormatter(_formatter)
+    _queue = Queue()
+    _listener = QueueListener(_queue, *_handlers)
+    _root_logger = logging.getLogger()
+    _root_logger.addHandler(QueueHandler(_queue))
+    _root_logger.setLevel(level)
+    _listener.start()
+    # Write the pending records before closing
+    atexit.register(_listener.stop)
+
+
 def run(no_libs_check=False):
     """
     Start EasyCloud
@@ -75,20 +115,30 @@ def run(no_libs_check=False):
     Args:
         no_libs_check (bool, optional): disable libraries check at each module loading phase (default: False)
     """
-    logging.basicConfig(filename="logs" + os.sep + "easycloud.log",
-                        format="[%(levelname)s] %(asctime)s - %(module)s(line %(lineno)d): %(message)s",
-                        datefmt="%d/%m/%Y, %H:%M:%S",
-                        level=logging.DEBUG,
-                        filemode="a")
+    setup_logging()
     signal.signal(signal.SIGINT, signal_handler)
     easycloud = EasyCloud()
     easycloud.start(no_libs_check=no_libs_check)
 
 
+def run_daemon(platform, rule_names=None):
+    """
+    Run the monitor of a platform without the interactive menu
+
+    Args:
+        platform (str): the platform module directory name (e.g. aws_libcloud)
+        rule_names (str[], optional): the rules to enable (default: all the rules)
+    """
+    setup_logging(console=True)
+    sys.exit(Daemon(platform, rule_names=rule_names).run())
+
+
 if __name__ == "__main__":
 
     if len(sys.argv) == 1:
         run()
+    elif len(sys.argv) >= 3 and sys.argv[1] == "--daemon":
+        run_daemon(sys.argv[2], rule_names=sys.argv[3:] if len(sys.argv) > 3 else None)
     elif len(sys.argv) == 2:
         if sys.argv[1] == "--libcloud-debug":
             run_debug()
@@ -15,7 +15,7 @@ PIP3="pip3"
 SCRIPT="easycloud_launcher.py"
 
 run() {
-    $PYTHON3 $SCRIPT $1
+    $PYTHON3 $SCRIPT "$@"
 }
 
 run_debug() {
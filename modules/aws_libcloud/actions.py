@@ -24,31 +24,40 @@ class AWSAgentActions:
         Args:
             self (MetaManager): The platform manager object
             instance_id (str): The id of the instance to clone
+
+        Returns:
+            bool: True if the instance has been cloned, False if the clone has been skipped
+                  (instance not running or already cloned)
+
+        Raises:
+            Exception: if the platform fails to clone the instance
         """
         if AWSAgentActions.is_clonable(self, instance_id):
             logging.debug("Cloning instance " + instance_id + "...")
-            try:
-                instance = self.ec2_client.list_nodes(ex_node_ids=[instance_id])[0]
-                # Clone only if the instance is running
-                if instance.state == "running":
-                    instance_clone = self.ec2_client.create_node(name=instance.name + "-clone-" + str(int(time.time())),
-                                                                 image=self.ec2_client.get_image(instance.extra["image_id"]),
-                                                                 size=self._get_instance_type_from_instance(instance),
-                                                                 ex_keyname=instance.extra["key_name"],
-                                                                 ex_security_groups=self._get_security_groups_from_instance(instance),
-                                                                 ex_mincount=1,
-                                                                 ex_maxcount=1)
-                    if instance_clone is None:
-                        logging.error("An error has occurred while cloning the instance " + instance_id + "!")
-                    else:
-                        self.cloned_instances.append(instance_id)
-                        logging.debug("Instance " + instance_id + " cloned successfully!")
-                else:
-                    logging.debug("The instance" + instance_id + " is not in a running state (currently: " + instance.state + "). Clonation aborted!")
-            except Exception as e:
-                logging.error("An error has occurred while cloning the instance " + instance_id + ": " + str(e))
+            instance = self.ec2_client.list_nodes(ex_node_ids=[instance_id])[0]
+            # Clone only if the instance is running
+            if instance.state == "running":
+                # The image could be missing from the catalogue if it doesn't match the filters
+                image = self._images_catalogue().get(instance.extra["image_id"])
+                if image is None:
+                    image = self.ec2_client.get_image(instance.extra["image_id"])
+                instance_clone = self.ec2_client.create_node(name=instance.name + "-clone-" + str(int(time.time())),
+                                                             image=image,
+                                                             size=self._get_instance_type_from_instance(instance),
+                                                             ex_keyname=instance.extra["key_name"],
+                                                             ex_security_groups=self._get_security_groups_from_instance(instance),
+                                                             ex_mincount=1,
+                                                             ex_maxcount=1)
+                if instance_clone is None:
+                    raise RuntimeError("the platform didn't return the clone")
+                self.cloned_instances.append(instance_id)
+                logging.debug("Instance " + instance_id + " cloned successfully!")
+                return True
+            else:
+                logging.debug("The instance" + instance_id + " is not in a running state (currently: " + instance.state + "). Clonation aborted!")
         else:
             logging.debug("The " + instance_id + " has already been cloned!")
+        return False
 
     def is_clonable(self, instance_id):
         """
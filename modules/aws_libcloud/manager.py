@@ -5,10 +5,11 @@ EasyCloud Amazon Web Services Manager
 # For a list of valid filters to use with the ex_filter parameter of certain methods,
 # please visit https://docs.aws.amazon.com/en_us/AWSEC2/latest/APIReference/API_Operations.html
 
-import time
-
 from core.actionbinder import bind_action
+from core.catalogue import get_catalogue
+from core.inventorycache import FLOATING_IPS, IMAGES, INSTANCES, KEY_PAIRS, NETWORKS, SECURITY_GROUPS, SIZES, VOLUMES, ZONES
 from core.metamanager import MetaManager
+from core.waiter import wait_until_all
 from libcloud.compute.providers import get_driver
 from libcloud.compute.types import Provider
 from modules.aws_libcloud.actions import AWSAgentActions
@@ -28,6 +29,9 @@ __status__ = "Prototype"
 
 class AWS(MetaManager):
 
+    # Maximum number of instance ids sent in a single DescribeInstances request
+    MAX_DESCRIBE_INSTANCES_IDS = 200
+
     def __init__(self):
         super().__init__()
         self.platform_name = "Amazon Web Services"
@@ -35,6 +39,9 @@ class AWS(MetaManager):
         self.cloned_instances = []
         # self.snapshots = None
         self.connect()
+        # Read the catalogues stored by the previous executions, revalidating them in background
+        for catalogue in (self._images_catalogue(), self._sizes_catalogue(), self._zones_catalogue()):
+            catalogue.warm_up()
 
     # =============================================================================================== #
     #                                Platform-specific client creation                                #
@@ -44,11 +51,70 @@ class AWS(MetaManager):
         """
         Connection to Amazon Web Services
         """
+        self.ec2_client = self._create_client()
+
+    def _create_client(self):
+        """
+        Create a new client for the region specified in the configuration file
+
+        Returns:
+            EC2NodeDriver: the client
+        """
         cls = get_driver(Provider.EC2)
-        self.ec2_client = cls(self.conf.ec2_access_key_id,
-                              self.conf.ec2_secret_access_key,
-                              token=self.conf.ec2_session_token,
-                              region=self.conf.ec2_default_region)
+        return cls(self.conf.ec2_access_key_id,
+                   self.conf.ec2_secret_access_key,
+                   token=self.conf.ec2_session_token,
+                   region=self.conf.ec2_default_region)
+
+    def _images_catalogue(self):
+        """
+        Return the catalogue of the images of the region (free-tier or filtered images,
+        according to the configuration), shared by all the managers of the process
+
+        Returns:
+            Catalogue: the images catalogue, indexed by image id
+        """
+        if self.conf.freetier_only:
+            return get_catalogue(self.platform_name, self.conf.ec2_default_region, IMAGES,
+                                 loader=lambda: self._create_client().list_images(ex_image_ids=self.conf.freetier_images_ids),
+                                 key=lambda image: image.id,
+                                 refresh_interval=self.conf.catalogue_refresh_interval,
+                                 client=lambda: self.ec2_client,
+                                 signature="freetier:" + str(self.conf.freetier_images_ids))
+        return get_catalogue(self.platform_name, self.conf.ec2_default_region, IMAGES,
+                             loader=lambda: self._create_client().list_images(ex_filters={"name": self.conf.images_filters}),
+                             key=lambda image: image.id,
+                             refresh_interval=self.conf.catalogue_refresh_interval,
+                             client=lambda: self.ec2_client,
+                             signature="filters:" + str(self.conf.images_filters))
+
+    def _sizes_catalogue(self):
+        """
+        Return the catalogue of the instance types of the region, shared by all the
+        managers of the process and refreshed in background using a dedicated client
+
+        Returns:
+            Catalogue: the instance types catalogue, indexed by instance type id
+        """
+        return get_catalogue(self.platform_name, self.conf.ec2_default_region, SIZES,
+                             loader=lambda: self._create_client().list_sizes(),
+                             key=lambda instance_type: instance_type.id,
+                             refresh_interval=self.conf.catalogue_refresh_interval,
+                             client=lambda: self.ec2_client)
+
+    def _zones_catalogue(self):
+        """
+        Return the catalogue of the availability zones of the region, shared by all the
+        managers of the process
+
+        Returns:
+            Catalogue: the availability zones catalogue, indexed by zone name
+        """
+        return get_catalogue(self.platform_name, self.conf.ec2_default_region, ZONES,
+                             loader=lambda: self._create_client().list_locations(),
+                             key=lambda avail_zone: avail_zone.availability_zone.name,
+                             refresh_interval=self.conf.catalogue_refresh_interval,
+                             client=lambda: self.ec2_client)
 
     # =============================================================================================== #
     #                                  Platform-specific list printers                                #
@@ -65,13 +131,8 @@ class AWS(MetaManager):
         Print all available images
         Format: "ID", "Name", Image ID", "State"
         """
-        if self.conf.freetier_only:
-            # Use free-tier images
-            self.images = self.ec2_client.list_images(ex_image_ids=self.conf.freetier_images_ids)
-        else:
-            # Use image filters
-            self.images = self.ec2_client.list_images(
-                ex_filters={"name": self.conf.images_filters})
+        # Free-tier or filtered images, according to the configuration
+        self.images = self._images_catalogue().list()
         i = 1
         table_body = []
         for image in self.images:
@@ -84,7 +145,7 @@ class AWS(MetaManager):
         Print all available images
         Format: "ID", "Name", Zone State", "Region Name"
         """
-        self.avail_zones = self.ec2_client.list_locations()
+        self.avail_zones = self._zones_catalogue().list()
         i = 1
         table_body = []
         for avail_zone in self.avail_zones:
@@ -98,7 +159,7 @@ class AWS(MetaManager):
         Print all instance types
         Format: "ID", "Instance Type ID", "vCPUs", "Ram (GB)", "Disk (GB)"
         """
-        self.instance_types = self.ec2_client.list_sizes()
+        self.instance_types = self._sizes_catalogue().list()
         if self.conf.freetier_only:
             filtered_instance_types = []
             for instance_type in self.instance_types:
@@ -120,7 +181,7 @@ class AWS(MetaManager):
         Format: "ID", "SG name", "SG description"
         """
         # Here a list of str is returned (the docs say list of EC2SecurityGroup)
-        self.security_groups = self.ec2_client.ex_list_security_groups()
+        self.security_groups = self._cached(SECURITY_GROUPS, self.ec2_client.ex_list_security_groups)
         i = 1
         table_body = []
         for security_group in self.security_groups:
@@ -133,7 +194,7 @@ class AWS(MetaManager):
         Print id and other useful informations of all networks available
         Format: "ID", "Network name", "Description"
         """
-        self.networks = self.ec2_client.ex_list_networks()
+        self.networks = self._cached(NETWORKS, self.ec2_client.ex_list_networks)
         i = 1
         table_body = []
         for network in self.networks:
@@ -146,7 +207,7 @@ class AWS(MetaManager):
         Print all key pairs
         Format: "ID", "Key name", "Key fingerprint"
         """
-        self.key_pairs = self.ec2_client.list_key_pairs()
+        self.key_pairs = self._cached(KEY_PAIRS, self.ec2_client.list_key_pairs)
         i = 1
         table_body = []
         for key_pair in self.key_pairs:
@@ -159,7 +220,7 @@ class AWS(MetaManager):
         Print instance id, image id, IP address and state for each active instance
         Format: "ID", "Instance Name", "Instance ID", "IP address", "Status", "Key Name", "Avail. Zone"
         """
-        self.instances = self.ec2_client.list_nodes()
+        self.instances = self._cached(INSTANCES, self.ec2_client.list_nodes)
         i = 1
         table_body = []
         for instance in self.instances:
@@ -175,15 +236,17 @@ class AWS(MetaManager):
         Print volumes alongside informations regarding attachments
         Format: "Volume ID", "Creation", "Size (GB)", "Attached To", "Status"
         """
-        self.volumes = self.ec2_client.list_volumes()
+        self.volumes = self._cached(VOLUMES, self.ec2_client.list_volumes)
+        nodes = self._get_nodes_by_id([volume.extra["instance_id"] for volume in self.volumes])
         i = 1
         table_body = []
         for volume in self.volumes:
             created_at = volume.extra["create_time"].strftime("%b %d %Y, %H:%M:%S") + " UTC"
             if volume.extra["instance_id"] is not None:
-                node = self.ec2_client.list_nodes(ex_node_ids=[volume.extra["instance_id"]])[0]
+                node = nodes.get(volume.extra["instance_id"])
+                node_name = node.name if node is not None else volume.extra["instance_id"]
                 table_body.append([i, volume.name, volume.id, created_at, volume.size,
-                                   node.name + " (" + volume.extra["device"] + ")", volume.state, volume.extra["zone"]])
+                                   node_name + " (" + volume.extra["device"] + ")", volume.state, volume.extra["zone"]])
             else:
                 table_body.append([i, volume.name, volume.id, created_at, volume.size,
                                    "- (-)", volume.state, volume.extra["zone"]])
@@ -195,12 +258,13 @@ class AWS(MetaManager):
         Print ip and other useful information of all floating ip available
         Format: ""ID", "Public Ip", "Floating IP ID", "Associated Instance"
         """
-        self.floating_ips = self.ec2_client.ex_describe_all_addresses()
+        self.floating_ips = self._cached(FLOATING_IPS, self.ec2_client.ex_describe_all_addresses)
+        nodes = self._get_nodes_by_id([floating_ip.instance_id for floating_ip in self.floating_ips])
         i = 1
         table_body = []
         for floating_ip in self.floating_ips:
             if(floating_ip.instance_id is not None):
-                node = self.ec2_client.list_nodes(ex_node_ids=[floating_ip.instance_id])[0]
+                node = nodes.get(floating_ip.instance_id)
                 if(node is not None):
                     table_body.append([i, floating_ip.ip, floating_ip.extra["allocation_id"], node.name, "n/a"])
                 else:
@@ -214,7 +278,36 @@ class AWS(MetaManager):
     #                                Platform-specific list builders                                  #
     # =============================================================================================== #
 
-    # Nothing here
+    def _get_nodes_by_id(self, node_ids):
+        """
+        Resolve many instance ids with a few DescribeInstances requests (each one
+        containing up to MAX_DESCRIBE_INSTANCES_IDS ids)
+
+        Args:
+            node_ids (str[]): The instances ids (duplicates and None values are ignored)
+
+        Returns:
+            dict: a structure in the form {<instance_id>: <node>}, not containing
+                  the ids that cannot be resolved
+        """
+        _node_ids = sorted(set([node_id for node_id in node_ids if node_id is not None]))
+        nodes = {}
+        for i in range(0, len(_node_ids), self.MAX_DESCRIBE_INSTANCES_IDS):
+            _chunk = _node_ids[i:i + self.MAX_DESCRIBE_INSTANCES_IDS]
+            try:
+                _chunk_nodes = self.ec2_client.list_nodes(ex_node_ids=_chunk)
+            except Exception:
+                # A single unknown id makes the whole request fail, so the ids
+                # of this chunk are resolved one at a time
+                _chunk_nodes = []
+                for node_id in _chunk:
+                    try:
+                        _chunk_nodes.extend(self.ec2_client.list_nodes(ex_node_ids=[node_id]))
+                    except Exception:
+                        pass
+            for node in _chunk_nodes:
+                nodes[node.id] = node
+        return nodes
 
     # =============================================================================================== #
     #                                       Actions and Menus                                         #
@@ -327,21 +420,26 @@ class AWS(MetaManager):
         """
         result = self.ec2_client.detach_volume(volume)
         if result:
-            while True:
-                # No direct way to refresh a Volume status, so we look if
-                # it is still attached to its previous instance
-                node = self.ec2_client.list_nodes(ex_node_ids=[volume.extra["instance_id"]])[0]
-                node_volumes = self.ec2_client.list_volumes(node=node)
-                is_present = False
-                for node_volume in node_volumes:
-                    if node_volume.id == volume.id:
-                        is_present = True
-                        break
-                if not is_present:
-                    break
-                time.sleep(3)
+            result = len(self._wait_for_volumes_detached([volume])) == 0
         return result
 
+    def _wait_for_volumes_detached(self, volumes):
+        """
+        Wait until some volumes are detached from their instances (all the
+        volumes are checked with a single request at each round)
+
+        Args:
+            volumes (<volume>[]): The volumes being detached
+
+        Returns:
+            <volume>[]: The volumes still attached once the timeout is expired
+        """
+        def probe(pending):
+            _updated_volumes = self.ec2_client.list_volumes(ex_filters={"volume-id": [volume.id for volume in pending]})
+            _attached_ids = set(volume.id for volume in _updated_volumes if self._platform_is_volume_attached(volume))
+            return [volume for volume in pending if volume.id in _attached_ids]
+        return wait_until_all(probe, volumes, self.conf.wait_timeout, description="volumes detach")
+
     def _platform_delete_volume(self, volume):
         """
         Delete a volume using the Amazon Web Services API
@@ -444,16 +542,25 @@ class AWS(MetaManager):
         """
         result = self.ec2_client.ex_disassociate_address(floating_ip, domain="vpc")
         if(result):
-            while True:
-                # No direct way to refresh a Floating IP, so we look if
-                # it is still attached to its previous instance
-                node = self.ec2_client.list_nodes(ex_node_ids=[floating_ip.instance_id])[0]
-                node_floating_ips = self.ec2_client.ex_describe_addresses_for_node(node)
-                if floating_ip.ip not in node_floating_ips:
-                    break
-                time.sleep(3)
+            result = len(self._wait_for_floating_ips_detached([floating_ip])) == 0
         return result
 
+    def _wait_for_floating_ips_detached(self, floating_ips):
+        """
+        Wait until some floating IPs are detached from their instances (all the
+        floating IPs are checked with a single request at each round)
+
+        Args:
+            floating_ips (<floating_ip>[]): The floating IPs being detached
+
+        Returns:
+            <floating_ip>[]: The floating IPs still assigned once the timeout is expired
+        """
+        def probe(pending):
+            _assigned_ips = set(address.ip for address in self.ec2_client.ex_describe_all_addresses(only_associated=True))
+            return [floating_ip for floating_ip in pending if floating_ip.ip in _assigned_ips]
+        return wait_until_all(probe, floating_ips, self.conf.wait_timeout, description="floating IPs detach")
+
     def _platform_release_floating_ip(self, floating_ip):
         """
         Release a floating IP using the Amazon Web Services API
@@ -536,10 +643,7 @@ class AWS(MetaManager):
         Returns:
             NodeSize: an instance type object, None if it can't be determined
         """
-        for instance_type in self.ec2_client.list_sizes():
-            if instance_type.id == instance.extra["instance_type"]:
-                return instance_type
-        return None
+        return self._sizes_catalogue().get(instance.extra["instance_type"])
 
     def _platform_extra_menu(self):
         """
@@ -615,7 +719,10 @@ class AWS(MetaManager):
         """
         Clone instance
         """
-        AWSAgentActions.clone_instance(self, instance_id)
+        try:
+            return AWSAgentActions.clone_instance(self, instance_id)
+        finally:
+            self.inventory.invalidate(INSTANCES, VOLUMES)
 
     @bind_action("AWS", "alarm")
     def alarm(self, resource_id):
@@ -3,6 +3,7 @@ AWS monitor implementation (using Boto3 API)
 """
 
 import boto3
+import collections
 import datetime
 import logging
 import pytz
@@ -22,6 +23,9 @@ __status__ = "Prototype"
 
 class AWSMonitor(MetaMonitor):
 
+    # Maximum number of queries allowed by CloudWatch in a single GetMetricData request
+    MAX_METRIC_DATA_QUERIES = 500
+
     def __init__(self, conf, commands_queue, measurements_queue):
         """
         Init method
@@ -46,6 +50,9 @@ class AWSMonitor(MetaMonitor):
         # self._bind_generic_metric_to_getter(
         #    name="memory_used", function=self._get_memory_used_measures)
         #
+        # Association between generic metric name and CloudWatch metric name and unit,
+        # used by the batch getter
+        self._batch_metrics = {"cpu_load": ("CPUUtilization", "Percent")}
         logging.debug("[AWS MONITOR GETTERS]: " + str(self._metrics_getters))
 
     def connect(self):
@@ -71,22 +78,13 @@ class AWSMonitor(MetaMonitor):
         Returns:
             dict: A structure containing all the measurements for a metric
         """
-        logging.debug("Fetching metric \"" + metric + "\" with granularity=" + str(granularity) + " and limit=" + str(limit))
-        # Define time interval for retrieving metrics
-        start_time_local = datetime.datetime.now() - datetime.timedelta(seconds=(granularity * limit) + granularity * 2)
-        end_time_local = datetime.datetime.now()
-        local_tz = get_localzone()  # Detect current timezone
-        # Convert local time to UTC
-        start_time_no_tz = local_tz.localize(start_time_local, is_dst=None)  # No daylight saving time
-        end_time_no_tz = local_tz.localize(end_time_local, is_dst=None)  # No daylight saving time
-        # Final times
-        start_time_utc = start_time_no_tz.astimezone(pytz.utc)
-        end_time_utc = end_time_no_tz.astimezone(pytz.utc)
+        logging.debug("Fetching metric \"%s\" with granularity=%s and limit=%s", metric, granularity, limit)
+        start_time_utc, end_time_utc = self._get_time_interval(granularity, limit)
 
         _samples = []
 
         try:
-            logging.debug("Instance ID: " + str(instance_id))
+            logging.debug("Instance ID: %s", instance_id)
             # logging.debug("FETCHING METRIC " + metric + ": " + str(instance_resources))
             _random_measurements_values = self.cloudwatch_client.get_metric_statistics(Namespace='AWS/EC2',
                                                                                        MetricName=metric,
@@ -104,13 +102,90 @@ class AWSMonitor(MetaMonitor):
                 _samples.append(self._build_message(timestamp=_value["Timestamp"],
                                                     value=_value["Average"],
                                                     unit=_value["Unit"]))
-            logging.debug("MEASUREMENTS: " + str(_samples))
+            logging.debug("MEASUREMENTS: %s", _samples)
         except Exception as _exception:
             _samples.append(self._error_sample(_exception))
             raise _exception
 
         return _samples
 
+    def _get_batch_samples(self, instance_ids, metric_names, limit, granularity):
+        """
+        CloudWatch batch measurements getter. All the (instance, metric) pairs are fetched
+        using GetMetricData requests, each one containing up to MAX_METRIC_DATA_QUERIES queries
+
+        Args:
+            instance_ids (str[]): The ids of the instances to fetch the measurements
+            metric_names (str[]): The *generic* metrics names
+            limit (int): The maximum number of measurements returned for each metric
+            granularity (int): The granularity of the measurements fetched, expressed in seconds
+
+        Returns:
+            dict: A structure in the form {<instance_id>: {<metric_name>: [<measurement>, ...]}}
+        """
+        start_time_utc, end_time_utc = self._get_time_interval(granularity, limit)
+        # Build a query for each (instance, metric) pair
+        _queries = []
+        _queries_pairs = {}  # Association between query id and (instance, metric) pair
+        for _metric_name in metric_names:
+            if _metric_name not in self._batch_metrics:
+                continue
+            _metric, _ = self._batch_metrics[_metric_name]
+            for _instance_id in instance_ids:
+                _query_id = "q" + str(len(_queries))
+                _queries.append({"Id": _query_id,
+                                 "MetricStat": {"Metric": {"Namespace": "AWS/EC2",
+                                                           "MetricName": _metric,
+                                                           "Dimensions": [{"Name": "InstanceId", "Value": _instance_id}]},
+                                                "Period": granularity,
+                                                "Stat": "Average"},
+                                 "ReturnData": True})
+                _queries_pairs[_query_id] = (_instance_id, _metric_name)
+        logging.debug("Fetching %s metrics with granularity=%s and limit=%s", len(_queries), granularity, limit)
+        # Send the queries (the results of a request can be split in many pages)
+        _datapoints = collections.defaultdict(list)
+        for i in range(0, len(_queries), self.MAX_METRIC_DATA_QUERIES):
+            _request = {"MetricDataQueries": _queries[i:i + self.MAX_METRIC_DATA_QUERIES],
+                        "StartTime": start_time_utc,
+                        "EndTime": end_time_utc}
+            while True:
+                _response = self.cloudwatch_client.get_metric_data(**_request)
+                for _result in _response["MetricDataResults"]:
+                    _datapoints[_queries_pairs[_result["Id"]]] += zip(_result["Timestamps"], _result["Values"])
+                if "NextToken" not in _response:
+                    break
+                _request["NextToken"] = _response["NextToken"]
+        # Split the results for each instance
+        _samples = collections.defaultdict(dict)
+        for _instance_id, _metric_name in _queries_pairs.values():
+            _, _unit = self._batch_metrics[_metric_name]
+            # Sort all the data (data can be unordered) and extract the most recent limit-values
+            _measurements_values = sorted(_datapoints[(_instance_id, _metric_name)], key=lambda x: x[0])[-limit:]
+            _samples[_instance_id][_metric_name] = [self._build_message(timestamp=_timestamp, value=_value, unit=_unit)
+                                                    for _timestamp, _value in _measurements_values]
+        return _samples
+
+    def _get_time_interval(self, granularity, limit):
+        """
+        Return the time interval (in UTC) to use for retrieving the measurements
+
+        Args:
+            granularity (int): The granularity of the measurements fetched, expressed in seconds
+            limit (int): The maximum number of measurements returned
+
+        Returns:
+            datetime, datetime: the start and the end of the interval
+        """
+        # Define time interval for retrieving metrics
+        start_time_local = datetime.datetime.now() - datetime.timedelta(seconds=(granularity * limit) + granularity * 2)
+        end_time_local = datetime.datetime.now()
+        local_tz = get_localzone()  # Detect current timezone
+        # Convert local time to UTC
+        start_time_no_tz = local_tz.localize(start_time_local, is_dst=None)  # No daylight saving time
+        end_time_no_tz = local_tz.localize(end_time_local, is_dst=None)  # No daylight saving time
+        # Final times
+        return start_time_no_tz.astimezone(pytz.utc), end_time_no_tz.astimezone(pytz.utc)
+
     # Please visit https://docs.aws.amazon.com/en_us/AmazonCloudWatch/latest/monitoring/viewing_metrics_with_cloudwatch.html
     # in order to get the specific metric name for a generic metric (e.g. cpu_load -> CPUUtilization)
 
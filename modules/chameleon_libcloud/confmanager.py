@@ -40,9 +40,10 @@ class ChameleonCloudConfManager(MetaConfManager):
         logging.debug("OpenStack login data read")
 
     def read_platform_options(self):
-        self.demo_reservation_id = self.get_parameter("re_demo", "demo_reservation_id", return_type=str)
         """
         Read platform-specific options from settings.cfg
         """
-        # Nothing to do here
-        pass
+        self.demo_reservation_id = self.get_parameter("re_demo", "demo_reservation_id", return_type=str)
+        # Gnocchi settings
+        self.metrics_cache_ttl = self.get_parameter("gnocchi", "metrics_cache_ttl", return_type=int, default=3600)
+        logging.debug("OpenStack platform options read")
@@ -2,9 +2,11 @@
 Chameleon Cloud monitor implementation (using Gnocchi API)
 """
 
+import collections
 import datetime
 import logging
 import pytz
+import time
 
 from core.metamonitor import MetaMonitor
 from gnocchiclient.v1 import client
@@ -43,6 +45,13 @@ class ChameleonCloudMonitor(MetaMonitor):
             name="memory_free", function=self._get_memory_free_measures)
         self._bind_generic_metric_to_getter(
             name="memory_used", function=self._get_memory_used_measures)
+        # Association between generic metric name and Gnocchi metric name,
+        # used by the batch getter
+        self._batch_metrics = {"cpu_load": "load@load",
+                               "memory_free": "memory@memory.free",
+                               "memory_used": "memory@memory.used"}
+        # Metrics details cache, in the form {(<instance_id>, <metric>): (<expiration>, <metric_id>, <unit>)}
+        self._metrics_cache = {}
         logging.debug("[CHAMELEON CLOUD MONITOR GETTERS]: " + str(self._metrics_getters))
 
     def connect(self):
@@ -72,33 +81,19 @@ class ChameleonCloudMonitor(MetaMonitor):
             dict: A structure containing all the measurements for a metric
         """
         logging.debug("Fetching metric \"" + metric + "\" with granularity=" + str(granularity) + " and limit=" + str(limit))
-        # Define time interval for retrieving metrics
-        start_time_local = datetime.datetime.now() - datetime.timedelta(seconds=(granularity * limit) + granularity * 2)
-        end_time_local = datetime.datetime.now()
-        local_tz = get_localzone()  # Detect current timezone
-        # Convert local time to UTC
-        start_time_no_tz = local_tz.localize(
-            start_time_local, is_dst=None)  # No daylight saving time
-        end_time_no_tz = local_tz.localize(
-            end_time_local, is_dst=None)  # No daylight saving time
-        # Final times
-        start_time_utc = start_time_no_tz.astimezone(pytz.utc)
-        end_time_utc = end_time_no_tz.astimezone(pytz.utc)
+        start_time_utc, end_time_utc = self._get_time_interval(granularity, limit)
 
         _samples = []
 
         try:
-            instance_resources = self.gnocchi_client.resource.get("generic", instance_id)
+            _metric_id, _metric_unit = self._get_metric_details(instance_id, metric)
             logging.debug("Instance ID: " + str(instance_id))
-            # logging.debug("FETCHING METRIC " + metric + ": " + str(instance_resources))
             _random_measurements_values = self.gnocchi_client.metric.get_measures(
-                instance_resources["metrics"][metric], start=start_time_utc, end=end_time_utc, granularity=granularity)
+                _metric_id, start=start_time_utc, end=end_time_utc, granularity=granularity)
             # Sort all the data (sometimes data can be unrodered)
             _random_measurements_values.sort(key=lambda x: x[0])
             # Extract the most recent limit-values
             _measurements_values = _random_measurements_values[-limit:]
-            _metric_unit = self.gnocchi_client.metric.get(
-                instance_resources["metrics"][metric])["unit"]
             # Add the measurements to the list that will be returned
             for _value in _measurements_values:
                 _samples.append(self._build_message(timestamp=_value[0],
@@ -113,6 +108,126 @@ class ChameleonCloudMonitor(MetaMonitor):
 
         return _samples
 
+    def _get_batch_samples(self, instance_ids, metric_names, limit, granularity):
+        """
+        Gnocchi batch measurements getter. The measurements of all the metrics of all
+        the instances are fetched with a single request to the aggregates endpoint
+
+        Args:
+            instance_ids (str[]): The ids of the instances to fetch the measurements
+            metric_names (str[]): The *generic* metrics names
+            limit (int): The maximum number of measurements returned for each metric
+            granularity (int): The granularity of the measurements fetched, expressed in seconds
+
+        Returns:
+            dict: A structure in the form {<instance_id>: {<metric_name>: [<measurement>, ...]}}
+        """
+        _metrics = [_metric_name for _metric_name in metric_names if _metric_name in self._batch_metrics]
+        if len(_metrics) == 0:
+            return {}
+        start_time_utc, end_time_utc = self._get_time_interval(granularity, limit)
+        # e.g. (metric ((load@load mean) (memory@memory.free mean)))
+        _operations = "(metric (" + " ".join(["(" + self._batch_metrics[_metric_name] + " mean)"
+                                               for _metric_name in _metrics]) + "))"
+        logging.debug("Fetching " + _operations + " for all the instances with granularity=" +
+                      str(granularity) + " and limit=" + str(limit))
+        _result = self.gnocchi_client.aggregates.fetch(_operations,
+                                                       search={"in": {"id": instance_ids}},
+                                                       resource_type="generic",
+                                                       start=start_time_utc,
+                                                       stop=end_time_utc,
+                                                       granularity=granularity)
+        _measures = _result.get("measures", {})
+        _samples = collections.defaultdict(dict)
+        for instance_id in instance_ids:
+            for _metric_name in _metrics:
+                metric = self._batch_metrics[_metric_name]
+                try:
+                    _, _metric_unit = self._get_metric_details(instance_id, metric)
+                    _random_measurements_values = list(_measures.get(instance_id, {}).get(metric, {}).get("mean", []))
+                    # Sort all the data (sometimes data can be unrodered)
+                    _random_measurements_values.sort(key=lambda x: x[0])
+                    _samples[instance_id][_metric_name] = [self._build_message(timestamp=_value[0],
+                                                                               value=_value[2],
+                                                                               unit=_metric_unit)
+                                                           for _value in _random_measurements_values[-limit:]]
+                except Exception as _exception:
+                    _samples[instance_id][_metric_name] = [self._error_sample(_exception)]
+        return _samples
+
+    def _get_metric_details(self, instance_id, metric):
+        """
+        Return the Gnocchi id and the unit of a metric of an instance. Details are
+        requested only if not cached or if the cached ones are expired
+
+        Args:
+            instance_id (str): The id of the instance
+            metric (str): The *specific* metric name
+
+        Returns:
+            str, str: The metric id and the metric unit
+        """
+        _cached = self._metrics_cache.get((instance_id, metric))
+        if _cached is not None and _cached[0] > time.time():
+            return _cached[1], _cached[2]
+        instance_resources = self.gnocchi_client.resource.get("generic", instance_id)
+        _metric_id = instance_resources["metrics"][metric]
+        _metric_unit = self.gnocchi_client.metric.get(_metric_id)["unit"]
+        self._metrics_cache[(instance_id, metric)] = (time.time() + self.conf.metrics_cache_ttl, _metric_id, _metric_unit)
+        return _metric_id, _metric_unit
+
+    def _invalidate_metrics_cache(self, instance_id):
+        """
+        Remove all the cached metrics details of an instance
+
+        Args:
+            instance_id (str): The id of the instance
+        """
+        for _key in [_key for _key in self._metrics_cache if _key[0] == instance_id]:
+            self._metrics_cache.pop(_key, None)
+
+    def _add_monitored_instance(self, instance_id):
+        """
+        Args:
+            instance_id (str): The instance id to add to the monitored instances list
+        """
+        self._invalidate_metrics_cache(instance_id)
+        super()._add_monitored_instance(instance_id)
+
+    def _remove_monitored_instance(self, instance_id):
+        """
+        Remove a instance id inside the monitored instances list
+
+        Args:
+            instance_id (str): The instance id (intended as instance id) to remove from the
+                               monitored instances list
+        """
+        self._invalidate_metrics_cache(instance_id)
+        super()._remove_monitored_instance(instance_id)
+
+    def _get_time_interval(self, granularity, limit):
+        """
+        Return the time interval (in UTC) to use for retrieving the measurements
+
+        Args:
+            granularity (int): The granularity of the measurements fetched, expressed in seconds
+            limit (int): The maximum number of measurements returned
+
+        Returns:
+            datetime, datetime: the start and the end of the interval
+        """
+        # Define time interval for retrieving metrics
+        start_time_local = datetime.datetime.now() - datetime.timedelta(seconds=(granularity * limit) + granularity * 2)
+        end_time_local = datetime.datetime.now()
+        local_tz = get_localzone()  # Detect current timezone
+        # Convert local time to UTC
+        start_time_no_tz = local_tz.localize(
+            start_time_local, is_dst=None)  # No daylight saving time
+        end_time_no_tz = local_tz.localize(
+            end_time_local, is_dst=None)  # No daylight saving time
+        # Final times
+        return start_time_no_tz.astimezone(pytz.utc), end_time_no_tz.astimezone(pytz.utc)
+
     # For the complete metrics list available for each instance, please use the
     # res_viewer.py script available in the module main directory, after
     # filling all the required authentication parameters
@@ -24,27 +24,32 @@ class GCPAgentActions:
         Args:
             self (MetaManager): The platform manager object
             instance_id (str): The id of the instance to clone
+
+        Returns:
+            bool: True if the instance has been cloned, False if the clone has been skipped
+                  (instance not running or already cloned)
+
+        Raises:
+            Exception: if the platform fails to clone the instance
         """
         if GCPAgentActions.is_clonable(self, instance_id):
             logging.debug("Cloning instance " + instance_id + "...")
-            try:
-                instance = self.gcp_client.ex_get_node(instance_id)
-                # Clone only if the instance is running
-                if instance.state == "running":
-                    instance_clone = self.gcp_client.create_node(name=instance.name + "-clone-" + str(int(time.time())),
-                                                                 size=instance.size,
-                                                                 image=instance.image)
-                    if instance_clone is None:
-                        logging.error("An error has occurred while cloning the instance " + instance_id + "!")
-                    else:
-                        self.cloned_instances.append(instance_id)
-                        logging.debug("Instance " + instance_id + " cloned successfully!")
-                else:
-                    logging.debug("The instance" + instance_id + " is not in a running state (currently: " + instance.state + "). Clonation aborted!")
-            except Exception as e:
-                logging.error("An error has occurred while cloning the instance " + instance_id + ": " + str(e))
+            instance = self.gcp_client.ex_get_node(instance_id)
+            # Clone only if the instance is running
+            if instance.state == "running":
+                instance_clone = self.gcp_client.create_node(name=instance.name + "-clone-" + str(int(time.time())),
+                                                             size=self._sizes_catalogue().get(instance.size) or instance.size,
+                                                             image=self._images_catalogue().get(instance.image) or instance.image)
+                if instance_clone is None:
+                    raise RuntimeError("the platform didn't return the clone")
+                self.cloned_instances.append(instance_id)
+                logging.debug("Instance " + instance_id + " cloned successfully!")
+                return True
+            else:
+                logging.debug("The instance" + instance_id + " is not in a running state (currently: " + instance.state + "). Clonation aborted!")
         else:
             logging.error("The " + instance_id + " has already been cloned!")
+        return False
 
     def is_clonable(self, instance_id):
         """
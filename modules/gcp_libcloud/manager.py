@@ -2,18 +2,24 @@
 EasyCloud Google Cloud Platform Manager
 """
 
+import collections
 import datetime
+import logging
 import pytz
 import re
-import time
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from core.actionbinder import bind_action
+from core.catalogue import get_catalogue
+from core.inventorycache import FLOATING_IPS, IMAGES, INSTANCES, NETWORKS, SIZES, VOLUMES, ZONES
 from core.metamanager import MetaManager
+from core.waiter import wait_until_all
 from libcloud.compute.providers import get_driver
 from libcloud.compute.types import Provider
 from modules.gcp_libcloud.actions import GCPAgentActions
 from modules.gcp_libcloud.confmanager import GCPConfManager
 from modules.gcp_libcloud.monitor import GCPMonitor
+from queue import Empty, Queue
 from tui.simpletui import SimpleTUI
 
 __author__ = "Davide Monfrecola, Stefano Garione, Giorgio Gambino, Luca Banzato"
@@ -25,16 +31,29 @@ __maintainer__ = "Luca Banzato"
 __email__ = "20005492@studenti.uniupo.it"
 __status__ = "Prototype"
 
+# Instances indexed by attached disk, in the form {(<zone_name>, <disk_device_name>): <instance>},
+# and by public IP, in the form {<ip_address>: <instance>}
+InstancesIndex = collections.namedtuple("InstancesIndex", ["by_disk", "by_ip"])
+
 
 class GCP(MetaManager):
 
+    # Maximum number of zones listed at the same time when the aggregated listing is not available
+    GLOBAL_LISTING_WORKERS = 16
+
     def __init__(self):
         super().__init__()
         self.platform_name = "Google Cloud Platform"
         self.conf = GCPConfManager()
         self.cloned_instances = []
+        # Clients used by the workers listing the zones (libcloud drivers
+        # cannot be shared between threads)
+        self._zone_clients = Queue()
         # self.snapshots = None
         self.connect()
+        # Read the catalogues stored by the previous executions, revalidating them in background
+        for catalogue in (self._images_catalogue(), self._sizes_catalogue(), self._zones_catalogue()):
+            catalogue.warm_up()
 
     # =============================================================================================== #
     #                                Platform-specific client creation                                #
@@ -51,9 +70,63 @@ class GCP(MetaManager):
                   "https://www.googleapis.com/auth/monitoring"  # View and write monitoring data for all of your Google projects
                   ]
         # Trying connection to endpoint
+        self.gcp_client = self._create_client(scopes)
+        self._scopes = scopes
+
+    def _create_client(self, scopes):
+        """
+        Create a new client for the endpoint specified in the configuration file
+
+        Args:
+            scopes (str[]): the authorization scopes
+
+        Returns:
+            GCENodeDriver: the client
+        """
         cls = get_driver(Provider.GCE)
-        self.gcp_client = cls(self.conf.gcp_access_key_id, self.conf.gcp_secret_access_key, scopes=scopes,
-                              project=self.conf.gcp_project, datacenter=self.conf.gcp_datacenter)
+        return cls(self.conf.gcp_access_key_id, self.conf.gcp_secret_access_key, scopes=scopes,
+                   project=self.conf.gcp_project, datacenter=self.conf.gcp_datacenter)
+
+    def _images_catalogue(self):
+        """
+        Return the catalogue of the images available to the project (public images
+        included), shared by all the managers of the process
+
+        Returns:
+            Catalogue: the images catalogue, indexed by image name
+        """
+        return get_catalogue(self.platform_name, self.conf.gcp_project, IMAGES,
+                             loader=lambda: self._create_client(self._scopes).list_images(),
+                             key=lambda image: image.name,
+                             refresh_interval=self.conf.catalogue_refresh_interval,
+                             client=lambda: self.gcp_client)
+
+    def _sizes_catalogue(self):
+        """
+        Return the catalogue of the instance types of the default zone, shared by all the
+        managers of the process and refreshed in background using a dedicated client
+
+        Returns:
+            Catalogue: the instance types catalogue, indexed by instance type name
+        """
+        return get_catalogue(self.platform_name, self.conf.gcp_datacenter, SIZES,
+                             loader=lambda: self._create_client(self._scopes).list_sizes(),
+                             key=lambda instance_type: instance_type.name,
+                             refresh_interval=self.conf.catalogue_refresh_interval,
+                             client=lambda: self.gcp_client)
+
+    def _zones_catalogue(self):
+        """
+        Return the catalogue of the zones, shared by all the managers of the process
+
+        Returns:
+            Catalogue: the zones catalogue, indexed by zone name
+        """
+        return get_catalogue(self.platform_name, self.conf.gcp_project, ZONES,
+                             loader=lambda: self._create_client(self._scopes).ex_list_zones(),
+                             key=lambda avail_zone: avail_zone.name,
+                             refresh_interval=self.conf.catalogue_refresh_interval,
+                             client=lambda: self.gcp_client)
 
     # =============================================================================================== #
     #                                  Platform-specific list printers                                #
@@ -119,7 +192,7 @@ class GCP(MetaManager):
         Print all available images
         Format: "ID", "Name", Image ID", "State"
         """
-        self.images = self.gcp_client.list_images()
+        self.images = self._images_catalogue().list()
         i = 1
         table_body = []
         for image in self.images:
@@ -133,7 +206,7 @@ class GCP(MetaManager):
         Print all available images
         Format: "ID", "Name", Zone State", "Region Name"
         """
-        self.avail_zones = self.gcp_client.ex_list_zones()
+        self.avail_zones = self._zones_catalogue().list()
         i = 1
         table_body = []
         for avail_zone in self.avail_zones:
@@ -146,7 +219,7 @@ class GCP(MetaManager):
         Print all instance types
         Format: "ID", "Instance Type ID", "vCPUs", "Ram (GB)", "Disk (GB)"
         """
-        self.instance_types = self.gcp_client.list_sizes()
+        self.instance_types = self._sizes_catalogue().list()
         if self.conf.alwaysfree_only:
             filtered_instance_types = []
             for instance_type in self.instance_types:
@@ -176,7 +249,7 @@ class GCP(MetaManager):
         Print id and other useful informations of all networks available
         Format: "ID", "Network name", "Description"
         """
-        self.networks = self.gcp_client.ex_list_networks()
+        self.networks = self._cached(NETWORKS, self.gcp_client.ex_list_networks)
         i = 1
         table_body = []
         for network in self.networks:
@@ -211,7 +284,7 @@ class GCP(MetaManager):
         Print instance id, image id, IP address and state for each active instance
         Format: "ID", "Instance Name", "Instance ID", "IP address", "Status", "Key Name", "Avail. Zone"
         """
-        self.instances = self.gcp_client.list_nodes()
+        self.instances = self._cached(INSTANCES, self.gcp_client.list_nodes)
         i = 1
         table_body = []
         for instance in self.instances:
@@ -227,7 +300,8 @@ class GCP(MetaManager):
         Print volumes alongside informations regarding attachments
         Format: "Volume ID", "Creation", "Size (GB)", "Attached To", "Status", "Avail. Zone"
         """
-        self.volumes = self.gcp_client.list_volumes()
+        self.volumes = self._cached(VOLUMES, self.gcp_client.list_volumes)
+        instances_index = self._build_instances_index()
         i = 1
         table_body = []
         for volume in self.volumes:
@@ -237,7 +311,7 @@ class GCP(MetaManager):
             timestamp_tz_fix = re.sub(r'([-+]\d{2}):(\d{2})(?:(\d{2}))?$', r'\1\2\3', created_at_timestamp)
             created_at_datetime = datetime.datetime.strptime(timestamp_tz_fix, "%Y-%m-%dT%H:%M:%S.%f%z")
             created_at = created_at_datetime.astimezone(pytz.utc).strftime("%b %d %Y, %H:%M:%S") + " UTC"
-            instance = self._get_instance_from_volume(volume)
+            instance = self._get_instance_from_volume(volume, instances_index)
             if instance is not None:
                 table_body.append([i, volume.name, volume.id, created_at, volume.size,
                                    instance.name, volume.extra["status"], volume.extra["zone"].name])
@@ -252,11 +326,12 @@ class GCP(MetaManager):
         Print ip and other useful information of all floating ip available
         Format: "ID", "Public Ip", "Floating IP ID", "Associated Instance", "Region"
         """
-        self.floating_ips = self.gcp_client.ex_list_addresses()
+        self.floating_ips = self._cached(FLOATING_IPS, self.gcp_client.ex_list_addresses)
+        instances_index = self._build_instances_index()
         i = 1
         table_body = []
         for floating_ip in self.floating_ips:
-            instance = self._get_instance_from_floating_ip(floating_ip)
+            instance = self._get_instance_from_floating_ip(floating_ip, instances_index)
             if instance is not None:
                 table_body.append([i, floating_ip.address, floating_ip.id, instance.name, floating_ip.region.name])
             else:
@@ -298,10 +373,7 @@ class GCP(MetaManager):
         Print instance id, image id, IP address and state for all the instances in all the zones
         Format: "ID", "Instance Name", "Instance ID", "IP address", "Status", "Key Name", "Avail. Zone"
         """
-        self.global_instances = []
-        zones = self.gcp_client.ex_list_zones()
-        for zone in zones:
-            self.global_instances += self.gcp_client.list_nodes(ex_zone=zone)
+        self.global_instances = self._list_in_all_zones("list_nodes")
         i = 1
         table_body = []
         for instance in self.global_instances:
@@ -317,10 +389,8 @@ class GCP(MetaManager):
         Print volumes alongside informations regarding attachments for all the volumes in all the zones
         Format: "Volume ID", "Creation", "Size (GB)", "Attached To", "Status", "Avail. Zone"
         """
-        self.global_volumes = []
-        zones = self.gcp_client.ex_list_zones()
-        for zone in zones:
-            self.global_volumes += self.gcp_client.list_volumes(ex_zone=zone)
+        self.global_volumes = self._list_in_all_zones("list_volumes")
+        instances_index = self._build_instances_index()
         i = 1
         table_body = []
         for volume in self.global_volumes:
@@ -330,7 +400,7 @@ class GCP(MetaManager):
             timestamp_tz_fix = re.sub(r'([-+]\d{2}):(\d{2})(?:(\d{2}))?$', r'\1\2\3', created_at_timestamp)
             created_at_datetime = datetime.datetime.strptime(timestamp_tz_fix, "%Y-%m-%dT%H:%M:%S.%f%z")
             created_at = created_at_datetime.astimezone(pytz.utc).strftime("%b %d %Y, %H:%M:%S") + " UTC"
-            instance = self._get_instance_from_volume(volume)
+            instance = self._get_instance_from_volume(volume, instances_index)
             if instance is not None:
                 table_body.append([i, volume.name, volume.id, created_at, volume.size,
                                    instance.name, volume.extra["status"], volume.extra["zone"].name])
@@ -346,10 +416,11 @@ class GCP(MetaManager):
         Format: "ID", "Public Ip", "Floating IP ID", "Associated Instance", "Region"
         """
         self.global_floating_ips = self.gcp_client.ex_list_addresses(region="all")
+        instances_index = self._build_instances_index()
         i = 1
         table_body = []
         for floating_ip in self.global_floating_ips:
-            instance = self._get_instance_from_floating_ip(floating_ip)
+            instance = self._get_instance_from_floating_ip(floating_ip, instances_index)
             if instance is not None:
                 table_body.append([i, floating_ip.address, floating_ip.id, instance.name, floating_ip.region.name])
             else:
@@ -458,15 +529,25 @@ class GCP(MetaManager):
             return
         result = self.gcp_client.detach_volume(volume, instance)
         if result:
-            while True:
-                # No direct way to refresh a Volume status, so we look if
-                # it is still attached to its previous instance
-                updated_volume = self.gcp_client.ex_get_volume(volume.name)
-                if not self._platform_is_volume_attached(updated_volume):
-                    break
-                time.sleep(3)
+            result = len(self._wait_for_volumes_detached([volume])) == 0
         return result
 
+    def _wait_for_volumes_detached(self, volumes):
+        """
+        Wait until some volumes are detached from their instances, checking
+        only the users of each pending volume
+
+        Args:
+            volumes (<volume>[]): The volumes being detached
+
+        Returns:
+            <volume>[]: The volumes still attached once the timeout is expired
+        """
+        def probe(pending):
+            return [volume for volume in pending
+                    if len(self.gcp_client.ex_get_volume(volume.name, volume.extra["zone"]).extra.get("users", [])) > 0]
+        return wait_until_all(probe, volumes, self.conf.wait_timeout, description="volumes detach")
+
     def _platform_delete_volume(self, volume):
         """
         Delete a volume using the Google Cloud Platform API
@@ -716,16 +797,93 @@ class GCP(MetaManager):
                                                        name=nic["accessConfigs"][0]["name"],
                                                        nic=nic["name"])
 
-    def _get_instance_from_volume(self, volume):
+    def _list_in_all_zones(self, list_method):
+        """
+        Return the resources of all the zones using the aggregated listing of the
+        Compute Engine API (a single request). If it fails, the zones are listed in
+        parallel (up to GLOBAL_LISTING_WORKERS at a time), skipping the ones that
+        cannot be listed
+
+        Args:
+            list_method (str): the name of a client method accepting the ex_zone parameter
+                               (e.g. "list_nodes", "list_volumes")
+
+        Returns:
+            object[]: the resources of all the zones
+        """
+        try:
+            return getattr(self.gcp_client, list_method)(ex_zone="all")
+        except Exception as e:
+            logging.warning("Aggregated " + list_method + " failed, listing zone by zone: " + str(e))
+        zones = self.gcp_client.ex_list_zones()
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(self.GLOBAL_LISTING_WORKERS, len(zones)))) as executor:
+            futures = {executor.submit(self._list_in_zone, list_method, zone): zone for zone in zones}
+            for future in as_completed(futures):
+                zone = futures[future]
+                try:
+                    results[zone.name] = future.result()
+                except Exception as e:
+                    logging.error("Unable to list the " + zone.name + " zone (" + list_method + "): " + str(e))
+        # Keep the zones order
+        resources = []
+        for zone in zones:
+            resources += results.get(zone.name, [])
+        return resources
+
+    def _list_in_zone(self, list_method, zone):
+        """
+        List the resources of a zone using a client reserved to the current thread
+
+        Args:
+            list_method (str): the name of a client method accepting the ex_zone parameter
+            zone (GCEZone): the zone
+
+        Returns:
+            object[]: the resources of the zone
+        """
+        try:
+            client = self._zone_clients.get_nowait()
+        except Empty:
+            client = self._create_client(self._scopes)
+        try:
+            return getattr(client, list_method)(ex_zone=zone)
+        finally:
+            self._zone_clients.put(client)
+
+    def _build_instances_index(self):
+        """
+        Index all the instances of all the zones (fetched with a single request)
+        by attached disk and by public IP, so that a listing can find the instance
+        of each volume or floating IP without further requests
+
+        Returns:
+            InstancesIndex: the instances index
+        """
+        by_disk = {}
+        by_ip = {}
+        for instance in self.gcp_client.list_nodes(ex_zone="all"):
+            for disk in instance.extra["disks"]:
+                by_disk.setdefault((instance.extra["zone"].name, disk["deviceName"]), instance)
+            if len(instance.public_ips) > 0 and None not in instance.public_ips:
+                by_ip.setdefault(instance.public_ips[0], instance)
+        return InstancesIndex(by_disk=by_disk, by_ip=by_ip)
+
+    def _get_instance_from_volume(self, volume, instances_index=None):
         """
         Return the instance to which the volume is attached
 
         Args:
             volume (StorageVolume): the volume attached to an instance
+            instances_index (InstancesIndex): an index built with _build_instances_index
+                                              (if not provided, the instances of the volume
+                                              zone are fetched)
 
         Returns:
             Node: an instance, or None if no instances are found
         """
+        if instances_index is not None:
+            return instances_index.by_disk.get((volume.extra["zone"].name, volume.name))
         for instance in self.gcp_client.list_nodes(ex_zone=volume.extra["zone"]):
             disks = instance.extra["disks"]
             if len(disks) > 0:
@@ -734,16 +892,20 @@ class GCP(MetaManager):
                         return instance
         return None
 
-    def _get_instance_from_floating_ip(self, floating_ip):
+    def _get_instance_from_floating_ip(self, floating_ip, instances_index=None):
         """
         Return the instance to which the floating IP is attached
 
         Args:
             floating_ip (GCEAddress): the floating IP attached to an instance
+            instances_index (InstancesIndex): an index built with _build_instances_index
+                                              (if not provided, all the instances are fetched)
 
         Returns:
             Node: an instance, or None if no instances are found
         """
+        if instances_index is not None:
+            return instances_index.by_ip.get(floating_ip.address)
         for instance in self.gcp_client.list_nodes(ex_zone="all"):
             if len(instance.public_ips) > 0 and None not in instance.public_ips:
                 if instance.public_ips[0] == floating_ip.address:
@@ -806,6 +968,7 @@ class GCP(MetaManager):
             SimpleTUI.msg_dialog("Static Floating IP Promotion", "Floating IP promoted!", SimpleTUI.DIALOG_SUCCESS)
         else:
             SimpleTUI.msg_dialog("Static Floating IP Promotion", "There was an error while promoting this Floating IP!", SimpleTUI.DIALOG_ERROR)
+        self.inventory.invalidate(FLOATING_IPS)
 
     def _promote_ephimeral_ip_to_static(self, floating_ip, address_name):
         """
@@ -920,9 +1083,12 @@ class GCP(MetaManager):
         """
         Clone instance
         """
-        GCPAgentActions.clone_instance(self, instance_id)
+        try:
+            return GCPAgentActions.clone_instance(self, instance_id)
+        finally:
+            self.inventory.invalidate(INSTANCES, VOLUMES)
 
-    @bind_action("GCPCloud", "alarm")
+    @bind_action("GCP", "alarm")
     def alarm(self, resource_id):
         """
         Trigger an alarm
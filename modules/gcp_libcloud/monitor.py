@@ -2,6 +2,7 @@
 Google Cloud monitor implementation (using StackDriver API)
 """
 
+import collections
 import datetime
 import logging
 import time
@@ -46,6 +47,11 @@ class GCPMonitor(MetaMonitor):
         # No metric available for memory_used
         # self._bind_generic_metric_to_getter(name="memory_used", function=self._get_memory_used_measures)
         #
+        # Association between generic metric name and StackDriver metric type,
+        # used by the batch getter
+        self._batch_metrics = {"cpu_load": "compute.googleapis.com/instance/cpu/utilization"}
+        # Metric units cache (metric type -> unit), units never change during the life of the monitor
+        self._metric_units = {}
         logging.debug("[GCP MONITOR GETTERS]: " + str(self._metrics_getters))
 
     def connect(self):
@@ -78,25 +84,16 @@ class GCPMonitor(MetaMonitor):
         Returns:
             dict: A structure containing all the measurements for a metric
         """
-        logging.debug("Fetching metric \"" + metric + "\" with granularity=" + str(granularity) + " and limit=" + str(limit))
+        logging.debug("Fetching metric \"%s\" with granularity=%s and limit=%s", metric, granularity, limit)
         # Get the project full path
         project_name = self.stackdriver_client.project_path(self.conf.gcp_project)
-        # Define time interval for retrieving metrics
-        interval = monitoring_v3.types.TimeInterval()
-        # now is a UNIX timestamp (60 seconds are equal to 100 units)
-        # The latest measurements are 5 minutes back in time, so we add a -500 ms in order to cover this delay
-        now = time.time()
-        interval.start_time.seconds = int(now - (((granularity / 0.6) * limit)) + (granularity / 0.6) * 2 - 500)
-        interval.end_time.seconds = int(now)
-        # Set the aggregation level
-        aggregation = monitoring_v3.types.Aggregation()
-        aggregation.alignment_period.seconds = granularity
-        aggregation.per_series_aligner = (monitoring_v3.enums.Aggregation.Aligner.ALIGN_MEAN)
+        interval = self._get_time_interval(granularity, limit)
+        aggregation = self._get_aggregation(granularity)
 
         _samples = []
 
         try:
-            logging.debug("Instance ID: " + str(instance_id))
+            logging.debug("Instance ID: %s", instance_id)
             results = self.stackdriver_client.list_time_series(project_name,
                                                                "metric.type = \"" + metric + "\" AND " +
                                                                "metric.label.instance_name = \"" + instance_id + "\"",  # FILTRO ()
@@ -112,24 +109,120 @@ class GCPMonitor(MetaMonitor):
             # Extract the most recent limit-values
             _measurements_values = _random_measurements_values[-limit:]
             # Get the metric unit
-            _metric_unit = "n/a"
-            for page in self.stackdriver_client.list_metric_descriptors(project_name,
-                                                                        filter_="metric.type = \"" + metric + "\"").pages:
-                for element in page:
-                    _metric_unit = element.unit
-                    break
+            _metric_unit = self._get_metric_unit(project_name, metric)
             # Add the measurements to the list that will be returned
             for _value in _measurements_values:
                 _samples.append(self._build_message(timestamp=_value.interval.start_time.seconds,
                                                     value=_value.value.double_value,
                                                     unit=_metric_unit))
-            logging.debug("MEASUREMENTS: " + str(_samples))
+            logging.debug("MEASUREMENTS: %s", _samples)
         except Exception as _exception:
             _samples.append(self._error_sample(_exception))
             raise _exception
 
         return _samples
 
+    def _get_batch_samples(self, instance_ids, metric_names, limit, granularity):
+        """
+        StackDriver batch measurements getter. A single request is issued for each metric type,
+        then the time series returned are grouped by instance name
+
+        Args:
+            instance_ids (str[]): The ids of the instances to fetch the measurements
+            metric_names (str[]): The *generic* metrics names
+            limit (int): The maximum number of measurements returned for each metric
+            granularity (int): The granularity of the measurements fetched, expressed in seconds
+
+        Returns:
+            dict: A structure in the form {<instance_id>: {<metric_name>: [<measurement>, ...]}}
+        """
+        project_name = self.stackdriver_client.project_path(self.conf.gcp_project)
+        interval = self._get_time_interval(granularity, limit)
+        aggregation = self._get_aggregation(granularity)
+        _samples = collections.defaultdict(dict)
+        for _metric_name in metric_names:
+            if _metric_name not in self._batch_metrics:
+                continue
+            metric = self._batch_metrics[_metric_name]
+            logging.debug("Fetching metric \"" + metric + "\" for all the instances with granularity=" +
+                          str(granularity) + " and limit=" + str(limit))
+            results = self.stackdriver_client.list_time_series(project_name,
+                                                               "metric.type = \"" + metric + "\"",
+                                                               interval,
+                                                               monitoring_v3.enums.ListTimeSeriesRequest.TimeSeriesView.FULL,
+                                                               aggregation)
+            # Group the points by instance name
+            _instances_points = collections.defaultdict(list)
+            for result in results:
+                _instances_points[result.metric.labels["instance_name"]] += result.points
+            _metric_unit = self._get_metric_unit(project_name, metric)
+            for instance_id in instance_ids:
+                # Sort all the data (data can be unordered) and extract the most recent limit-values
+                _measurements_values = sorted(_instances_points[instance_id],
+                                              key=lambda x: x.interval.start_time.seconds)[-limit:]
+                _samples[instance_id][_metric_name] = [self._build_message(timestamp=_value.interval.start_time.seconds,
+                                                                           value=_value.value.double_value,
+                                                                           unit=_metric_unit)
+                                                       for _value in _measurements_values]
+        return _samples
+
+    def _get_time_interval(self, granularity, limit):
+        """
+        Return the time interval to use for retrieving the measurements
+
+        Args:
+            granularity (int): The granularity of the measurements fetched, expressed in seconds
+            limit (int): The maximum number of measurements returned
+
+        Returns:
+            TimeInterval: the time interval
+        """
+        # Define time interval for retrieving metrics
+        interval = monitoring_v3.types.TimeInterval()
+        # now is a UNIX timestamp (60 seconds are equal to 100 units)
+        # The latest measurements are 5 minutes back in time, so we add a -500 ms in order to cover this delay
+        now = time.time()
+        interval.start_time.seconds = int(now - (((granularity / 0.6) * limit)) + (granularity / 0.6) * 2 - 500)
+        interval.end_time.seconds = int(now)
+        return interval
+
+    def _get_aggregation(self, granularity):
+        """
+        Return the aggregation level to use for retrieving the measurements
+
+        Args:
+            granularity (int): The granularity of the measurements fetched, expressed in seconds
+
+        Returns:
+            Aggregation: the aggregation level
+        """
+        aggregation = monitoring_v3.types.Aggregation()
+        aggregation.alignment_period.seconds = granularity
+        aggregation.per_series_aligner = (monitoring_v3.enums.Aggregation.Aligner.ALIGN_MEAN)
+        return aggregation
+
+    def _get_metric_unit(self, project_name, metric):
+        """
+        Return the unit of a metric. The unit is requested only the first time,
+        then it's read from the cache
+
+        Args:
+            project_name (str): The project full path
+            metric (str): The *specific* metric name
+
+        Returns:
+            str: The metric unit ("n/a" if unknown)
+        """
+        if metric not in self._metric_units:
+            _metric_unit = "n/a"
+            for page in self.stackdriver_client.list_metric_descriptors(project_name,
+                                                                        filter_="metric.type = \"" + metric + "\"").pages:
+                for element in page:
+                    _metric_unit = element.unit
+                    break
+            self._metric_units[metric] = _metric_unit
+        return self._metric_units[metric]
+
     # Please visit https://cloud.google.com/monitoring/api/metrics_gcp
     # in order to get the specific metric name for a generic metric
     # (e.g. cpu_load -> compute.googleapis.com/instance/cpu/utilization)